@@ -0,0 +1,195 @@
+# -*- coding: UTF-8 -*-
+"""Measures how much terminal output the editor causes.
+
+Over a slow connection the time to redraw is mostly the time to send the
+escape sequences, so this draws a widget on a fake terminal, and records
+the bytes written and the screen cells that changed for each keypress,
+scroll and resize.
+
+Run it from the top of the source tree::
+
+    python -m benchmarks.screenbench [file]
+
+or from code::
+
+    bench = ScreenBenchmark(LineNosWidget(editor), size=(80, 24))
+    bench.draw()
+    bench.keypress('x')
+    bench.resize(100, 30)
+    print(bench.report())
+"""
+import io
+import sys
+
+from collections import namedtuple
+
+from urwid import raw_display
+
+from doctrine import code
+from doctrine.urwid import EditorConfig, LineNosWidget, TextEditor
+
+# What one step of a benchmark sent to the terminal
+Step = namedtuple('Step', 'name bytes cells rows')
+
+
+class FakeScreen(raw_display.Screen):
+    """A urwid raw_display Screen that writes to a buffer.
+
+    The escape sequences are the same as on a real terminal, including
+    only redrawing the rows that changed, but no terminal is needed.
+
+    :param size: The (columns, rows) of the terminal
+    :param encoding: The encoding the output is measured in
+    """
+
+    def __init__(self, size=(80, 24), encoding='utf-8'):
+        self.size = size
+        self.encoding = encoding
+        self.output = io.StringIO()
+        raw_display.Screen.__init__(self, input=io.StringIO(),
+                                    output=self.output)
+
+    def _start(self, *args, **kwargs):
+        pass
+
+    def _stop(self):
+        pass
+
+    def get_cols_rows(self):
+        return self.size
+
+    def take_output(self):
+        """Return what was written since the last call, and forget it."""
+        data = self.output.getvalue()
+        self.output.seek(0)
+        self.output.truncate()
+        return data
+
+
+def canvas_cells(canvas, encoding='utf-8'):
+    """Return the (attr, character) of each screen cell, row by row."""
+    rows = []
+    for row in canvas.content():
+        cells = []
+        for attr, cs, text in row:
+            if isinstance(text, bytes):
+                text = text.decode(encoding, 'replace')
+            cells.extend((attr, char) for char in text)
+        rows.append(cells)
+    return rows
+
+
+def changed_cells(old, new):
+    """Return the number of cells and rows that differ between two screens."""
+    cells = rows = 0
+    for pos in range(max(len(old), len(new))):
+        old_row = old[pos] if pos < len(old) else []
+        new_row = new[pos] if pos < len(new) else []
+        if old_row == new_row:
+            continue
+        rows += 1
+        cells += abs(len(old_row) - len(new_row))
+        for old_cell, new_cell in zip(old_row, new_row):
+            if old_cell != new_cell:
+                cells += 1
+    return cells, rows
+
+
+class ScreenBenchmark(object):
+    """Draws a widget on a FakeScreen, and records what each step sends.
+
+    Each step is a :data:`Step` in the steps list, with the bytes written
+    to the terminal, and how many cells and rows of the screen changed.
+
+    :param widget: The box widget to draw, like a TextEditor or a
+                   LineNosWidget wrapping one
+    :param size: The (columns, rows) of the terminal
+    :param palette: A urwid palette to register on the screen
+    """
+
+    def __init__(self, widget, size=(80, 24), palette=(), encoding='utf-8'):
+        self.widget = widget
+        self.screen = FakeScreen(size, encoding)
+        self.screen.register_palette(list(palette))
+        self.screen.start()
+        self.steps = []
+        self._cells = []
+
+    @property
+    def size(self):
+        return self.screen.size
+
+    def draw(self, name='draw'):
+        """Render the widget and draw it, recording the output as a step."""
+        size = self.size
+        canvas = self.widget.render(size, focus=True)
+        self.screen.draw_screen(size, canvas)
+        data = self.screen.take_output()
+        cells = canvas_cells(canvas, self.screen.encoding)
+        changed, rows = changed_cells(self._cells, cells)
+        self._cells = cells
+        step = Step(name, len(data.encode(self.screen.encoding)), changed,
+                    rows)
+        self.steps.append(step)
+        return step
+
+    def keypress(self, key):
+        """Send a key to the widget, and draw it."""
+        self.widget.keypress(self.size, key)
+        return self.draw(key)
+
+    def resize(self, cols, rows):
+        """Change the size of the terminal, and draw the widget."""
+        self.screen.size = (cols, rows)
+        return self.draw('resize %ix%i' % (cols, rows))
+
+    def close(self):
+        """Stop the screen."""
+        self.screen.stop()
+
+    def totals(self):
+        """Return a Step with the sums of all steps."""
+        return Step('total', sum(step.bytes for step in self.steps),
+                    sum(step.cells for step in self.steps),
+                    sum(step.rows for step in self.steps))
+
+    def report(self):
+        """Return the steps as a table."""
+        lines = ['%-20s %10s %8s %6s' % ('step', 'bytes', 'cells', 'rows')]
+        for step in self.steps + [self.totals()]:
+            lines.append('%-20s %10i %8i %6i' % step)
+        return '\n'.join(lines)
+
+
+def run(widget, size=(80, 24)):
+    """Run the standard steps on a widget, and return the benchmark."""
+    bench = ScreenBenchmark(widget, size)
+    bench.draw('first draw')
+    for key in 'hello':
+        bench.keypress(key)
+    for key in ['right', 'down', 'down', 'end', 'enter', 'backspace']:
+        bench.keypress(key)
+    for key in ['page down', 'page down', 'page up', 'down', 'up']:
+        bench.keypress(key)
+    bench.resize(size[0] + 20, size[1] + 6)
+    bench.resize(*size)
+    return bench
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        with io.open(argv[0], encoding='utf-8', newline='') as f:
+            codeob = code.Code(f)
+    else:
+        codeob = code.Code(io.StringIO(u''.join(
+            u'    line %i of the benchmark text\n' % row
+            for row in range(1000))))
+    editor = TextEditor(codeob, EditorConfig())
+    bench = run(LineNosWidget(editor))
+    print(bench.report())
+    bench.close()
+
+
+if __name__ == '__main__':
+    main()
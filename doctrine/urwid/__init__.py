@@ -1,4 +1,13 @@
 # -*- coding: UTF-8 -*-
 from doctrine.urwid.widgets import (LineNoWidget, LineNosWidget, LineWalker,
-                                    EditorConfig, TextEditor, ERASE_LEFT, ERASE_RIGHT)
+                                    EditorConfig, TextEditor, ERASE_LEFT, ERASE_RIGHT,
+                                    CUT, COPY, PASTE, ADD_CURSOR_NEXT_MATCH,
+                                    ADD_CURSOR_ABOVE, ADD_CURSOR_BELOW,
+                                    WORD_LEFT, WORD_RIGHT, ERASE_WORD_LEFT,
+                                    ERASE_WORD_RIGHT)
 from doctrine.urwid.layout import CodeLayout
+from doctrine.urwid.selection import Selection, Cursors
+from doctrine.urwid.document import Document
+from doctrine.urwid.autosave import Autosave
+from doctrine.urwid.minimap import MinimapWidget
+from doctrine.urwid.scrollbar import ScrollbarWidget
@@ -0,0 +1,184 @@
+# -*- coding: UTF-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+
+from urwid.compat import bytes
+
+# How many lines are encoded and written at a time
+CHUNK_LINES = 1000
+
+
+class DirtyLines(object):
+    """The ranges of lines that changed since the code was last saved.
+
+    Each range is a (start, end) tuple of line numbers, with end excluded.
+    The ranges are kept sorted, and move as lines are inserted or removed,
+    so they always refer to the current lines. Removed lines leave an
+    empty range where they were.
+
+    The ranges are changed on the UI thread, and cleared by the thread
+    saving the code, so that is done under a lock.
+    """
+
+    def __init__(self):
+        self.ranges = []
+        # Bumped on every change, so a save can tell if it is out of date.
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.ranges)
+    __nonzero__ = __bool__
+
+    def mark(self, row, removed, added):
+        """Mark that lines starting at row were replaced.
+
+        :param row: The first line that changed
+        :param removed: How many lines were replaced
+        :param added: How many lines replaced them
+        """
+        delta = added - removed
+        start = row
+        end = row + added
+        ranges = []
+        with self._lock:
+            for r_start, r_end in self.ranges:
+                if r_end < row:
+                    ranges.append((r_start, r_end))
+                elif r_start > row + removed:
+                    ranges.append((r_start + delta, r_end + delta))
+                else:
+                    # Touches the replaced lines, merge them
+                    start = min(start, r_start)
+                    if r_end > row + removed:
+                        end = max(end, r_end + delta)
+            ranges.append((start, end))
+            ranges.sort()
+            self.ranges = ranges
+            self.version += 1
+
+    def clear(self, version=None):
+        """Mark everything as saved.
+
+        If a version is passed, nothing is cleared if there were changes
+        after that version.
+        """
+        with self._lock:
+            if version is None or version == self.version:
+                self.ranges = []
+                return True
+            return False
+
+
+class Autosave(object):
+    """Saves the code of a TextEditor to a file in the background.
+
+    :param editor: The editor to save
+    :type editor: doctrine.urwid.TextEditor
+    :param path: The file to save to
+    :param interval: How often to check for changes, in seconds
+    :param encoding: The encoding of the file, if the code is unicode
+    :param on_error: Called with the exception when a save fails. It is
+                     called from the worker thread, so it must not change
+                     widgets directly, use MainLoop.watch_pipe() for that.
+
+    Call :meth:`start` with the urwid event loop to save periodically.
+    Checking an unchanged editor costs nothing. When it has changed, a
+    snapshot of the list of lines is taken, which is fast as the lines
+    themselves are not copied, and a worker thread writes it to a
+    temporary file that then atomically replaces the file.
+
+    The whole file is written on every save, and not just the changed
+    lines, as that is what makes the replace atomic. The dirty ranges
+    only tell if there is anything to save.
+    """
+
+    def __init__(self, editor, path, interval=5.0, encoding='utf-8',
+                 on_error=None):
+        self.editor = editor
+        self.path = os.path.abspath(path)
+        self.interval = interval
+        self.encoding = encoding
+        self.event_loop = None
+        self.saves = 0
+        self.error = None
+        self.on_error = on_error
+        self._alarm = None
+        self._thread = None
+
+    def start(self, event_loop):
+        """Start saving the editor every interval seconds."""
+        self.stop()
+        self.event_loop = event_loop
+        self._schedule()
+
+    def stop(self):
+        """Stop saving periodically. A running save is completed."""
+        if self._alarm is not None:
+            self.event_loop.remove_alarm(self._alarm)
+            self._alarm = None
+
+    def _schedule(self):
+        self._alarm = self.event_loop.alarm(self.interval, self._tick)
+
+    def _tick(self):
+        self._alarm = None
+        self.save()
+        self._schedule()
+
+    def saving(self):
+        """Return True if a save is in progress."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def save(self):
+        """Start saving the editor, if it has unsaved changes.
+
+        Nothing is done if a save is already in progress, the changes
+        are saved the next time instead. Returns True if a save started.
+        """
+        dirty = self.editor.dirty
+        if not dirty or self.saving():
+            return False
+        lines = list(self.editor.body.code.lines)
+        self._thread = threading.Thread(target=self._write,
+                                        args=(lines, dirty.version))
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def wait(self, timeout=None):
+        """Wait for a save in progress to finish."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _write(self, lines, version):
+        directory, name = os.path.split(self.path)
+        tmp_path = None
+        try:
+            handle, tmp_path = tempfile.mkstemp(
+                dir=directory, prefix='.' + name + '.', suffix='.tmp')
+            with os.fdopen(handle, 'wb') as f:
+                for start in range(0, len(lines), CHUNK_LINES):
+                    chunk = lines[start:start + CHUNK_LINES]
+                    data = chunk[0][:0].join(chunk)
+                    if not isinstance(data, bytes):
+                        data = data.encode(self.encoding)
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(self.path):
+                shutil.copymode(self.path, tmp_path)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            self.error = e
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            if self.on_error is not None:
+                self.on_error(e)
+            return
+        self.error = None
+        self.saves += 1
+        # Changes made during the save are saved the next time
+        self.editor.dirty.clear(version)
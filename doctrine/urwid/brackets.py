@@ -0,0 +1,386 @@
+# -*- coding: UTF-8 -*-
+import re
+
+from urwid.compat import bytes
+
+from doctrine.urwid import instrument
+
+BRACKET_RE = re.compile(u'[][(){}]')
+BRACKET_RE_B = re.compile(b'[][(){}]')
+OPENING = u'([{'
+PAIRS = {u'(': u')', u'[': u']', u'{': u'}',
+         u')': u'(', u']': u'[', u'}': u'{'}
+
+
+def combine(first, second):
+    """Combine the (delta, low) summaries of two consecutive texts."""
+    return (first[0] + second[0], min(first[1], first[0] + second[1]))
+
+
+def line_brackets(text):
+    """Return the (col, char) of each bracket in a line, as unicode."""
+    if isinstance(text, bytes):
+        return [(m.start(), m.group().decode('ascii'))
+                for m in BRACKET_RE_B.finditer(text)]
+    return [(m.start(), m.group()) for m in BRACKET_RE.finditer(text)]
+
+
+# Summaries of the bracket sequences seen, lines often repeat them
+_summaries = {}
+SUMMARY_CACHE_SIZE = 4096
+
+
+def line_summary(text):
+    """Return the (delta, low) summary of the brackets of a line.
+
+    Delta is how much deeper the brackets are nested at the end of the
+    line than at the start, and low the least depth reached on the way,
+    relative to the start.
+    """
+    if isinstance(text, bytes):
+        brackets = b''.join(BRACKET_RE_B.findall(text)).decode('ascii')
+    else:
+        brackets = u''.join(BRACKET_RE.findall(text))
+    summary = _summaries.get(brackets)
+    if summary is None:
+        depth = low = 0
+        for char in brackets:
+            if char in OPENING:
+                depth += 1
+            else:
+                depth -= 1
+                if depth < low:
+                    low = depth
+        summary = depth, low
+        if len(_summaries) >= SUMMARY_CACHE_SIZE:
+            _summaries.clear()
+        _summaries[brackets] = summary
+    return summary
+
+
+class BracketIndex(object):
+    """Finds the partners of brackets in a Code object.
+
+    Each line is summarized by how it changes the bracket depth, and the
+    summaries are kept in chunks of lines, with a segment tree over the
+    chunks. A partner is found by scanning the chunk of the bracket, and
+    then searching the tree for the chunk the depth gets back to zero in,
+    so it takes the same time however far away the partner is.
+
+    The summaries are only calculated when a search needs them, and
+    :meth:`update_lines` forgets the summaries of changed lines.
+
+    Brackets in strings and comments are counted like any other.
+
+    :param code: The code object to match brackets in
+    :type code: doctrine.code.Code
+    """
+
+    chunk_size = 64
+
+    def __init__(self, code):
+        self.code = code
+        self._chunks = None
+
+    def _build(self, chunks):
+        self._chunks = chunks
+        size = 1
+        while size < len(chunks):
+            size *= 2
+        self._size = size
+        self._count = [0] * (2 * size)
+        self._sum = [None] * (2 * size)
+        for index, chunk in enumerate(chunks):
+            self._count[size + index] = len(chunk)
+        for index in range(size + len(chunks), 2 * size):
+            self._sum[index] = (0, 0)
+        for index in range(size - 1, 0, -1):
+            self._count[index] = (self._count[2 * index] +
+                                  self._count[2 * index + 1])
+
+    def _ensure_built(self):
+        if self._chunks is None:
+            lines = len(self.code)
+            size = self.chunk_size
+            self._build([[None] * min(size, lines - start)
+                         for start in range(0, lines, size)] or [[]])
+
+    def _locate(self, row):
+        """Return the chunk a line is in, and the offset in the chunk."""
+        index = 1
+        while index < self._size:
+            left = 2 * index
+            if row < self._count[left]:
+                index = left
+            else:
+                row -= self._count[left]
+                index = left + 1
+        chunk = index - self._size
+        if chunk >= len(self._chunks):
+            # Past the end
+            chunk = len(self._chunks) - 1
+            row += len(self._chunks[chunk])
+        return chunk, row
+
+    def _chunk_start(self, chunk):
+        """Return the line number of the first line of a chunk."""
+        start = 0
+        index = chunk + self._size
+        while index > 1:
+            if index & 1:
+                start += self._count[index - 1]
+            index //= 2
+        return start
+
+    def _changed(self, chunk):
+        """Forget the summaries of a chunk and its parents."""
+        index = chunk + self._size
+        count = len(self._chunks[chunk])
+        while index:
+            self._sum[index] = None
+            if index >= self._size:
+                self._count[index] = count
+            else:
+                self._count[index] = (self._count[2 * index] +
+                                      self._count[2 * index + 1])
+            index //= 2
+
+    def _summary(self, chunk, offset, start):
+        """Return the summary of a line in a chunk starting at line start."""
+        summaries = self._chunks[chunk]
+        summary = summaries[offset]
+        if summary is None:
+            if instrument.enabled:
+                instrument.miss('brackets.lines')
+            summary = line_summary(self.code[start + offset])
+            summaries[offset] = summary
+        return summary
+
+    def _chunk_value(self, chunk):
+        """Summarize all lines of a chunk, and return their combination."""
+        summaries = self._chunks[chunk]
+        if None in summaries:
+            start = self._chunk_start(chunk)
+            code = self.code
+            if instrument.enabled:
+                for summary in summaries:
+                    if summary is None:
+                        instrument.miss('brackets.lines')
+            summaries[:] = [summary or line_summary(code[start + offset])
+                            for offset, summary in enumerate(summaries)]
+        depth = low = 0
+        for delta, line_low in summaries:
+            if depth + line_low < low:
+                low = depth + line_low
+            depth += delta
+        return depth, low
+
+    def _value(self, index):
+        """Return the summary of a node of the tree."""
+        value = self._sum[index]
+        if value is None:
+            if index >= self._size:
+                value = self._chunk_value(index - self._size)
+            else:
+                value = combine(self._value(2 * index),
+                                self._value(2 * index + 1))
+            self._sum[index] = value
+        return value
+
+    def update_lines(self, row, removed, added):
+        """Forget the summaries of replaced lines."""
+        if self._chunks is None:
+            return
+        chunk, offset = self._locate(row)
+        chunks = self._chunks
+        if removed == added and offset + removed <= len(chunks[chunk]):
+            chunks[chunk][offset:offset + removed] = [None] * added
+            self._changed(chunk)
+            return
+
+        # Join the chunks the lines are in, and split them up again
+        last, ignore = self._locate(row + removed - 1) if removed else (
+            chunk, offset)
+        lines = []
+        for summaries in chunks[chunk:last + 1]:
+            lines.extend(summaries)
+        lines[offset:offset + removed] = [None] * added
+        size = self.chunk_size
+        if last == chunk and len(lines) <= 2 * size:
+            # Chunks may grow a bit, so the tree is rarely rebuilt
+            pieces = [lines]
+        else:
+            pieces = [lines[start:start + size]
+                      for start in range(0, len(lines), size)]
+            if not pieces:
+                pieces = [[]]
+        if len(pieces) == last + 1 - chunk:
+            chunks[chunk:last + 1] = pieces
+            for index in range(chunk, last + 1):
+                self._changed(index)
+        else:
+            # The chunks moved, the tree is rebuilt
+            chunks[chunk:last + 1] = pieces
+            old_sum = self._sum
+            old_size = self._size
+            self._build(chunks)
+            for index in range(chunk):
+                self._sum[self._size + index] = old_sum[old_size + index]
+            moved = len(pieces) - (last + 1 - chunk)
+            for index in range(chunk + len(pieces), len(chunks)):
+                self._sum[self._size + index] = old_sum[
+                    old_size + index - moved]
+
+    def match(self, row, col):
+        """Return the (row, col) of the partner of the bracket at a position.
+
+        Returns None if there is no bracket there, or it has no partner.
+        """
+        text = self.code[row]
+        char = text[col:col + 1]
+        if isinstance(char, bytes):
+            char = char.decode('ascii', 'replace')
+        if char not in PAIRS:
+            return None
+        self._ensure_built()
+        if char in OPENING:
+            found = self._match_forward(row, col)
+        else:
+            found = self._match_backward(row, col)
+        if found is None:
+            return None
+        partner = self.code[found[0]][found[1]:found[1] + 1]
+        if isinstance(partner, bytes):
+            partner = partner.decode('ascii')
+        if partner != PAIRS[char]:
+            return None
+        return found
+
+    def _scan_forward(self, row, depth, after=-1):
+        for col, char in line_brackets(self.code[row]):
+            if col <= after:
+                continue
+            depth += 1 if char in OPENING else -1
+            if depth == 0:
+                return col
+        return None
+
+    def _scan_backward(self, row, depth, before=None):
+        for col, char in reversed(line_brackets(self.code[row])):
+            if before is not None and col >= before:
+                continue
+            depth += -1 if char in OPENING else 1
+            if depth == 0:
+                return col
+        return None
+
+    def _match_forward(self, row, col):
+        found = self._scan_forward(row, 0, col - 1)
+        if found is not None:
+            return row, found
+        depth = line_summary(self.code[row][col:])[0]
+
+        chunk, offset = self._locate(row)
+        start = row - offset
+        while True:
+            # The rest of the chunk, line by line
+            for offset in range(offset + 1, len(self._chunks[chunk])):
+                delta, low = self._summary(chunk, offset, start)
+                if depth + low <= 0:
+                    return start + offset, self._scan_forward(
+                        start + offset, depth)
+                depth += delta
+            # Then find the chunk the depth gets to zero in
+            chunk, depth = self._find_chunk_forward(chunk, depth)
+            if chunk is None:
+                return None
+            start = self._chunk_start(chunk)
+            offset = -1
+
+    def _match_backward(self, row, col):
+        found = self._scan_backward(row, 0, col + 1)
+        if found is not None:
+            return row, found
+        depth = -line_summary(self.code[row][:col + 1])[0]
+
+        chunk, offset = self._locate(row)
+        start = row - offset
+        while True:
+            for offset in range(offset - 1, -1, -1):
+                delta, low = self._summary(chunk, offset, start)
+                if depth - delta + low <= 0:
+                    return start + offset, self._scan_backward(
+                        start + offset, depth)
+                depth -= delta
+            chunk, depth = self._find_chunk_backward(chunk, depth)
+            if chunk is None:
+                return None
+            start = self._chunk_start(chunk)
+            offset = len(self._chunks[chunk])
+
+    def _find_chunk_forward(self, chunk, depth):
+        """Return the first chunk after chunk that the depth reaches zero
+        in, and the depth at the start of it."""
+        nodes = []
+        right_nodes = []
+        left = chunk + 1 + self._size
+        right = 2 * self._size
+        while left < right:
+            if left & 1:
+                nodes.append(left)
+                left += 1
+            if right & 1:
+                right -= 1
+                right_nodes.append(right)
+            left //= 2
+            right //= 2
+        nodes.extend(reversed(right_nodes))
+        for node in nodes:
+            delta, low = self._value(node)
+            if depth + low > 0:
+                depth += delta
+                continue
+            while node < self._size:
+                delta, low = self._value(2 * node)
+                if depth + low <= 0:
+                    node = 2 * node
+                else:
+                    depth += delta
+                    node = 2 * node + 1
+            return node - self._size, depth
+        return None, depth
+
+    def _find_chunk_backward(self, chunk, depth):
+        """Return the last chunk before chunk that the depth reaches zero
+        in, and the depth at the end of it."""
+        nodes = []
+        left_nodes = []
+        left = self._size
+        right = chunk + self._size
+        while left < right:
+            if left & 1:
+                left_nodes.append(left)
+                left += 1
+            if right & 1:
+                right -= 1
+                nodes.append(right)
+            left //= 2
+            right //= 2
+        nodes.extend(reversed(left_nodes))
+        for node in nodes:
+            delta, low = self._value(node)
+            if depth - delta + low > 0:
+                depth -= delta
+                continue
+            while node < self._size:
+                delta, low = self._value(2 * node + 1)
+                if depth - delta + low <= 0:
+                    node = 2 * node + 1
+                else:
+                    depth -= delta
+                    node = 2 * node
+            return node - self._size, depth
+        return None, depth
+
+
+instrument.get_counter('brackets.lines')
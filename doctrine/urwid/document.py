@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+import weakref
+
+from doctrine.urwid.autosave import DirtyLines
+from doctrine.urwid.layout import CodeLayout
+
+
+class Document(object):
+    """A Code object shown in several editors.
+
+    The editors share the code and the layout, so the layout of a line is
+    only calculated once however many editors show it. Each editor keeps
+    its own focus, cursors and selection.
+
+    :param code: The code object to be edited
+    :type code: doctrine.code.Code
+    :param layout: The layout shared by the editors
+    :param dirty: The changed lines of the code, shared by the editors
+    :type dirty: doctrine.urwid.autosave.DirtyLines
+    """
+
+    def __init__(self, code, layout=None, dirty=None):
+        self.code = code
+        self.layout = layout or CodeLayout()
+        self.dirty = dirty if dirty is not None else DirtyLines()
+        self.walkers = weakref.WeakSet()
+        self.listeners = weakref.WeakSet()
+        # The doctrine.urwid.interning.LineInterner of the code, if any
+        self.interner = None
+
+    def connect(self, walker):
+        """Make a LineWalker show this document."""
+        walker.code = self.code
+        walker.layout = self.layout
+        walker.dirty = self.dirty
+        walker.document = self
+        self.walkers.add(walker)
+
+    def disconnect(self, walker):
+        """Stop telling a LineWalker about changes."""
+        self.walkers.discard(walker)
+        walker.document = None
+
+    def add_listener(self, listener):
+        """Tell an object about every change of the code.
+
+        The listener has an update_lines(row, removed, added) method,
+        that is called after lines are replaced, whichever editor made
+        the change. Only a weak reference to the listener is kept.
+        """
+        self.listeners.add(listener)
+
+    def remove_listener(self, listener):
+        """Stop telling an object about changes."""
+        self.listeners.discard(listener)
+
+    def lines_changed(self, source, row, removed, added, edits=None):
+        """Tell the other walkers and the listeners that lines of the code
+        were replaced.
+
+        :param source: The walker that made the change
+        :param row: The first line that changed
+        :param removed: How many lines were replaced
+        :param added: How many lines replaced them
+        :param edits: The (col, removed, added) change of each row whose
+                      text was replaced within the line, so the other
+                      walkers can move their cursors on it
+        """
+        for walker in list(self.walkers):
+            if walker is not source:
+                walker.update_lines(row, removed, added, edits)
+        for listener in list(self.listeners):
+            listener.update_lines(row, removed, added)
@@ -0,0 +1,118 @@
+# -*- coding: UTF-8 -*-
+from bisect import bisect_left, bisect_right
+
+
+class FoldIndex(object):
+    """The folded ranges of lines of a LineWalker.
+
+    Each fold is a (start, end) range of line numbers, with end excluded.
+    The start line is shown in place of the whole range, the others are
+    hidden. The folds do not overlap, and are kept sorted in two lists of
+    starts and ends, so the fold of a line is found with a binary search.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __bool__(self):
+        return bool(self.starts)
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        return iter(list(zip(self.starts, self.ends)))
+
+    def fold(self, start, end):
+        """Fold the lines from start up to end.
+
+        Folds that overlap the range are merged with it. Returns the
+        (start, end) of the resulting fold, or None if the range has less
+        than two lines.
+        """
+        if end - start < 2:
+            return None
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+        return start, end
+
+    def unfold(self, row):
+        """Remove the fold that row is in. Returns the fold, or None."""
+        index = self._index(row)
+        if index is None:
+            return None
+        return self.starts.pop(index), self.ends.pop(index)
+
+    def clear(self):
+        """Remove all folds."""
+        self.starts = []
+        self.ends = []
+
+    def _index(self, row):
+        index = bisect_right(self.starts, row) - 1
+        if index >= 0 and row < self.ends[index]:
+            return index
+        return None
+
+    def fold_at(self, row):
+        """Return the (start, end) of the fold that row is in, or None."""
+        index = self._index(row)
+        if index is None:
+            return None
+        return self.starts[index], self.ends[index]
+
+    def hidden(self, row):
+        """Return True if row is folded away."""
+        index = self._index(row)
+        return index is not None and row != self.starts[index]
+
+    def hidden_after(self, row):
+        """Return how many lines are folded into row."""
+        index = self._index(row)
+        if index is None or row != self.starts[index]:
+            return 0
+        return self.ends[index] - row - 1
+
+    def next_row(self, row):
+        """Return the first shown row after row."""
+        if self.starts:
+            index = self._index(row)
+            if index is not None:
+                return self.ends[index]
+        return row + 1
+
+    def prev_row(self, row):
+        """Return the first shown row before row."""
+        row -= 1
+        if self.starts:
+            index = self._index(row)
+            if index is not None:
+                return self.starts[index]
+        return row
+
+    def update_lines(self, row, removed, added):
+        """Move the folds after lines of the code were replaced.
+
+        Folds after the replaced lines move with them. Folds that the
+        replaced lines overlap are removed, unless lines were only
+        changed, not added or removed.
+        """
+        delta = added - removed
+        if not delta or not self.starts:
+            return
+        index = bisect_right(self.ends, row)
+        last = index
+        while last < len(self.starts) and self.starts[last] < row + removed:
+            last += 1
+        del self.starts[index:last]
+        del self.ends[index:last]
+        for i in range(index, len(self.starts)):
+            self.starts[i] += delta
+            self.ends[i] += delta
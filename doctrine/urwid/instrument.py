@@ -0,0 +1,288 @@
+# -*- coding: UTF-8 -*-
+"""Opt-in timing and cache counters for the editor hot paths.
+
+Usage::
+
+    from doctrine.urwid import instrument
+    instrument.enable()
+    ...
+    print(instrument.snapshot())
+
+The hot paths register themselves with :func:`probe`. They are only
+wrapped with timing code while instrumentation is enabled, so there
+is no overhead when it is disabled, except the check of
+``instrument.enabled`` around the cache counters.
+
+To find out what happens in a single slow frame, record the nested
+calls of the hot paths with :func:`start_trace`, and load the dumped
+file in a Chrome trace viewer, such as ``chrome://tracing`` or Perfetto.
+"""
+import json
+import os
+import threading
+
+from collections import deque
+from functools import wraps
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # Python 2
+    from time import time as clock
+
+enabled = False
+
+_probes = []
+_counters = {}
+_tracer = None
+
+
+class Counter(object):
+    """The call counts, durations and cache hits of one hot path."""
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def add_time(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def stats(self):
+        """Return the counts as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            'calls': self.calls,
+            'total': self.total,
+            'max': self.max,
+            'mean': self.total / self.calls if self.calls else 0.0,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else None,
+        }
+
+
+class Tracer(object):
+    """Records the calls of the hot paths as nested spans.
+
+    :param capacity: How many spans to keep, older spans are dropped
+    :type capacity: int
+    :param slow_frame: Dump the trace when an outermost span, typically a
+                       keypress or render, takes longer than this many
+                       seconds. None disables the check.
+    :type slow_frame: float
+    :param path: The file to dump the trace to on a slow frame
+    :type path: str
+
+    Only the spans of the last dump_context seconds before a slow frame
+    are dumped, and at most once every dump_interval seconds, so a slow
+    session is not made slower by writing the whole trace again and
+    again. Slow frames in between are only counted.
+    """
+
+    dump_interval = 10.0
+    dump_context = 1.0
+
+    def __init__(self, capacity=100000, slow_frame=None, path=None):
+        self.spans = deque(maxlen=capacity)
+        self.slow_frame = slow_frame
+        self.path = path
+        self.depth = 0
+        self.start = clock()
+        self.slow_frames = 0
+        self.dumps = 0
+        self._last_dump = None
+
+    def add(self, name, start, end, args):
+        """Record a span that ran between two clock() times.
+
+        The span is recorded with the thread it ran in, so call this from
+        that thread.
+        """
+        self.spans.append((name, start, end, args,
+                           threading.current_thread().ident))
+        if (not self.depth and self.slow_frame is not None and
+           end - start > self.slow_frame):
+            self.slow_frames += 1
+            if self.path is not None and (
+               self._last_dump is None or
+               end - self._last_dump >= self.dump_interval):
+                self._last_dump = end
+                self.dump(self.path, since=start - self.dump_context)
+
+    def events(self, since=None):
+        """Return the spans as Chrome trace events.
+
+        :param since: Only return the spans that ended after this clock()
+                      time
+        """
+        pid = os.getpid()
+        events = []
+        spans = self.spans
+        if since is not None:
+            # The spans are added as they end, so the last ones are the
+            # ones that ended after since
+            spans = []
+            for span in reversed(self.spans):
+                if span[2] < since:
+                    break
+                spans.append(span)
+            spans.reverse()
+        for name, start, end, args, tid in spans:
+            event = {
+                'name': name,
+                'cat': name.split('.')[0],
+                'ph': 'X',
+                'ts': (start - self.start) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': pid,
+                'tid': tid,
+            }
+            if args:
+                event['args'] = args
+            events.append(event)
+        return events
+
+    def dump(self, path, since=None):
+        """Write the spans to a file in the Chrome trace JSON format.
+
+        :param since: Only write the spans that ended after this clock()
+                      time
+        """
+        self.dumps += 1
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': self.events(since),
+                       'displayTimeUnit': 'ms'}, trace_file)
+
+
+def get_counter(name):
+    """Return the counter with a name, creating it if needed."""
+    counter = _counters.get(name)
+    if counter is None:
+        counter = _counters[name] = Counter(name)
+    return counter
+
+
+def probe(owner, attribute, name, args=None):
+    """Register a method to be timed when instrumentation is enabled.
+
+    :param owner: The class the method is defined on
+    :param attribute: The name of the method
+    :param name: The name of the counter the timings are added to
+    :param args: An optional function that is called with the arguments
+                 of the method, and returns a dictionary of arguments to
+                 record with the span when tracing.
+    """
+    _probes.append((owner, attribute, name, args))
+    get_counter(name)
+    if enabled:
+        _wrap(owner, attribute, name, args)
+
+
+def hit(name):
+    """Count a cache hit. Only call this if ``instrument.enabled``."""
+    get_counter(name).hits += 1
+
+
+def miss(name):
+    """Count a cache miss. Only call this if ``instrument.enabled``."""
+    get_counter(name).misses += 1
+
+
+def _wrap(owner, attribute, name, span_args):
+    function = owner.__dict__[attribute]
+    counter = get_counter(name)
+
+    @wraps(function)
+    def timed(*args, **kw):
+        tracer = _tracer
+        if tracer is not None:
+            # Get the arguments before the call changes them
+            info = span_args and span_args(*args, **kw)
+            tracer.depth += 1
+        start = clock()
+        try:
+            return function(*args, **kw)
+        finally:
+            end = clock()
+            counter.add_time(end - start)
+            if tracer is not None:
+                tracer.depth -= 1
+                tracer.add(name, start, end, info)
+
+    timed.__wrapped_probe__ = function
+    setattr(owner, attribute, timed)
+
+
+def _unwrap(owner, attribute):
+    function = owner.__dict__[attribute]
+    setattr(owner, attribute, function.__wrapped_probe__)
+
+
+def enable():
+    """Start collecting timings and counts."""
+    global enabled
+    if enabled:
+        return
+    enabled = True
+    for owner, attribute, name, args in _probes:
+        _wrap(owner, attribute, name, args)
+
+
+def disable():
+    """Stop collecting, restoring the hot paths to their original state.
+
+    This also stops any trace. The collected counts are kept until
+    :func:`reset` is called.
+    """
+    global enabled
+    stop_trace()
+    if not enabled:
+        return
+    enabled = False
+    for owner, attribute, name, args in reversed(_probes):
+        _unwrap(owner, attribute)
+
+
+def reset():
+    """Set all the counts back to zero."""
+    for counter in _counters.values():
+        counter.reset()
+
+
+def snapshot():
+    """Return the current counts of all hot paths.
+
+    The result is a dictionary keyed on counter name, with the number
+    of calls, total, max and mean duration in seconds, and the number
+    of cache hits and misses and the hit ratio.
+    """
+    return dict((name, counter.stats())
+                for name, counter in _counters.items())
+
+
+def start_trace(capacity=100000, slow_frame=None, path=None):
+    """Start recording spans, enabling instrumentation if needed.
+
+    See :class:`Tracer` for the parameters. Returns the tracer, use its
+    :meth:`Tracer.dump` method to save the trace at any time.
+    """
+    global _tracer
+    enable()
+    _tracer = Tracer(capacity, slow_frame, path)
+    return _tracer
+
+
+def stop_trace():
+    """Stop recording spans, and return the tracer, if any."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
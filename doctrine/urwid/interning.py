@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+from doctrine.urwid import instrument
+
+
+class LineInterner(object):
+    """Makes equal lines of a Code object share one string.
+
+    Logs and generated code repeat the same lines many times. The lines
+    of the code are interned when the interner is made, and the lines
+    that replace others after that, so each distinct line is only kept
+    once. The LineEdit widgets intern their text and display text too,
+    and as the layouts are cached by the display text, equal lines share
+    one layout.
+
+    Unlike sys.intern(), this also works for byte strings, and the
+    strings are freed when the interner is.
+
+    :param code: The code object to intern the lines of
+    :type code: doctrine.code.Code
+    """
+
+    # The most distinct strings kept, they are all dropped when there
+    # are more, and interned again as they are used.
+    max_size = 1 << 20
+
+    def __init__(self, code):
+        self.code = code
+        self._texts = {}
+        self.update_lines(0, 0, len(code.lines))
+
+    def __len__(self):
+        return len(self._texts)
+
+    def intern(self, text):
+        """Return the kept string equal to text, keeping text if none is."""
+        texts = self._texts
+        found = texts.get(text)
+        if found is None:
+            if instrument.enabled:
+                instrument.miss('intern.lines')
+            if len(texts) >= self.max_size:
+                texts.clear()
+            texts[text] = found = text
+        elif instrument.enabled:
+            instrument.hit('intern.lines')
+        return found
+
+    def update_lines(self, row, removed, added):
+        """Intern the lines that replaced others."""
+        code = self.code
+        intern = self.intern
+        for pos in range(row, row + added):
+            code[pos] = intern(code[pos])
+
+
+instrument.get_counter('intern.lines')
@@ -1,31 +1,263 @@
 # -*- coding: UTF-8 -*-
+import re
 import urwid
 
-from urwid.util import (move_prev_char, move_next_char, calc_width,
-                        calc_text_pos, is_wide_char)
-from urwid.text_layout import CanNotDisplayText, TextLayout
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from urwid import old_str_util, util
+from urwid.util import move_prev_char, move_next_char
+from urwid.text_layout import (CanNotDisplayText, LayoutSegment, TextLayout,
+                               calc_coords, calc_pos)
 from urwid.compat import bytes, PYTHON3, B
 
+from doctrine.urwid import instrument
+from doctrine.urwid.memory import layout_size
+
 ONECHAR_NEWLINES = (u'\n', b'\n', u'\r', b'\r')
 TWOCHAR_NEWLINES = (u'\n\r', b'\n\r', u'\r\n', b'\r\n')
 
+# The kinds of line terminators, and the terminator of each kind
+NO_TERMINATOR, LF, CRLF, CR = range(4)
+TERMINATORS = (u'', u'\n', u'\r\n', u'\r')
+TERMINATORS_B = (b'', b'\n', b'\r\n', b'\r')
+
+# Characters that are not one column wide, or may not be.
+NOT_SIMPLE_RE = re.compile(u'[^ -~]')
+
+
+def build_width_table(widths=old_str_util.widths):
+    """Build lookup tables from urwid's (max ordinal, width) table.
+
+    Returns a bytearray with the width of every character in the Basic
+    Multilingual Plane, and the (max ordinals, widths) of the ranges
+    above it.
+    """
+    bmp = bytearray(0x10000)
+    astral_max = []
+    astral_widths = []
+    start = 0
+    for num, wid in widths:
+        if start < 0x10000:
+            end = min(num, 0xffff) + 1
+            bmp[start:end] = bytearray([wid]) * (end - start)
+        if num >= 0x10000:
+            astral_max.append(num)
+            astral_widths.append(wid)
+        start = num + 1
+    if start < 0x10000:
+        bmp[start:] = bytearray([1]) * (0x10000 - start)
+    # Shift out and shift in take no space
+    bmp[0xe] = bmp[0xf] = 0
+    return bmp, (astral_max, astral_widths)
+
+
+BMP_WIDTHS, ASTRAL_WIDTHS = build_width_table()
+
+
+def char_width(char):
+    """Return the screen column width of a unicode character."""
+    o = ord(char)
+    if o < 0x10000:
+        return BMP_WIDTHS[o]
+    astral_max, astral_widths = ASTRAL_WIDTHS
+    index = bisect_left(astral_max, o)
+    if index == len(astral_max):
+        return 1
+    return astral_widths[index]
+
+
+def table_calc_width(text, start_offs, end_offs):
+    """calc_width() using the lookup tables for unicode text."""
+    if isinstance(text, bytes):
+        return util.calc_width(text, start_offs, end_offs)
+    if not NOT_SIMPLE_RE.search(text, start_offs, end_offs):
+        return end_offs - start_offs
+    segment = text[start_offs:end_offs]
+    if max(segment) <= u'\uffff':
+        return sum(map(BMP_WIDTHS.__getitem__, map(ord, segment)))
+    return sum(map(char_width, segment))
+
+
+def table_calc_text_pos(text, start_offs, end_offs, pref_col):
+    """calc_text_pos() using the lookup tables for unicode text."""
+    if isinstance(text, bytes):
+        return util.calc_text_pos(text, start_offs, end_offs, pref_col)
+    stop = min(end_offs, start_offs + pref_col + 1)
+    if not NOT_SIMPLE_RE.search(text, start_offs, stop):
+        # All one column wide up to the preferred column
+        if start_offs + pref_col >= end_offs:
+            return end_offs, end_offs - start_offs
+        return start_offs + pref_col, pref_col
+    pos = start_offs
+    sc = 0
+    for char in text[start_offs:end_offs]:
+        w = char_width(char)
+        if w + sc > pref_col:
+            return pos, sc
+        pos += 1
+        sc += w
+    return pos, sc
 
-def find_newline(text, pos):
-    l = len(text)
-    while pos < l:
-        char = text[pos:pos+1]
 
-        if char in ONECHAR_NEWLINES:
-            return pos
-        pos += 1
+def table_is_wide_char(text, offs):
+    """is_wide_char() using the lookup tables for unicode text."""
+    if isinstance(text, bytes):
+        return util.is_wide_char(text, offs)
+    return char_width(text[offs]) == 2
+
+
+if util.str_util is old_str_util:
+    # Urwid is running without its C extension, and would look up the
+    # width of each character by scanning its width table.
+    calc_width = table_calc_width
+    calc_text_pos = table_calc_text_pos
+    is_wide_char = table_is_wide_char
+else:
+    calc_width = util.calc_width
+    calc_text_pos = util.calc_text_pos
+    is_wide_char = util.is_wide_char
 
-    return pos
+
+def split_terminator(text):
+    """Return a line without its terminator, and the kind of terminator."""
+    end = text[-1:]
+    if end in (u'\n', b'\n'):
+        if text[-2:-1] in (u'\r', b'\r'):
+            return text[:-2], CRLF
+        return text[:-1], LF
+    if end in (u'\r', b'\r'):
+        return text[:-1], CR
+    return text, NO_TERMINATOR
+
+
+def join_terminator(text, kind):
+    """Return a line with a terminator of a kind added."""
+    if isinstance(text, bytes):
+        return text + TERMINATORS_B[kind]
+    return text + TERMINATORS[kind]
+
+
+def find_newline(text, pos):
+    """Return the offset of the next newline in text, or its length."""
+    if isinstance(text, bytes):
+        nl, cr = B('\n'), B('\r')
+    else:
+        nl, cr = u'\n', u'\r'
+    end = text.find(nl, pos)
+    if end == -1:
+        end = len(text)
+    # Only look for a carriage return before the newline, so that
+    # finding each line is not quadratic in the length of the text.
+    cr_pos = text.find(cr, pos, end)
+    if cr_pos != -1:
+        return cr_pos
+    return max(pos, end)
+
+
+class CursorMap(object):
+    """Translates between offsets into a text and coordinates in its layout.
+
+    Built once for a layout, after which a translation is a binary search
+    instead of a scan through all the rows of the layout.
+
+    :param text: The text that was laid out
+    :param trans: The layout structure of the text
+    """
+
+    def __init__(self, text, trans):
+        self.text = text
+        self.trans = trans
+        # The offset, end and (x, y) of the segments in layout order
+        self.offsets = []
+        self.ends = []
+        self.points = []
+        # The start columns and (col, offs, end, sc) of each row's text
+        self.rows = []
+        # Offsets must never go backwards for the binary search to work
+        self.ordered = True
+
+        last_end = 0
+        for y, row in enumerate(trans):
+            cols = []
+            segs = []
+            x = 0
+            for seg in row:
+                s = LayoutSegment(seg)
+                if s.offs is not None:
+                    if s.offs < last_end or s.text is not None:
+                        self.ordered = False
+                    self.offsets.append(s.offs)
+                    self.ends.append(s.end)
+                    self.points.append((x, y))
+                    if s.end is not None:
+                        cols.append(x)
+                        segs.append((x, s.offs, s.end, s.sc))
+                        last_end = s.end
+                x += s.sc
+            self.rows.append((cols, segs))
+
+    def coords(self, pos):
+        """Return the (x, y) coordinates of an offset, like calc_coords()."""
+        if not self.ordered:
+            return calc_coords(self.text, self.trans, pos)
+        offsets = self.offsets
+        i = bisect_left(offsets, pos)
+        # The segment with the last offset before pos may span it
+        j = i - 1
+        while j >= 0 and offsets[j] == offsets[i - 1]:
+            end = self.ends[j]
+            if end is not None and end > pos:
+                x, y = self.points[j]
+                return x + calc_width(self.text, offsets[j], pos), y
+            j -= 1
+        if i < len(offsets) and offsets[i] == pos:
+            return self.points[i]
+        # Not in the layout, find the closest segment the slow way
+        return calc_coords(self.text, self.trans, pos)
+
+    def pos(self, x, y):
+        """Return the offset closest to coordinates, like calc_pos()."""
+        if self.ordered and 0 <= y < len(self.rows) and isinstance(x, int):
+            cols, segs = self.rows[y]
+            i = bisect_right(cols, x) - 1
+            if i >= 0:
+                col, offs, end, sc = segs[i]
+                if x < col + sc:
+                    return calc_text_pos(self.text, offs, end, x - col)[0]
+        return calc_pos(self.text, self.trans, x, y)
 
 
 class CodeLayout(TextLayout):
-    """A layout for Urwid that can deal with tabs."""
+    """A layout for Urwid that can deal with tabs.
+
+    Layouts are cached, so that lines that are laid out again, for example
+    after each cursor movement, are looked up instead.
+    """
 
     tab_width = 8
+    # How many layouts to keep in the cache
+    cache_size = 1000
+
+    def __init__(self):
+        self._cache = OrderedDict()
+        # A doctrine.urwid.memory.MemoryBudget the cache reports to
+        self.memory = None
+        # Changes when the cache is cleared, so users of the layouts
+        # can tell that their own copies are stale
+        self.generation = 0
+
+    def clear_cache(self):
+        """Forget the cached layouts, for example if tab_width changed."""
+        if self.memory is not None:
+            for key in self._cache:
+                self.memory.discard(self, key)
+        self._cache.clear()
+        self.generation += 1
+
+    def evict(self, keys):
+        """Drop cached layouts, when over the memory budget."""
+        for key in keys:
+            self._cache.pop(key, None)
 
     def supports_align_mode(self, align):
         """Return True if align is a supported align mode."""
@@ -37,11 +269,44 @@ class CodeLayout(TextLayout):
 
     def layout(self, text, width, align, wrap):
         """Return a layout structure for text."""
-        try:
-            segs = self.calculate_text_segments(text, width, wrap)
-            return self.align_layout(text, width, segs, wrap, align)
-        except CanNotDisplayText:
-            return [[]]
+        return self._cached(text, width, align, wrap)[0]
+
+    def cursor_map(self, text, width, align, wrap):
+        """Return the CursorMap of the layout of text."""
+        entry = self._cached(text, width, align, wrap)
+        if entry[1] is None:
+            entry[1] = CursorMap(text, entry[0])
+        return entry[1]
+
+    def _cached(self, text, width, align, wrap):
+        # The layout of bytes depends on the encoding.
+        key = (text, width, align, wrap, util.get_encoding_mode())
+        cache = self._cache
+        entry = cache.pop(key, None)
+        if entry is None:
+            if instrument.enabled:
+                instrument.miss('layout.cache')
+            try:
+                segs = self.calculate_text_segments(text, width, wrap)
+                segs = self.align_layout(text, width, segs, wrap, align)
+            except CanNotDisplayText:
+                segs = [[]]
+            entry = [segs, None]
+            if len(cache) >= self.cache_size:
+                old_key = cache.popitem(last=False)[0]
+                if self.memory is not None:
+                    self.memory.discard(self, old_key)
+            # The most recently used entries are last
+            cache[key] = entry
+            if self.memory is not None:
+                self.memory.add(self, key, layout_size(text, segs))
+            return entry
+        if instrument.enabled:
+            instrument.hit('layout.cache')
+        cache[key] = entry
+        if self.memory is not None and not self.memory.touch(self, key):
+            self.memory.add(self, key, layout_size(text, entry[0]))
+        return entry
 
     def calculate_text_segments(self, text, width, wrap):
         """
@@ -61,12 +326,17 @@ class CodeLayout(TextLayout):
         # It's a prime candidate for refacturing, making easier to understand
         # and as it is heavily used, profiling would be nice too.
 
-        nl, nl_o, sp_o, tab_o = "\n", "\n", " ", "\t"
-        if PYTHON3 and isinstance(text, bytes):
-            nl = B(nl)  # can only find bytes in python3 bytestrings
-            nl_o = ord(nl_o)  # + an item of a bytestring is the ordinal value
-            sp_o = ord(sp_o)
-            tab_o = ord(tab_o)
+        # All offsets are into text itself, the lines are never sliced
+        # out of it, so laying out a large byte string copies nothing.
+        nl_o, sp_o, tab_o = "\n", " ", "\t"
+        twochar = (u'\n\r', u'\r\n')
+        if isinstance(text, bytes):
+            twochar = (B('\n\r'), B('\r\n'))
+            if PYTHON3:
+                # an item of a bytestring is the ordinal value
+                nl_o = ord(nl_o)
+                sp_o = ord(sp_o)
+                tab_o = ord(tab_o)
         b = []
         p = 0
         if wrap == 'clip':
@@ -74,31 +344,29 @@ class CodeLayout(TextLayout):
             l = []
             while p <= len(text):
                 n_cr = find_newline(text, p)
-                if p != n_cr:
-                    line = text[p:n_cr]
-                    pt = 0
-                    while pt < len(line):
-                        n_tab = line.find(tab_o, pt)
-                        if n_tab == -1:
-                            end = len(line)
-                        else:
-                            end = n_tab
-
-                        sc = calc_width(line, pt, end)
-                        if sc != 0:
-                            l.append((sc, p + pt, p + end))
-
-                        if end == n_tab:  # A tab was found
-                            extra_space = (self.tab_width - (
-                                sc % self.tab_width))
-                            l.append((extra_space, p + n_tab))
-
-                        pt = end + 1
+                pt = p
+                while pt < n_cr:
+                    n_tab = text.find(tab_o, pt, n_cr)
+                    if n_tab == -1:
+                        end = n_cr
+                    else:
+                        end = n_tab
+
+                    sc = calc_width(text, pt, end)
+                    if sc != 0:
+                        l.append((sc, pt, end))
+
+                    if end == n_tab:  # A tab was found
+                        extra_space = (self.tab_width - (
+                            sc % self.tab_width))
+                        l.append((extra_space, n_tab))
+
+                    pt = end + 1
 
                 l.append((0, n_cr))
                 b.append(l)
                 l = []
-                if text[n_cr:n_cr+2] in TWOCHAR_NEWLINES:
+                if text.startswith(twochar, n_cr):
                     # Two char newline:
                     p = n_cr + 2
                 else:
@@ -109,30 +377,32 @@ class CodeLayout(TextLayout):
             # look for next eligible line break
             n_cr = find_newline(text, p)
 
-            line = text[p:n_cr]
             l = []
-            pt = 0
+            pt = p
             lc = 0
-            while pt < len(line):
-                n_tab = line.find(tab_o, pt)
+            n_tab = text.find(tab_o, p, n_cr)
+            while pt < n_cr:
+                if n_tab != -1 and n_tab < pt:
+                    n_tab = text.find(tab_o, pt, n_cr)
                 if n_tab == -1:
-                    end = len(line)
+                    end = n_cr
                 else:
                     end = n_tab
 
-                sc = calc_width(line, pt, end)
+                # Only measure as much of a long line as fits the width
+                pos, sc = calc_text_pos(text, pt, end, width - lc)
 
-                if lc + sc <= width:
+                if pos == end:
                     # this segment fits
                     if sc:
-                        l.append((sc, p + pt, p + end))
+                        l.append((sc, pt, end))
                     if end == n_tab:  # A tab was found
                         extra_space = self.tab_width - (sc % self.tab_width)
-                        l.append((extra_space, p + n_tab))
+                        l.append((extra_space, n_tab))
                         lc += extra_space
                     else:
                         # removed character hint
-                        l.append((0, p + end))
+                        l.append((0, end))
 
                     pt = end + 1
                     lc += sc
@@ -149,14 +419,13 @@ class CodeLayout(TextLayout):
                     continue
 
                 # This segment does not fit. Let's fit it.
-                pos, sc = calc_text_pos(line, pt, end, width - lc)
                 if pos == pt:  # pathological width=1 double-byte case
                     raise CanNotDisplayText(
                         "Wide character will not fit in 1-column width")
 
                 if wrap == 'any':
-                    l.append((sc, p + pt, p + pos))
-                    l.append((0, p + pos))
+                    l.append((sc, pt, pos))
+                    l.append((0, pos))
                     b.append(l)
                     l = []
                     lc = 0
@@ -164,20 +433,20 @@ class CodeLayout(TextLayout):
                     continue
 
                 assert wrap == 'space'
-                if line[pos] == sp_o:
+                if text[pos] == sp_o:
                     # perfect space wrap
-                    l.append((sc, p + pt, p + pos))
+                    l.append((sc, pt, pos))
                     # removed character hint
-                    l.append((0, p + pos))
+                    l.append((0, pos))
                     b.append(l)
                     l = []
                     lc = 0
                     pt = pos + 1
                     continue
 
-                if is_wide_char(line, pos):
+                if is_wide_char(text, pos):
                     # perfect next wide
-                    l.append((sc, p + pt, p + pos))
+                    l.append((sc, pt, pos))
                     b.append(l)
                     l = []
                     lc = 0
@@ -186,23 +455,23 @@ class CodeLayout(TextLayout):
 
                 prev = pos
                 while prev > pt:
-                    prev = move_prev_char(line, pt, prev)
-                    if line[prev] == sp_o:
-                        sc = calc_width(line, pt, prev)
+                    prev = move_prev_char(text, pt, prev)
+                    if text[prev] == sp_o:
+                        sc = calc_width(text, pt, prev)
                         if prev != pt:
-                            l.append((sc, p + pt, p + prev))
-                        l.append((0, p + prev))
+                            l.append((sc, pt, prev))
+                        l.append((0, prev))
                         b.append(l)
                         l = []
                         lc = 0
                         pt = prev + 1
                         break
 
-                    if is_wide_char(line, prev):
+                    if is_wide_char(text, prev):
                         # wrap after wide char
-                        nextc = move_next_char(line, prev, pos)
-                        sc = calc_width(line, pt, nextc)
-                        l.append((sc, p + pt, p + nextc))
+                        nextc = move_next_char(text, prev, pos)
+                        sc = calc_width(text, pt, nextc)
+                        l.append((sc, pt, nextc))
                         b.append(l)
                         l = []
                         lc = 0
@@ -227,17 +496,17 @@ class CodeLayout(TextLayout):
                                 # combine with previous line
                                 old_line = b[-1][:-2]
                                 del b[-1]
-                                pt = p_off - p
+                                pt = p_off
                                 pos, sc = calc_text_pos(
-                                    line, pt, end, width)
-                                old_line.append((sc, p + pt, p + pos))
+                                    text, pt, end, width)
+                                old_line.append((sc, pt, pos))
                                 b.append(old_line)
                                 # check for trailing " " or "\n"
                                 pt = pos
                                 if pt < len(text) and (
                                    text[pt] in (sp_o, nl_o)):
                                     # removed character hint
-                                    b[-1].append((0, p + pt))
+                                    b[-1].append((0, pt))
                                     pt += 1
                                 continue
                     # Break on previous tab, and try again.
@@ -250,7 +519,7 @@ class CodeLayout(TextLayout):
                     # There is no space to break the line on, unwrapping the
                     # previous line doesn't help, I guess we just break on a
                     # character.
-                    b.append([(sc, p + pt, p + pos)])
+                    b.append([(sc, pt, pos)])
                     l = []
                     lc = 0
                     pt = pos
@@ -258,18 +527,25 @@ class CodeLayout(TextLayout):
             # force any char wrap
             if l:
                 b.append(l)
-            elif not line:
+            elif p == n_cr:
                 # An empty line.
                 b.append([(0, n_cr)])
-                pt = 1
+                pt = n_cr + 1
 
-            if text[pt-1:pt+1] in TWOCHAR_NEWLINES:
+            if text.startswith(twochar, pt - 1):
                 # Two char newline:
                 pt += 1
-            p += pt
+            p = pt
         return b
 
     def align_layout(self, text, width, segs, wrap, align):
         """Convert the layout segs to an aligned layout."""
         assert align == urwid.LEFT
         return segs
+
+
+instrument.get_counter('layout.cache')
+instrument.probe(CodeLayout, 'calculate_text_segments',
+                 'layout.calculate_text_segments',
+                 lambda layout, text, width, wrap: {'width': width,
+                                                    'length': len(text)})
@@ -0,0 +1,114 @@
+# -*- coding: UTF-8 -*-
+import difflib
+
+from bisect import bisect_left
+
+# Parts of at most this many lines on each side are compared with
+# difflib, which takes time proportional to the product of the sizes.
+DIFF_LIMIT = 1000
+
+
+def diff_lines(old, new, limit=DIFF_LIMIT):
+    """Return the hunks of lines that differ between two lists of lines.
+
+    Each hunk is an (old_start, old_end, new_start, new_end) tuple, in
+    order. The equal lines at the start and end are skipped first, which
+    is usually most of the file. Small differences are then compared with
+    difflib. Larger ones are split at the lines that occur once on each
+    side, in the order of the longest sequence of them that is in the
+    same order on both sides, like a patience diff. Parts that can not
+    be split are one hunk, so the time taken is about linear however
+    much differs.
+    """
+    hunks = []
+    _diff_range(old, 0, len(old), new, 0, len(new), limit, hunks)
+    return hunks
+
+
+def _diff_range(old, old_start, old_end, new, new_start, new_end, limit,
+                hunks):
+    while (old_start < old_end and new_start < new_end and
+           old[old_start] == new[new_start]):
+        old_start += 1
+        new_start += 1
+    while (old_start < old_end and new_start < new_end and
+           old[old_end - 1] == new[new_end - 1]):
+        old_end -= 1
+        new_end -= 1
+    if old_start == old_end and new_start == new_end:
+        return
+    if old_start == old_end or new_start == new_end:
+        hunks.append((old_start, old_end, new_start, new_end))
+        return
+
+    if old_end - old_start <= limit and new_end - new_start <= limit:
+        matcher = difflib.SequenceMatcher(
+            None, old[old_start:old_end], new[new_start:new_end],
+            autojunk=False)
+        hunks.extend((old_start + i1, old_start + i2,
+                      new_start + j1, new_start + j2)
+                     for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+                     if tag != 'equal')
+        return
+
+    anchors = unique_anchors(old, old_start, old_end,
+                             new, new_start, new_end)
+    if not anchors:
+        hunks.append((old_start, old_end, new_start, new_end))
+        return
+    for old_pos, new_pos in anchors:
+        _diff_range(old, old_start, old_pos, new, new_start, new_pos, limit,
+                    hunks)
+        old_start = old_pos + 1
+        new_start = new_pos + 1
+    _diff_range(old, old_start, old_end, new, new_start, new_end, limit,
+                hunks)
+
+
+def unique_anchors(old, old_start, old_end, new, new_start, new_end):
+    """Return the (old_pos, new_pos) of lines that can be kept in place.
+
+    These are the lines that occur once in each range, and of those the
+    longest sequence that is in the same order in both.
+    """
+    counts = {}
+    for pos in range(old_start, old_end):
+        line = old[pos]
+        count = counts.get(line)
+        counts[line] = (pos, None) if count is None else (None, None)
+    for pos in range(new_start, new_end):
+        line = new[pos]
+        count = counts.get(line)
+        if count is None:
+            continue
+        old_pos, new_pos = count
+        if old_pos is None or new_pos is not None:
+            # Not once in the old lines, or more than once in the new
+            counts[line] = (None, None)
+        else:
+            counts[line] = (old_pos, pos)
+    pairs = sorted(count for count in counts.values()
+                   if count[0] is not None and count[1] is not None)
+
+    # The longest increasing sequence of new positions, by patience
+    # sorting: the top new position of each pile, and the pair on top
+    # of each pile with the index of the pair below it in the sequence.
+    tops = []
+    top_pairs = []
+    previous = []
+    for index, (old_pos, new_pos) in enumerate(pairs):
+        pile = bisect_left(tops, new_pos)
+        if pile == len(tops):
+            tops.append(new_pos)
+            top_pairs.append(index)
+        else:
+            tops[pile] = new_pos
+            top_pairs[pile] = index
+        previous.append(top_pairs[pile - 1] if pile else None)
+    anchors = []
+    index = top_pairs[-1] if top_pairs else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
@@ -0,0 +1,325 @@
+# -*- coding: UTF-8 -*-
+"""A persisted index of the lines of a file, for fast reopening.
+
+The index holds the byte offset of the start of each line, and for each
+screen width it has been asked for, the number of rows each line wraps
+to. It is saved in a binary cache file that is memory mapped when the
+file is opened again, so nothing has to be scanned or laid out.
+
+The cache is keyed on the path of the file, and checked against its
+size, modification time and a hash of its first and last bytes. If the
+file has only been appended to, just the new lines are indexed.
+
+The cache file has a header, the newline the row counts were made with,
+a table of (width, offset) pairs locating the row counts of each width,
+the line offsets as unsigned 64 bit integers, and the row counts of each
+width as unsigned 32 bit integers, in the native byte order, as the cache
+is local to the machine.
+"""
+import hashlib
+import mmap
+import os
+import re
+import struct
+
+from array import array
+from urwid.text_layout import CanNotDisplayText
+
+from doctrine.urwid.layout import CodeLayout, split_terminator
+
+MAGIC = b'DULI'
+VERSION = 2
+# magic, version, length of the newline in UTF-8, file size, mtime in ns,
+# line count, width count, hash of the head, hash of the tail
+HEADER = struct.Struct('<4sHHQQQQ20s20s')
+WIDTH_ENTRY = struct.Struct('<QQ')
+# How many bytes at the start and end of the file are hashed
+SAMPLE_SIZE = 65536
+CHUNK_SIZE = 1 << 20
+# Lines end in \r\n, \n or \r, like in doctrine.code.Code
+TERMINATOR_RE = re.compile(b'\r\n|\n|\r')
+
+
+def padded(size):
+    """Return size rounded up to keep the arrays after it aligned."""
+    return (size + 7) & ~7
+
+
+def sample_hashes(path, size):
+    """Return hashes of the first and last bytes of the first size bytes."""
+    with open(path, 'rb') as f:
+        head = hashlib.sha1(f.read(min(size, SAMPLE_SIZE))).digest()
+        start = max(0, size - SAMPLE_SIZE)
+        f.seek(start)
+        tail = hashlib.sha1(f.read(size - start)).digest()
+    return head, tail
+
+
+def scan_lines(path, start):
+    """Return the offsets of the lines that start after offset start.
+
+    A line starts after each \r\n, \n or \r, also at the end of the
+    file, like in doctrine.code.Code.
+    """
+    offsets = array('Q')
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        # A \r at the end of a chunk may be the start of a \r\n
+        carriage_return = False
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if carriage_return:
+                if chunk[:1] == b'\n':
+                    offsets.append(pos + 1)
+                    chunk = chunk[1:]
+                    pos += 1
+                else:
+                    offsets.append(pos)
+            carriage_return = chunk[-1:] == b'\r'
+            if carriage_return:
+                chunk = chunk[:-1]
+            offsets.extend(pos + match.end()
+                           for match in TERMINATOR_RE.finditer(chunk))
+            pos += len(chunk) + carriage_return
+        if carriage_return:
+            offsets.append(pos)
+    return offsets
+
+
+class LineIndex(object):
+    """The line offsets and row counts of a file, cached on disk.
+
+    Use :meth:`open` to create one.
+
+    :param path: The file to index
+    :param cache_dir: The directory to keep the cache files in
+    :param newline: The character a LineEdit shows instead of a newline
+    :param encoding: The encoding of the file
+    :param layout: The layout used to count the rows of lines
+    """
+
+    def __init__(self, path, cache_dir, newline=u'', encoding='utf-8',
+                 layout=None):
+        self.path = os.path.abspath(path)
+        name = hashlib.sha1(self.path.encode('utf-8')).hexdigest()
+        self.cache_path = os.path.join(cache_dir, name + '.idx')
+        self.newline = newline
+        self.encoding = encoding
+        self.layout = layout or CodeLayout()
+        self.file_size = 0
+        self.mtime = 0
+        self.hashes = None
+        self.offsets = array('Q', [0])
+        self._rows = {}
+        self._totals = {}
+        self._mmap = None
+        self._views = []
+        # How the index was last loaded: 'cached', 'appended' or 'built'
+        self.loaded = None
+
+    @classmethod
+    def open(cls, path, cache_dir, **kw):
+        """Return the index of a file, loading or rebuilding its cache."""
+        index = cls(path, cache_dir, **kw)
+        index.load()
+        return index
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def line_offset(self, row):
+        """Return the byte offset in the file of the start of a line."""
+        return self.offsets[row]
+
+    def has_rows(self, width):
+        """Return True if the row counts of a width are in the index."""
+        return width in self._rows
+
+    def rows(self, width):
+        """Return the number of screen rows of each line at a width.
+
+        The row counts are calculated and saved the first time a width
+        is asked for, which lays out every line of the file.
+        """
+        rows = self._rows.get(width)
+        if rows is None:
+            rows = self._rows[width] = self._count_rows(0, width)
+            self.save()
+        return rows
+
+    def total_rows(self, width):
+        """Return the number of screen rows of the file at a width."""
+        total = self._totals.get(width)
+        if total is None:
+            total = self._totals[width] = sum(self.rows(width))
+        return total
+
+    def load(self):
+        """Load the cache, and rebuild what is stale."""
+        stat = os.stat(self.path)
+        size, mtime = stat.st_size, stat.st_mtime_ns
+        if self._read_cache():
+            old_size = self.file_size
+            if size >= old_size and (
+               sample_hashes(self.path, old_size) == self.hashes):
+                if size == old_size and mtime == self.mtime:
+                    self.loaded = 'cached'
+                    return
+                if size > old_size:
+                    # Appended to, only index the new lines
+                    self._extend(size, mtime)
+                    self.loaded = 'appended'
+                    return
+        self._build(size, mtime)
+        self.loaded = 'built'
+
+    def close(self):
+        """Unmap the cache file. The index is empty afterwards."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self.offsets = array('Q', [0])
+        self._rows = {}
+        self._totals = {}
+
+    def save(self):
+        """Write the index to the cache file."""
+        widths = sorted(self._rows)
+        lines = len(self.offsets)
+        newline = self.newline.encode('utf-8')
+        table_pos = HEADER.size + padded(len(newline))
+        pos = table_pos + WIDTH_ENTRY.size * len(widths) + 8 * lines
+        table = []
+        for width in widths:
+            table.append(WIDTH_ENTRY.pack(width, pos))
+            pos += 4 * lines
+
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(newline),
+                                self.file_size, self.mtime, lines,
+                                len(widths), self.hashes[0], self.hashes[1]))
+            f.write(newline.ljust(table_pos - HEADER.size, b'\0'))
+            f.write(b''.join(table))
+            f.write(self.offsets)
+            for width in widths:
+                f.write(self._rows[width])
+        # Unmap before replacing the file, which some platforms require
+        self._detach()
+        os.replace(tmp_path, self.cache_path)
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            # No cache, or an empty file that can not be mapped
+            return False
+
+        view = memoryview(mapped)
+        views = [view]
+        try:
+            (magic, version, newline_size, file_size, mtime, lines, widths,
+             head, tail) = HEADER.unpack_from(mapped)
+            table_pos = HEADER.size + padded(newline_size)
+            newline = mapped[HEADER.size:HEADER.size + newline_size]
+            pos = table_pos + WIDTH_ENTRY.size * widths
+            if (magic != MAGIC or version != VERSION or
+               len(mapped) != pos + (8 + 4 * widths) * lines):
+                raise ValueError('Bad cache file')
+            offsets = view[pos:pos + 8 * lines].cast('Q')
+            views.append(offsets)
+            rows = {}
+            if newline == self.newline.encode('utf-8'):
+                # Row counts depend on the width of the newline
+                for i in range(widths):
+                    width, start = WIDTH_ENTRY.unpack_from(
+                        mapped, table_pos + WIDTH_ENTRY.size * i)
+                    rows[width] = view[start:start + 4 * lines].cast('I')
+                    views.append(rows[width])
+        except (ValueError, struct.error):
+            for view in reversed(views):
+                view.release()
+            mapped.close()
+            return False
+
+        self.close()
+        self._mmap = mapped
+        self._views = views
+        self.file_size = file_size
+        self.mtime = mtime
+        self.hashes = (head, tail)
+        self.offsets = offsets
+        self._rows = rows
+        return True
+
+    def _detach(self):
+        # Copy the index out of the mapped cache file and unmap it
+        if self._mmap is None:
+            return
+        offsets = array('Q', self.offsets)
+        rows = dict((width, array('I', counts))
+                    for width, counts in self._rows.items())
+        self.close()
+        self.offsets = offsets
+        self._rows = rows
+
+    def _build(self, size, mtime):
+        self.close()
+        self.offsets = array('Q', [0])
+        self.offsets.extend(scan_lines(self.path, 0))
+        self.file_size = size
+        self.mtime = mtime
+        self.hashes = sample_hashes(self.path, size)
+        self.save()
+
+    def _extend(self, size, mtime):
+        self._detach()
+        # The last line may have been continued
+        last = len(self.offsets) - 1
+        start = self.file_size
+        if start and self.offsets[last] == start:
+            # The file ended with a newline, which may have been a \r
+            # that is now the start of a \r\n
+            self.offsets.pop()
+            start -= 1
+        self.offsets.extend(scan_lines(self.path, start))
+        for width, rows in self._rows.items():
+            del rows[last:]
+            rows.extend(self._count_rows(last, width))
+        self._totals = {}
+        self.file_size = size
+        self.mtime = mtime
+        self.hashes = sample_hashes(self.path, size)
+        self.save()
+
+    def _count_rows(self, first, width):
+        counts = array('I')
+        offsets = self.offsets
+        with open(self.path, 'rb') as f:
+            f.seek(offsets[first])
+            for row in range(first, len(offsets)):
+                if row + 1 < len(offsets):
+                    line = f.read(offsets[row + 1] - offsets[row])
+                else:
+                    line = f.read()
+                text = line.decode(self.encoding, 'replace')
+                counts.append(self._line_rows(text, width))
+        return counts
+
+    def _line_rows(self, text, width):
+        # The text is shown like LineEdit.get_text() shows it
+        text, terminator = split_terminator(text)
+        if terminator:
+            text += self.newline
+        try:
+            return len(self.layout.calculate_text_segments(
+                text, width, 'space'))
+        except CanNotDisplayText:
+            return 1
@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+import sys
+
+from collections import OrderedDict
+
+# Rough sizes in bytes of the objects the caches keep, besides the text
+WIDGET_SIZE = 1024
+LAYOUT_SIZE = 200
+SEGMENT_SIZE = 80
+
+
+def text_size(text):
+    """Return the estimated size in bytes of a text."""
+    return sys.getsizeof(text)
+
+
+def layout_size(text, layout):
+    """Return the estimated size in bytes of a cached layout of text."""
+    return (text_size(text) + LAYOUT_SIZE +
+            SEGMENT_SIZE * sum(len(row) for row in layout))
+
+
+class MemoryBudget(object):
+    """Keeps the caches of an editor within a number of bytes.
+
+    The caches report the estimated size of each entry they add, and
+    every use of an entry. The entries of all caches are kept in one
+    least recently used order, and when the sizes add up to more than the
+    limit, the entries that were used the longest ago are evicted,
+    whichever cache they are in.
+
+    A cache has an evict(keys) method, that is called with the keys of
+    the entries it should drop. It may keep entries it can not drop, like
+    the widget of the focus line, they are added again when next used.
+
+    :param limit: The most bytes the caches may use
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def touch(self, cache, key):
+        """Mark an entry as used. Returns False if it is not in the budget."""
+        entry = (cache, key)
+        size = self._entries.pop(entry, None)
+        if size is None:
+            return False
+        # The most recently used entries are last
+        self._entries[entry] = size
+        return True
+
+    def add(self, cache, key, size):
+        """Add an entry of an estimated size in bytes, evicting if needed."""
+        entry = (cache, key)
+        self.used += size - self._entries.pop(entry, 0)
+        self._entries[entry] = size
+        if self.used > self.limit:
+            self._evict()
+
+    def discard(self, cache, key):
+        """Remove an entry that the cache dropped by itself."""
+        self.used -= self._entries.pop((cache, key), 0)
+
+    def _evict(self):
+        evicted = OrderedDict()
+        entries = self._entries
+        # The entry just added is never evicted, or it would be made again
+        while self.used > self.limit and len(entries) > 1:
+            (cache, key), size = entries.popitem(last=False)
+            self.used -= size
+            evicted.setdefault(cache, []).append(key)
+        for cache, keys in evicted.items():
+            self.evictions += len(keys)
+            cache.evict(keys)
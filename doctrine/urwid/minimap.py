@@ -0,0 +1,175 @@
+# -*- coding: UTF-8 -*-
+import urwid
+
+from urwid.util import apply_target_encoding
+
+from doctrine.urwid import instrument
+
+
+class Minimap(object):
+    """A downsampled overview of a Code object.
+
+    The code is divided into rows of an equal number of lines, and each
+    row is summarized by the average indent and length of its lines. Rows
+    of many lines only measure a sample of them, so the overview costs
+    the same however long the code is, and no line is laid out.
+
+    The summaries are cached, and :meth:`update_lines` recalculates only
+    the rows that an edit changed.
+
+    :param code: The code object to show
+    :type code: doctrine.code.Code
+    """
+
+    # The most lines measured for one row
+    samples = 32
+
+    def __init__(self, code):
+        self.code = code
+        self.lines_per_row = 1
+        self._rows = []
+
+    def update_lines(self, row, removed, added):
+        """Forget the rows of replaced lines.
+
+        If lines were added or removed, the rows after them move, and
+        are recalculated as well.
+        """
+        index = row // self.lines_per_row
+        if removed == added:
+            end = (row + added - 1) // self.lines_per_row + 1
+        else:
+            end = len(self._rows)
+        for i in range(index, min(end, len(self._rows))):
+            self._rows[i] = None
+
+    def rows(self, height):
+        """Return the summary of each row, for an overview of height rows.
+
+        A summary is an (indent, length) tuple, or None for rows after
+        the end of the code.
+        """
+        lines_per_row = max(1, -(-len(self.code) // height))
+        if len(self._rows) != height or lines_per_row != self.lines_per_row:
+            self.lines_per_row = lines_per_row
+            self._rows = [None] * height
+        rows = self._rows
+        for i, summary in enumerate(rows):
+            if summary is None:
+                if instrument.enabled:
+                    instrument.miss('minimap.rows')
+                rows[i] = self._summarize(i * lines_per_row,
+                                          (i + 1) * lines_per_row)
+        return [summary or None for summary in rows]
+
+    def _summarize(self, start, end):
+        lines = self.code.lines
+        end = min(end, len(lines))
+        if start >= end:
+            # Past the end, cached as a false value that is not None
+            return ()
+        count = min(end - start, self.samples)
+        indents = lengths = 0
+        for sample in range(count):
+            pos = start + sample * (end - start) // count
+            text = lines[pos].rstrip()
+            indents += len(text) - len(text.lstrip())
+            lengths += len(text)
+        return indents // count, lengths // count
+
+
+class MinimapWidget(urwid.WidgetWrap):
+    """This widget wraps a TextEditor to display an overview of the code.
+
+    The overview is shown to the right of the editor, with the rows that
+    are shown in the editor marked with the 'minimap viewport' attribute
+    and the selected rows with 'minimap selection'.
+
+    :param editor: The editor to show an overview of, or another wrapper
+                   of one, like a LineNosWidget
+    :type editor: doctrine.urwid.TextEditor
+    :param width: The width of the overview
+    :param scale: How many columns of text one column of the overview is
+    """
+
+    fill = u'='
+
+    def __init__(self, editor, width=16, scale=4):
+        urwid.WidgetWrap.__init__(self, editor)
+        self.width = width
+        self.scale = scale
+        self.minimap = Minimap(self.editor.body.code)
+        self.editor.get_document().add_listener(self.minimap)
+
+    editor = property(lambda self: getattr(self._w, 'editor', self._w),
+                      doc="""The TextEditor that is wrapped.""")
+
+    def _editor_size(self, size):
+        maxcol, maxrow = size
+        return max(1, maxcol - self.width - 1), maxrow
+
+    def keypress(self, size, key):
+        return self._w.keypress(self._editor_size(size), key)
+
+    def mouse_event(self, size, event, button, col, row, focus):
+        return self._w.mouse_event(self._editor_size(size), event, button,
+                                   col, row, focus)
+
+    def get_cursor_coords(self, size):
+        return self._w.get_cursor_coords(self._editor_size(size))
+
+    def calculate_visible(self, size, focus=False):
+        """Return the visible lines of the editor, like ListBox does."""
+        return self._w.calculate_visible(self._editor_size(size), focus)
+
+    def render(self, size, focus=False):
+        throttle = self.editor.throttle
+        if throttle is not None:
+            return throttle.render(self, size, focus, self._render)
+        return self._render(size, focus)
+
+    def _render(self, size, focus):
+        maxcol, maxrow = size
+        editor_size = self._editor_size(size)
+        middle, top, bottom = self.calculate_visible(size, focus)
+        first = top[1][-1][1] if top[1] else middle[2]
+        last = bottom[1][-1][1] if bottom[1] else middle[2]
+
+        rows = self.minimap.rows(maxrow)
+        lines_per_row = self.minimap.lines_per_row
+        selected = set()
+        for start, end in self.editor.body.selection:
+            selected.update(range(start[0] // lines_per_row,
+                                  end[0] // lines_per_row + 1))
+
+        texts = []
+        attrs = []
+        charsets = []
+        for index, summary in enumerate(rows):
+            if summary is None:
+                line = u''
+            else:
+                indent, length = summary
+                start = min(indent // self.scale, self.width)
+                end = min(-(-length // self.scale), self.width)
+                line = u' ' * start + self.fill * (end - start)
+            text, cs = apply_target_encoding(
+                u' ' + line + u' ' * (self.width - len(line)))
+            if index in selected:
+                attr = 'minimap selection'
+            elif first // lines_per_row <= index <= last // lines_per_row:
+                attr = 'minimap viewport'
+            else:
+                attr = 'minimap'
+            texts.append(text)
+            attrs.append([(None, 1), (attr, self.width)])
+            charsets.append(cs)
+        minimap = urwid.TextCanvas(text=texts, attr=attrs, cs=charsets,
+                                   maxcol=self.width + 1)
+
+        canvas = self._w.render(editor_size, focus)
+        return urwid.CanvasJoin([(canvas, None, focus, editor_size[0]),
+                                 (minimap, None, False, self.width + 1)])
+
+
+instrument.get_counter('minimap.rows')
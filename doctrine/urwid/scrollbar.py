@@ -0,0 +1,227 @@
+# -*- coding: UTF-8 -*-
+import urwid
+
+from collections import deque
+
+
+class RowEstimate(object):
+    """Estimates how many screen rows the lines of a Code object take.
+
+    The heights of the last sample_size lines that were shown are kept,
+    with their sum, and the other lines are assumed to be as high as
+    those on average. Nothing is laid out to make the estimate, and no
+    height is kept per line, so edits cost nothing however many lines
+    have been seen.
+
+    Until the code is edited, the exact row counts of a
+    :class:`doctrine.urwid.lineindex.LineIndex` of its file are used
+    instead if it has them for the width, see :meth:`use_index`.
+
+    :param code: The code object to estimate
+    :type code: doctrine.code.Code
+    """
+
+    sample_size = 1000
+
+    def __init__(self, code):
+        self.code = code
+        self.width = None
+        self.heights = deque(maxlen=self.sample_size)
+        self.known_rows = 0
+        # The (row: rows) of the lines of the last frame
+        self._shown = {}
+        # The line index in use, and the last one given to use_index()
+        self.index = None
+        self._given_index = None
+
+    def set_width(self, width):
+        """Set the width the rows are for. Changing it forgets all heights."""
+        if width != self.width:
+            self.width = width
+            self.heights.clear()
+            self.known_rows = 0
+            self._shown = {}
+
+    def use_index(self, index):
+        """Use the row counts of a line index of the file of the code.
+
+        The index is used until the code is edited, and not at all if it
+        has a different number of lines than the code. Only widths that
+        are already in the index are used, the estimate never makes the
+        index lay out the file.
+        """
+        if index is not self._given_index:
+            self._given_index = index
+            if index is not None and len(index) != len(self.code):
+                index = None
+            self.index = index
+
+    def seen(self, lines):
+        """Tell the estimate the (row, rows) of the lines of a frame.
+
+        Lines that were in the last frame with the same height are not
+        counted again, so showing the same lines does not fill the
+        sample with them.
+        """
+        shown = self._shown
+        heights = self.heights
+        for row, rows in lines:
+            if shown.get(row) != rows:
+                if len(heights) == heights.maxlen:
+                    self.known_rows -= heights[0]
+                heights.append(rows)
+                self.known_rows += rows
+        self._shown = dict(lines)
+
+    def update_lines(self, row, removed, added):
+        """Move the lines of the last frame that are after replaced lines.
+
+        The replaced lines are counted again when they are shown. The
+        line index no longer matches the code, and is not used anymore.
+        """
+        self.index = None
+        delta = added - removed
+        shown = {}
+        for pos, rows in self._shown.items():
+            if pos >= row + removed:
+                shown[pos + delta] = rows
+            elif pos < row:
+                shown[pos] = rows
+        self._shown = shown
+
+    def _index_rows(self):
+        # The rows of the code from the index, or None
+        index = self.index
+        if index is None or not index.has_rows(self.width):
+            return None
+        return index.total_rows(self.width)
+
+    def rows_per_line(self):
+        """Return the average rows of the lines seen."""
+        total = self._index_rows()
+        if total is not None:
+            return total / float(len(self.code))
+        if not self.heights:
+            return 1.0
+        return self.known_rows / float(len(self.heights))
+
+    def total_rows(self):
+        """Return the estimated rows of the whole code."""
+        total = self._index_rows()
+        if total is not None:
+            return total
+        return len(self.code) * self.rows_per_line()
+
+
+class ScrollbarWidget(urwid.WidgetWrap):
+    """This widget wraps a TextEditor to display a scrollbar.
+
+    The scrollbar is shown to the right of the editor, with the trough
+    in the 'scrollbar' attribute and the thumb in 'scrollbar thumb'. The
+    thumb is placed from the line at the top of the editor and a
+    :class:`RowEstimate` of the rows of the code, so it costs the same
+    however long the code is. If the editor has a line index, see
+    :meth:`doctrine.urwid.TextEditor.open_index`, its row counts for the
+    width of the editor are used until the code is edited. Clicking the
+    scrollbar moves the focus to that part of the code.
+
+    :param editor: The editor to show a scrollbar for, or another wrapper
+                   of one, like a LineNosWidget
+    :type editor: doctrine.urwid.TextEditor
+    """
+
+    trough = u' '
+    thumb = u'#'
+
+    def __init__(self, editor):
+        urwid.WidgetWrap.__init__(self, editor)
+        self.estimate = RowEstimate(self.editor.body.code)
+        self.editor.get_document().add_listener(self.estimate)
+
+    editor = property(lambda self: getattr(self._w, 'editor', self._w),
+                      doc="""The TextEditor that is wrapped.""")
+
+    def _editor_size(self, size):
+        maxcol, maxrow = size
+        return max(1, maxcol - 1), maxrow
+
+    def keypress(self, size, key):
+        return self._w.keypress(self._editor_size(size), key)
+
+    def mouse_event(self, size, event, button, col, row, focus):
+        editor_size = self._editor_size(size)
+        if col < editor_size[0]:
+            return self._w.mouse_event(editor_size, event, button, col, row,
+                                       focus)
+        if event != 'mouse press' or button != 1:
+            return False
+        lines = len(self.estimate.code)
+        self.editor.set_focus(min(lines - 1, row * lines // size[1]))
+        return True
+
+    def get_cursor_coords(self, size):
+        return self._w.get_cursor_coords(self._editor_size(size))
+
+    def _text_width(self, size):
+        # The width of the editor, within the widgets it is wrapped in
+        widget = self
+        while widget is not self.editor:
+            size = widget._editor_size(size)
+            widget = widget._w
+        return size[0]
+
+    def calculate_visible(self, size, focus=False):
+        """Return the visible lines of the editor, like ListBox does."""
+        return self._w.calculate_visible(self._editor_size(size), focus)
+
+    def thumb_rows(self, top, top_trim, height):
+        """Return the (start, end) rows of the thumb.
+
+        :param top: The line at the top of the editor
+        :param top_trim: How many rows of the top line are scrolled away
+        :param height: The height of the editor
+        """
+        total = self.estimate.total_rows()
+        if total <= height:
+            return 0, height
+        before = top * self.estimate.rows_per_line() + top_trim
+        size = max(1, min(height, int(round(height * height / total))))
+        start = int(round(before * height / total))
+        return min(start, height - size), min(start, height - size) + size
+
+    def render(self, size, focus=False):
+        throttle = self.editor.throttle
+        if throttle is not None:
+            return throttle.render(self, size, focus, self._render)
+        return self._render(size, focus)
+
+    def _render(self, size, focus):
+        maxcol, maxrow = size
+        editor_size = self._editor_size(size)
+        middle, top, bottom = self.calculate_visible(size, focus)
+
+        self.estimate.set_width(self._text_width(size))
+        self.estimate.use_index(self.editor.line_index)
+        self.estimate.seen([(middle[2], middle[3])] +
+                           [(pos, rows)
+                            for widget, pos, rows in top[1] + bottom[1]])
+        if top[1]:
+            top_line = top[1][-1][1]
+        else:
+            top_line = middle[2]
+        start, end = self.thumb_rows(top_line, top[0], maxrow)
+
+        texts = []
+        attrs = []
+        for row in range(maxrow):
+            if start <= row < end:
+                texts.append(self.thumb.encode('ascii'))
+                attrs.append([('scrollbar thumb', 1)])
+            else:
+                texts.append(self.trough.encode('ascii'))
+                attrs.append([('scrollbar', 1)])
+        scrollbar = urwid.TextCanvas(text=texts, attr=attrs, maxcol=1)
+
+        canvas = self._w.render(editor_size, focus)
+        return urwid.CanvasJoin([(canvas, None, focus, editor_size[0]),
+                                 (scrollbar, None, False, 1)])
@@ -0,0 +1,199 @@
+# -*- coding: UTF-8 -*-
+import sys
+
+from bisect import bisect_left, bisect_right
+
+
+def shift_position(position, row, removed, added):
+    """Return where a (row, col) position is after lines were replaced.
+
+    Positions after the replaced lines move with them, positions on
+    lines that were removed move to the last line that replaced them.
+    """
+    pos_row, col = position
+    if pos_row >= row + removed:
+        return pos_row + added - removed, col
+    if pos_row >= row + added:
+        return max(row, row + added - 1), col
+    return position
+
+
+def shift_column(position, edits):
+    """Return where a (row, col) position is after text in lines changed.
+
+    edits has a (col, removed, added) change for each row whose text was
+    replaced within the line. Positions after the replaced text move
+    with it, positions in it move to the end of the new text if they
+    are past it.
+    """
+    pos_row, col = position
+    edit = edits.get(pos_row)
+    if edit is None:
+        return position
+    start, removed, added = edit
+    if col >= start + removed:
+        return pos_row, col + added - removed
+    return pos_row, min(col, start + added)
+
+
+class Selection(object):
+    """The selected text ranges of a document.
+
+    Each range is a ``((from_row, from_col), (to_row, to_col))`` tuple.
+    The ranges are kept sorted and never overlap, ranges that touch or
+    overlap are merged when added.
+    """
+
+    def __init__(self):
+        self.ranges = []
+        # Bumped on every change, so views can tell when to redraw.
+        self.version = 0
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def __bool__(self):
+        return bool(self.ranges)
+    __nonzero__ = __bool__
+
+    def add(self, start, end):
+        """Add the range between two (row, col) positions."""
+        if self._add(start, end):
+            self.version += 1
+
+    def _add(self, start, end):
+        # Returns True if the range was added, without bumping the version
+        if end < start:
+            start, end = end, start
+        if start == end:
+            # An empty range selects nothing
+            return False
+
+        ranges = self.ranges
+        first = bisect_left(ranges, (start, start))
+        if first and ranges[first - 1][1] >= start:
+            first -= 1
+        last = first
+        while last < len(ranges) and ranges[last][0] <= end:
+            start = min(start, ranges[last][0])
+            end = max(end, ranges[last][1])
+            last += 1
+        ranges[first:last] = [(start, end)]
+        return True
+
+    def set(self, start, end):
+        """Make the range between two positions the only selection."""
+        del self.ranges[:]
+        self._add(start, end)
+        self.version += 1
+
+    def clear(self):
+        """Deselect everything."""
+        if self.ranges:
+            del self.ranges[:]
+            self.version += 1
+
+    def update_lines(self, row, removed, added, edits=None):
+        """Move the ranges after lines of the code were replaced.
+
+        edits are the changes within the lines, see shift_column().
+        """
+        ranges = [(shift_position(start, row, removed, added),
+                   shift_position(end, row, removed, added))
+                  for start, end in self.ranges]
+        if edits:
+            ranges = [(shift_column(start, edits), shift_column(end, edits))
+                      for start, end in ranges]
+        if ranges != self.ranges:
+            del self.ranges[:]
+            for start, end in ranges:
+                self._add(start, end)
+            self.version += 1
+
+    def row_spans(self, row):
+        """Return the selected (from_col, to_col) spans of a row.
+
+        to_col is None when the selection continues past the end of the
+        row, which includes the newline.
+        """
+        ranges = self.ranges
+        index = bisect_right(ranges, ((row, sys.maxsize),))
+        spans = []
+        while index:
+            index -= 1
+            start, end = ranges[index]
+            if end <= (row, 0):
+                # Ends before anything on this row
+                break
+            from_col = start[1] if start[0] == row else 0
+            to_col = end[1] if end[0] == row else None
+            spans.append((from_col, to_col))
+        spans.reverse()
+        return spans
+
+
+class Cursors(object):
+    """The extra cursors of a document, as sorted (row, col) positions.
+
+    The main cursor is the edit position of the focus line, and is not
+    included.
+    """
+
+    def __init__(self):
+        self.positions = []
+        # Bumped on every change, so views can tell when to redraw.
+        self.version = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __bool__(self):
+        return bool(self.positions)
+    __nonzero__ = __bool__
+
+    def add(self, row, col):
+        """Add a cursor, unless there already is one at the position."""
+        index = bisect_left(self.positions, (row, col))
+        if self.positions[index:index + 1] != [(row, col)]:
+            self.positions.insert(index, (row, col))
+            self.version += 1
+
+    def set(self, positions):
+        """Replace all the cursors."""
+        self.positions = sorted(set(positions))
+        self.version += 1
+
+    def clear(self):
+        """Remove all the cursors."""
+        if self.positions:
+            self.positions = []
+            self.version += 1
+
+    def update_lines(self, row, removed, added, edits=None):
+        """Move the cursors after lines of the code were replaced.
+
+        edits are the changes within the lines, see shift_column().
+        """
+        positions = [shift_position(position, row, removed, added)
+                     for position in self.positions]
+        if edits:
+            positions = [shift_column(position, edits)
+                         for position in positions]
+        if positions != self.positions:
+            self.set(positions)
+
+    def row_cols(self, row):
+        """Return the columns of the cursors on a row."""
+        positions = self.positions
+        index = bisect_left(positions, (row, 0))
+        cols = []
+        while index < len(positions) and positions[index][0] == row:
+            cols.append(positions[index][1])
+            index += 1
+        return cols
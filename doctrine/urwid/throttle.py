@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+import weakref
+
+try:
+    from time import monotonic as clock
+except ImportError:  # Python 2
+    from time import time as clock
+
+
+class RedrawThrottle(object):
+    """Limits how often a widget, and the widgets wrapping it, render.
+
+    :param max_fps: The highest number of renders per second
+    :type max_fps: float
+    :param event_loop: The urwid event loop used to schedule the render
+                       at the end of a frame that was skipped.
+
+    Within a frame interval the canvas of the last render is reused, and
+    an alarm is set to invalidate the widgets when the interval is over,
+    so the last changes always get drawn once input goes quiet.
+
+    Wrappers of the widget, like a LineNosWidget, render through the same
+    throttle with :meth:`render`, so they reuse their canvas in the same
+    frames as the widget. When a wrapper does render, the widgets within
+    it render too, so what they show always matches.
+    """
+
+    def __init__(self, max_fps, event_loop, clock=clock):
+        self.interval = 1.0 / max_fps
+        self.event_loop = event_loop
+        self.clock = clock
+        self.last_render = None
+        # The (size, focus, canvas) of the last render of each widget
+        self.canvases = weakref.WeakKeyDictionary()
+        self.alarm = None
+        # How many renders are in progress
+        self._depth = 0
+
+    def render(self, widget, size, focus, render):
+        """Return the last canvas of a widget, or render it.
+
+        :param render: Renders the widget, called with size and focus
+        """
+        canvas = self.cached(widget, size, focus)
+        if canvas is None:
+            self._depth += 1
+            try:
+                canvas = render(size, focus)
+            finally:
+                self._depth -= 1
+            self.rendered(widget, size, focus, canvas)
+        return canvas
+
+    def cached(self, widget, size, focus):
+        """Return the last canvas if it is too soon to render again.
+
+        Returns None when the widget should render, which it always
+        should within a widget that is rendering.
+        """
+        last = self.canvases.get(widget)
+        if (self._depth or self.last_render is None or last is None or
+           last[:2] != (size, focus)):
+            return None
+        remaining = self.last_render + self.interval - self.clock()
+        if remaining <= 0:
+            return None
+        if self.alarm is None:
+            self.alarm = self.event_loop.alarm(remaining, self._frame_done)
+        return last[2]
+
+    def rendered(self, widget, size, focus, canvas):
+        """Remember a canvas that was just rendered."""
+        self.last_render = self.clock()
+        self.canvases[widget] = size, focus, canvas
+
+    def _frame_done(self):
+        self.alarm = None
+        for widget in list(self.canvases.keys()):
+            widget._invalidate()
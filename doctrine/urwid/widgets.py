@@ -1,31 +1,212 @@
 # -*- coding: UTF-8 -*-
+import re
 import urwid
 
+from bisect import bisect_left, bisect_right
+
+from contextlib import contextmanager
+from itertools import groupby
+
 from encodings import codecs
 from urwid.util import (move_prev_char, move_next_char,
                         is_wide_char)
-from urwid.compat import bytes, PYTHON3
-
-from doctrine.urwid.layout import CodeLayout
+from urwid.compat import bytes, PYTHON3, B
+from urwid.text_layout import calc_coords, calc_pos, shift_line
+
+from doctrine.urwid import instrument
+from doctrine.urwid.autosave import DirtyLines
+from doctrine.urwid.brackets import BracketIndex
+from doctrine.urwid.layout import (CodeLayout, NO_TERMINATOR,
+                                   split_terminator, join_terminator)
+from doctrine.urwid.linediff import diff_lines
+from doctrine.urwid.lineindex import LineIndex
+from doctrine.urwid.document import Document
+from doctrine.urwid.folding import FoldIndex
+from doctrine.urwid.interning import LineInterner
+from doctrine.urwid.memory import MemoryBudget, WIDGET_SIZE, text_size
+from doctrine.urwid.selection import (Selection, Cursors, shift_position,
+                                      shift_column)
+from doctrine.urwid.throttle import RedrawThrottle
 
 ONECHAR_NEWLINES = (u'\n', b'\n', u'\r', b'\r')
 ERASE_LEFT = 'erase left'
 ERASE_RIGHT = 'erase right'
+CUT = 'cut'
+COPY = 'copy'
+PASTE = 'paste'
+ADD_CURSOR_NEXT_MATCH = 'add cursor next match'
+ADD_CURSOR_ABOVE = 'add cursor above'
+ADD_CURSOR_BELOW = 'add cursor below'
+WORD_LEFT = 'word left'
+WORD_RIGHT = 'word right'
+ERASE_WORD_LEFT = 'erase word left'
+ERASE_WORD_RIGHT = 'erase word right'
+
+MOVEMENT_COMMANDS = (urwid.CURSOR_UP, urwid.CURSOR_DOWN, urwid.CURSOR_LEFT,
+                     urwid.CURSOR_RIGHT, urwid.CURSOR_PAGE_UP,
+                     urwid.CURSOR_PAGE_DOWN, urwid.CURSOR_MAX_LEFT,
+                     urwid.CURSOR_MAX_RIGHT, WORD_LEFT, WORD_RIGHT)
+
+WORD_RE = re.compile(u'\\w+', re.UNICODE)
+WORD_RE_B = re.compile(b'\\w+')
+LINE_RE = re.compile(u'.*?(?:\r\n|\n|\r|\\Z)', re.DOTALL)
+LINE_RE_B = re.compile(b'.*?(?:\r\n|\n|\r|\\Z)', re.DOTALL)
+
+
+def split_lines(text):
+    """Split text into lines, keeping the newlines."""
+    if isinstance(text, bytes):
+        lines = LINE_RE_B.findall(text)
+    else:
+        lines = LINE_RE.findall(text)
+    # The pattern always matches an empty string at the end.
+    return lines[:-1] or lines
+
+
+def line_length(text):
+    """Return the length of a line, not counting the newline."""
+    l = len(text)
+    while l and text[l-1:l] in ONECHAR_NEWLINES:
+        l -= 1
+    return l
+
+
+def text_change(old, new):
+    """Return the (col, removed, added) change that turns old into new."""
+    start = 0
+    end = min(len(old), len(new))
+    while start < end and old[start] == new[start]:
+        start += 1
+    tail = 0
+    while tail < end - start and old[-1 - tail] == new[-1 - tail]:
+        tail += 1
+    return start, len(old) - tail - start, len(new) - tail - start
+
+
+def word_at(text, col):
+    """Return the (start, end) of the word at or just before col."""
+    regex = WORD_RE_B if isinstance(text, bytes) else WORD_RE
+    for match in regex.finditer(text):
+        if match.start() <= col <= match.end():
+            return match.span()
+        if match.start() > col:
+            break
+    return None
+
+
+def replace_ranges(text, ranges, insertion):
+    """Replace sorted (start, end) ranges of a line with insertion.
+
+    This is done in one sweep over the line. Returns the new text and
+    the position after each replacement in the new text.
+    """
+    parts = []
+    positions = []
+    last = 0
+    length = 0
+    for start, end in ranges:
+        if start < last:
+            # Overlaps the previous range
+            start = last
+        if end < start:
+            end = start
+        parts.append(text[last:start])
+        parts.append(insertion)
+        length += start - last + len(insertion)
+        positions.append(length)
+        last = end
+    parts.append(text[last:])
+    return text[:0].join(parts), positions
+
+
+def spans_to_attrib(spans, length):
+    """Convert (attr, start, end) spans to a run length attribute list.
+
+    An end of None means the end of the text.
+    """
+    attrib = []
+    pos = 0
+    for attr, start, end in sorted(spans, key=lambda span: span[1]):
+        if end is None or end > length:
+            end = length
+        if start < pos:
+            start = pos
+        if start >= end:
+            continue
+        if start > pos:
+            attrib.append((None, start - pos))
+        attrib.append((attr, end - start))
+        pos = end
+    return attrib
 
 
 class LineNosWidget(urwid.WidgetWrap):
-    """This widget wraps a Code widget to display line numbers."""
+    """This widget wraps a Code widget to display line numbers.
+
+    The wrapped widget is a TextEditor, or another wrapper of one, like
+    a MinimapWidget.
+    """
+
+    def __init__(self, w):
+        urwid.WidgetWrap.__init__(self, w)
+        self._linenos = {}
+
+    editor = property(lambda self: getattr(self._w, 'editor', self._w),
+                      doc="""The TextEditor that is wrapped.""")
+
+    def _gutter_width(self):
+        return max(3, len(str(len(self.editor.body.code.lines))))
+
+    def _editor_size(self, size):
+        maxcol, maxrow = size
+        return max(1, maxcol - self._gutter_width() - 1), maxrow
+
+    def keypress(self, size, key):
+        return self._w.keypress(self._editor_size(size), key)
+
+    def mouse_event(self, size, event, button, col, row, focus):
+        offset = self._gutter_width() + 1
+        if col < offset:
+            return False
+        return self._w.mouse_event(self._editor_size(size), event, button,
+                                   col - offset, row, focus)
+
+    def get_cursor_coords(self, size):
+        coords = self._w.get_cursor_coords(self._editor_size(size))
+        if coords is None:
+            return None
+        return coords[0] + self._gutter_width() + 1, coords[1]
+
+    def calculate_visible(self, size, focus=False):
+        """Return the visible lines of the editor, like ListBox does."""
+        return self._w.calculate_visible(self._editor_size(size), focus)
 
     def render(self, size, focus=False):
-        last_line = len(self._w.body.code.lines)
-        width = max(3, len(str(last_line)))
+        # Within a frame of the redraw limit of the editor, the numbers
+        # are kept with the text they were drawn with
+        throttle = self.editor.throttle
+        if throttle is not None:
+            return throttle.render(self, size, focus, self._render)
+        return self._render(size, focus)
 
-        max_col, max_rows = size
-        middle, top, bottom = self._w.calculate_visible(
-            (max_col - width, max_rows), focus)
+    def _render(self, size, focus):
+        width = self._gutter_width()
+        middle, top, bottom = self.calculate_visible(size, focus)
 
         lines = list(reversed(top[1:][0])) + [middle[1:-1]] + bottom[1:][0]
-        widgets = [(line[2], LineNoWidget(line[1])) for line in lines]
+        folds = self.editor.body.folds
+        # The number widgets of the last frame are reused, with their
+        # canvases, when the same line is shown again
+        old = self._linenos
+        self._linenos = new = {}
+        widgets = []
+        for line in lines:
+            key = line[1], folds.hidden_after(line[1])
+            widget = old.get(key)
+            if widget is None:
+                widget = LineNoWidget(*key)
+            new[key] = widget
+            widgets.append((line[2], widget))
 
         linenos = urwid.Pile(widgets)
         wrapper = urwid.Columns([(width, linenos), self._w], dividechars=1,
@@ -36,40 +217,162 @@ class LineNosWidget(urwid.WidgetWrap):
 
 
 class LineNoWidget(urwid.Widget):
-    """A widget that displays a row number."""
+    """A widget that displays a row number.
+
+    The number of a folded line is shown with the 'lineno folded'
+    attribute.
+    """
 
     _selectable = False
     _sizing = frozenset([urwid.FIXED])
 
-    def __init__(self, row):
+    def __init__(self, row, folded=0):
         self.row = row
+        self.folded = folded
+        self._canvas = None
 
     def render(self, size, focus=False):
+        # The number and folding never change, only the size may
+        canvas = self._canvas
+        if canvas is not None and canvas.cols() == size[0] and (
+                canvas.rows() == size[1]):
+            if instrument.enabled:
+                instrument.hit('lineno.render')
+            return canvas
+        if instrument.enabled:
+            instrument.miss('lineno.render')
+        self._canvas = canvas = self._render(size)
+        return canvas
+
+    def _render(self, size):
         maxcol, maxrow = size
         code = '%%%ii' % maxcol
         text = [b''] * maxrow
         text[0] = (code % self.row).encode()
-        attr = [(('lineno', maxcol),)] * maxrow
+        attr_name = 'lineno folded' if self.folded else 'lineno'
+        attr = [((attr_name, maxcol),)] * maxrow
         return urwid.TextCanvas(text=text,
                                 attr=attr,
                                 maxcol=maxcol)
 
 
 class LineEdit(urwid.Edit):
-    """The editor for one line of code."""
+    """The editor for one line of code.
+
+    The text is kept without its line terminator, and the kind of the
+    terminator is kept in the terminator attribute, see
+    :func:`doctrine.urwid.layout.split_terminator`. The edit_text is the
+    whole line, with the terminator.
+    """
+
+    # Shown after a line that has lines folded into it
+    fold_marker = u' [%i lines]'
+    # Lines longer than this are shown a part at a time, None means never
+    long_line_length = None
+    # How many rows of a long line are shown
+    long_line_rows = 50
+    # Shown after the part of a long line, with the offsets of the part
+    long_line_marker = u' [long line %i-%i of %i]'
+
     def __init__(self, edit_text="", align=urwid.widget.LEFT,
-                 wrap=urwid.widget.SPACE, layout=None, newline=None):
+                 wrap=urwid.widget.SPACE, layout=None, newline=None,
+                 interner=None):
 
         self.newline = newline
+        # A doctrine.urwid.interning.LineInterner for the texts, or None
+        self.interner = interner
+        self.terminator = NO_TERMINATOR
+        self.spans = []
+        self.spans_version = None
+        self.folded = 0
+        # Where the widget was when last used, and its size in the memory
+        # budget, see LineWalker.evict()
+        self.row_hint = None
+        self.memory_size = None
+        self._word_text = None
+        self._words = None
+        self._long_maxcol = 80
+        # The (newline, text, attrib) last returned by get_text()
+        self._display = None
+        # Changes when the display text does, see render()
+        self._version = 0
+        self._canvas_key = None
+        self._canvas = None
         urwid.Edit.__init__(self, edit_text=edit_text, allow_tab=True,
                             align=align, wrap=wrap, layout=layout)
         self._wrap_mode = 'space'
 
+    def set_edit_text(self, text):
+        text, self.terminator = split_terminator(text)
+        if self.interner is not None:
+            text = self.interner.intern(text)
+        self._display_changed()
+        urwid.Edit.set_edit_text(self, text)
+
+    def get_edit_text(self):
+        return join_terminator(self._edit_text, self.terminator)
+
+    edit_text = property(get_edit_text, set_edit_text, doc="""
+        The text of the line, with its terminator.
+        """)
+
+    def get_line_text(self):
+        """Return the text of the line without its terminator."""
+        return self._edit_text
+
+    def set_spans(self, spans):
+        """Set the (attr, start, end) spans displayed on the line."""
+        if spans != self.spans:
+            self.spans = spans
+            self._display_changed()
+            self._invalidate()
+
+    def set_folded(self, folded):
+        """Set how many lines are folded into this one."""
+        if folded != self.folded:
+            self.folded = folded
+            self._display_changed()
+            self._invalidate()
+
+    def word_bounds(self):
+        """Return the sorted lists of the starts and ends of the words.
+
+        The lists are cached until the text of the line changes.
+        """
+        text = self._edit_text
+        if self._word_text is not text:
+            if instrument.enabled:
+                instrument.miss('edit.words')
+            regex = WORD_RE_B if isinstance(text, bytes) else WORD_RE
+            starts = []
+            ends = []
+            for match in regex.finditer(text):
+                starts.append(match.start())
+                ends.append(match.end())
+            self._word_text = text
+            self._words = starts, ends
+        elif instrument.enabled:
+            instrument.hit('edit.words')
+        return self._words
+
+    def next_word_end(self, col):
+        """Return the end of the word at or after col, or None."""
+        ends = self.word_bounds()[1]
+        index = bisect_right(ends, col)
+        if index < len(ends):
+            return ends[index]
+        return None
+
+    def prev_word_start(self, col):
+        """Return the start of the word at or before col, or None."""
+        starts = self.word_bounds()[0]
+        index = bisect_left(starts, col)
+        if index:
+            return starts[index - 1]
+        return None
+
     def get_edit_len(self):
-        l = len(self._edit_text)
-        while l and self._edit_text[l-1] in ONECHAR_NEWLINES:
-            l -= 1
-        return l
+        return len(self._edit_text)
 
     def set_edit_pos(self, pos):
         l = self.get_edit_len()
@@ -80,6 +383,129 @@ class LineEdit(urwid.Edit):
         self._edit_pos = pos
         self._invalidate()
 
+    def is_long(self):
+        """Return True if the line is too long to lay out in full."""
+        return (self.long_line_length is not None and
+                len(self._edit_text) > self.long_line_length)
+
+    def long_line_window(self, maxcol=None):
+        """Return the (start, end) offsets of the part of a long line shown.
+
+        The line is split into parts of long_line_rows full rows, and the
+        part the cursor is in is shown.
+        """
+        if maxcol is None:
+            maxcol = self._long_maxcol
+        size = max(maxcol, 1) * self.long_line_rows
+        length = self.get_edit_len()
+        start = self.edit_pos // size * size
+        if start and start >= length:
+            start -= size
+        return start, min(start + size, length)
+
+    def _display_changed(self):
+        # Forget the display text, and the canvas made from it
+        self._display = None
+        self._version += 1
+
+    def render(self, size, focus=False):
+        """Render the line, reusing the last canvas if nothing changed.
+
+        urwid's CanvasCache only keeps weak references, and drops the
+        canvas on any invalidation. The line keeps its last canvas, for
+        the same text, width and focus, and cursor if it has the focus,
+        so only the lines that changed are rendered again. The walker
+        drops it when the line is no longer shown, see
+        :meth:`LineWalker.keep_canvases`. Clearing the
+        cache of the layout, like after changing tab_width, or changing
+        the caption, modes or long line limits, renders it again too.
+        """
+        # The part of a long line shown depends on the width
+        self._long_maxcol = size[0]
+        long_line = self.is_long()
+        layout = self.layout
+        key = (self._version, self.newline, size, focus,
+               self.edit_pos if focus or long_line else None,
+               layout, getattr(layout, 'generation', None), self.caption,
+               self._align_mode, self._wrap_mode, self.long_line_length,
+               self.long_line_rows)
+        if key == self._canvas_key:
+            if instrument.enabled:
+                instrument.hit('edit.render')
+        else:
+            if instrument.enabled:
+                instrument.miss('edit.render')
+            # urwid.Edit.render() is cached by urwid too, and the kept
+            # canvas would be found there
+            urwid.CanvasCache.invalidate(self)
+            self._canvas = urwid.Edit.render(self, size, focus)
+            self._canvas_key = key
+        # A new canvas around the kept one is returned, as urwid's
+        # CanvasCache would keep returning the kept one while it lives,
+        # without calling render() to check the key.
+        return urwid.CompositeCanvas(self._canvas)
+
+    def drop_canvas(self):
+        """Forget the kept canvas, the line is rendered again when shown."""
+        self._canvas = None
+        self._canvas_key = None
+
+    def get_cursor_map(self, maxcol, text=None):
+        """Return the CursorMap of the line, or None if the layout has none.
+
+        The map is cached with the layout, so the cursor can move through
+        long wrapped lines without translating the whole line every time.
+        """
+        if not isinstance(self.layout, CodeLayout) or self.is_long():
+            return None
+        if text is None:
+            text = self.get_text()[0]
+        return self.layout.cursor_map(text, maxcol, self._align_mode,
+                                      self._wrap_mode)
+
+    def get_line_translation(self, maxcol, ta=None):
+        if self.is_long():
+            # Wrapped at any character, without the layout cache
+            self._long_maxcol = maxcol
+            text = ta[0] if ta else self.get_text()[0]
+            return urwid.text_layout.default_layout.layout(
+                text, maxcol, self._align_mode, 'any')
+
+        cursor_map = self.get_cursor_map(maxcol, ta and ta[0])
+        if cursor_map is None:
+            return urwid.Edit.get_line_translation(self, maxcol, ta)
+
+        trans = cursor_map.trans
+        if not self._shift_view_to_cursor:
+            return trans
+
+        # Shift the cursor row into view, like urwid.Edit does
+        x, y = cursor_map.coords(self.edit_pos + len(self.caption))
+        if x < 0:
+            return (trans[:y] + [shift_line(trans[y], -x)] + trans[y+1:])
+        elif x >= maxcol:
+            return (trans[:y] + [shift_line(trans[y], -(x - maxcol + 1))] +
+                    trans[y+1:])
+        return trans
+
+    def position_coords(self, maxcol, pos):
+        if self.is_long():
+            trans = self.get_line_translation(maxcol)
+            start, end = self.long_line_window(maxcol)
+            pos = min(max(pos, start), end) - start
+            return calc_coords(self.get_text()[0], trans,
+                               pos + len(self.caption))
+
+        cursor_map = self.get_cursor_map(maxcol)
+        if cursor_map is None:
+            return urwid.Edit.position_coords(self, maxcol, pos)
+
+        trans = self.get_line_translation(maxcol)
+        pos += len(self.caption)
+        if trans is cursor_map.trans:
+            return cursor_map.coords(pos)
+        return calc_coords(cursor_map.text, trans, pos)
+
     def move_cursor_to_coords(self, size, x, y):
         (maxcol,) = size
         trans = self.get_line_translation(maxcol)
@@ -87,48 +513,243 @@ class LineEdit(urwid.Edit):
         if y < top_y or y >= len(trans):
             return False
 
-        pos = urwid.text_layout.calc_pos(self.get_text()[0], trans, x, y)
+        cursor_map = self.get_cursor_map(maxcol)
+        if cursor_map is not None and trans is cursor_map.trans:
+            pos = cursor_map.pos(x, y)
+        else:
+            pos = calc_pos(self.get_text()[0], trans, x, y)
         e_pos = pos - len(self.caption)
+        if self.is_long():
+            start, end = self.long_line_window(maxcol)
+            e_pos = min(e_pos, end - start) + start
         self.set_edit_pos(e_pos)
         self.pref_col_maxcol = x, maxcol
         self._invalidate()
         return True
 
     def get_text(self):
+        """Return the displayed text and attributes of the line.
+
+        They are kept until the text, spans or folding change, so the
+        same string is returned each time, and the layouts cached for it
+        are found without comparing the whole text.
+        """
+        if self.is_long():
+            return self._get_long_text()
+
+        display = self._display
+        if display is not None and display[0] == self.newline:
+            if instrument.enabled:
+                instrument.hit('edit.text')
+            return display[1:]
+        if instrument.enabled:
+            instrument.miss('edit.text')
+
         # We have a line, now make it into widgets:
         text = self._edit_text
 
         # Show the newline
-        if text and text[-1] in '\r\n':
-            text = text.rstrip('\r\n') + self.newline
-        return text, self._attrib
+        if self.terminator:
+            text += self.newline
+        spans = self.spans
+        if self.folded:
+            marker = self.fold_marker % self.folded
+            if isinstance(text, bytes):
+                marker = marker.encode('ascii')
+            spans = spans + [('folded', len(text), None)]
+            text += marker
+        if self.interner is not None:
+            text = self.interner.intern(text)
+        attrib = spans_to_attrib(spans, len(text)) if spans else self._attrib
+        self._display = self.newline, text, attrib
+        return text, attrib
+
+    def _get_long_text(self):
+        """Return the text and attributes of the part of a long line."""
+        length = self.get_edit_len()
+        start, end = self.long_line_window()
+        part = self._edit_text[start:end]
+        if end == length and self.terminator:
+            part += self.newline
+        spans = [(attr, span_start - start,
+                  None if span_end is None else span_end - start)
+                 for attr, span_start, span_end in self.spans
+                 if span_start < end and (span_end is None or
+                                          span_end > start)]
+        marker = self.long_line_marker % (start, end, length)
+        if isinstance(part, bytes):
+            marker = marker.encode('ascii')
+        spans.append(('long line', len(part), None))
+        part += marker
+        return part, spans_to_attrib(spans, len(part))
 
 
 class LineWalker(urwid.ListWalker):
-    """A ListWalker for doctrine.code.Code objects."""
+    """A ListWalker for doctrine.code.Code objects.
+
+    Changes to the code should be made through the walker, so that other
+    walkers of a shared :class:`doctrine.urwid.document.Document` can
+    update the lines that changed.
+
+    The code is changed with the methods of doctrine.code.Code where
+    there is one for the change. Code has none that replaces many lines
+    at once, so for that the walker replaces them in the public list of
+    lines of the Code, code.lines, which is the text of the code, see
+    :meth:`_replace_lines`.
+    """
 
     def __init__(self, code, newline, layout):
         self.code = code
         self.newline = newline
         self.focus = 0
         self.layout = layout
+        self.document = None
+        self.dirty = DirtyLines()
+        self.folds = FoldIndex()
+        # A doctrine.urwid.memory.MemoryBudget the widgets report to
+        self.memory = None
+        # Passed on to the LineEdit widgets
+        self.long_line_length = None
+        self.long_line_rows = LineEdit.long_line_rows
+        # A doctrine.urwid.interning.LineInterner the widgets use, or None
+        self.interner = None
         self.widgets = []
+        self.selection = Selection()
+        self.cursors = Cursors()
+        self.bracket_pair = ()
+        self._batch_depth = 0
+        self._batch_modified = False
+        # The widgets shown in the last frame, that keep their canvases
+        self._shown = set()
+
+    def _modified(self):
+        if self._batch_depth:
+            self._batch_modified = True
+        else:
+            urwid.ListWalker._modified(self)
+
+    @contextmanager
+    def batch(self):
+        """Group changes so that they emit a single modified signal.
+
+        While in the batch, modified signals are held back, and so are
+        invalidations of the TextEditor. One signal is emitted when the
+        outermost batch ends, if anything was modified.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_modified:
+                self._batch_modified = False
+                self._modified()
+
+    def in_batch(self):
+        """Return True if changes are being batched."""
+        return bool(self._batch_depth)
+
+    def _replace_lines(self, row, removed, added):
+        """Replace lines of the code with a list of new lines.
+
+        This is done in code.lines, as doctrine.code.Code keeps the text
+        of the code in that list, and has no method that replaces many
+        lines in one go. Replacing them one at a time with split_row()
+        and delete_text() would take time proportional to the lines of
+        the whole code for each line.
+        """
+        self.code.lines[row:row + removed] = added
+
+    def _lines_changed(self, row, removed, added, edits=None):
+        self._remember_changed(row, added)
+        self.folds.update_lines(row, removed, added)
+        self._notify_changed(row, removed, added, edits)
+
+    def _notify_changed(self, row, removed, added, edits=None):
+        self.dirty.mark(row, removed, added)
+        if self.document is not None:
+            self.document.lines_changed(self, row, removed, added, edits)
+
+    def update_lines(self, row, removed, added, edits=None):
+        """Update the view after lines of the code were replaced.
+
+        Only the widgets of the replaced lines are updated, the widgets
+        of the other lines are kept. The focus, cursors and selection
+        stay on the same text, also on lines changed within the line,
+        that have a (col, removed, added) change in edits.
+        """
+        widgets = self.widgets
+        for pos in range(row, min(row + removed, row + added, len(widgets))):
+            widget = widgets[pos]
+            if widget is not None:
+                edit_pos = widget.edit_pos
+                widget.set_edit_text(self.code[pos])
+                if edits and pos in edits:
+                    widget.set_edit_pos(
+                        shift_column((pos, edit_pos), edits)[1])
+        if row + removed < len(widgets):
+            if added > removed:
+                widgets[row + removed:row + removed] = (
+                    [None] * (added - removed))
+            else:
+                self._forget(widgets[row + added:row + removed])
+                del widgets[row + added:row + removed]
+        elif len(widgets) > row + added:
+            self._forget(widgets[row + added:])
+            del widgets[row + added:]
+        self._remember_changed(row, min(removed, added))
+
+        self.folds.update_lines(row, removed, added)
+        # The brackets are matched again by the editor on the next keypress
+        self.set_bracket_pair(())
+        self.focus = shift_position((self.focus, 0), row, removed, added)[0]
+        self.selection.update_lines(row, removed, added, edits)
+        self.cursors.update_lines(row, removed, added, edits)
+        self._modified()
 
     def _make_widget(self, edit_text):
-        return LineEdit(edit_text, newline=self.newline, layout=self.layout)
+        edit = LineEdit(edit_text, newline=self.newline, layout=self.layout,
+                        interner=self.interner)
+        edit.long_line_length = self.long_line_length
+        edit.long_line_rows = self.long_line_rows
+        return edit
 
     def get_focus(self):
         return self._get_at_pos(self.focus)
 
     def set_focus(self, focus):
+        if self.folds.hidden(focus):
+            # Moving into a fold opens it
+            self.folds.unfold(focus)
         self.focus = focus
         self._modified()
 
     def get_next(self, start_from):
-        return self._get_at_pos(start_from + 1)
+        return self._get_at_pos(self.folds.next_row(start_from))
 
     def get_prev(self, start_from):
-        return self._get_at_pos(start_from - 1)
+        return self._get_at_pos(self.folds.prev_row(start_from))
+
+    def fold(self, start, end):
+        """Fold the lines from start up to end into one row.
+
+        The start line is shown with a marker of how many lines are
+        hidden, and the focus moves there if it was on a hidden line.
+        Returns the fold, or None if there is nothing to fold.
+        """
+        fold = self.folds.fold(start, min(end, len(self.code)))
+        if fold is not None:
+            if self.folds.hidden(self.focus):
+                self.focus = fold[0]
+            self._modified()
+        return fold
+
+    def unfold(self, row):
+        """Show the lines folded into the fold that row is in."""
+        fold = self.folds.unfold(row)
+        if fold is not None:
+            self._modified()
+        return fold
 
     def _get_at_pos(self, pos):
         """Return a widget for the line number passed."""
@@ -138,9 +759,18 @@ class LineWalker(urwid.ListWalker):
             return None, None
 
         l = len(self.widgets)
-        if pos < l:
+        if pos < l and self.widgets[pos] is not None:
             # we have that line so return it
-            return self.widgets[pos], pos
+            if instrument.enabled:
+                instrument.hit('walker.widgets')
+            edit = self.widgets[pos]
+            if self.memory is not None:
+                self._remember(edit, pos)
+            if edit.spans_version != self._spans_version():
+                self._update_spans(edit, pos)
+            if edit.folded or self.folds:
+                edit.set_folded(self.folds.hidden_after(pos))
+            return edit, pos
 
         # Fetch the line
         try:
@@ -149,50 +779,335 @@ class LineWalker(urwid.ListWalker):
             # Past end of file:
             return None, None
 
+        if instrument.enabled:
+            instrument.miss('walker.widgets')
         edit = self._make_widget(next_line)
         edit.set_edit_pos(0)
-        self.widgets.append(edit)
+        if pos < l:
+            self.widgets[pos] = edit
+        else:
+            # Lines we skipped past are filled in when they are needed.
+            self.widgets.extend([None] * (pos - l))
+            self.widgets.append(edit)
+        if self.memory is not None:
+            self._remember(edit, pos)
+        self._update_spans(edit, pos)
+        if self.folds:
+            edit.set_folded(self.folds.hidden_after(pos))
 
         return edit, pos
 
+    def set_bracket_pair(self, pair):
+        """Set the (row, col) positions of the brackets to highlight.
+
+        Only the spans of the lines the old and new brackets are on are
+        updated.
+        """
+        pair = tuple(pair)
+        if pair != self.bracket_pair:
+            rows = set(row for row, col in self.bracket_pair + pair)
+            self.bracket_pair = pair
+            for row in rows:
+                if row < len(self.widgets) and self.widgets[row] is not None:
+                    self._update_spans(self.widgets[row], row)
+            self._modified()
+
+    def _remember(self, edit, pos):
+        """Report the use of a widget to the memory budget."""
+        edit.row_hint = pos
+        # The size is measured again, as the text may have changed
+        size = text_size(edit.get_line_text()) + WIDGET_SIZE
+        if size != edit.memory_size or not self.memory.touch(self, edit):
+            edit.memory_size = size
+            self.memory.add(self, edit, size)
+
+    def _remember_changed(self, row, count):
+        """Report the new sizes of the widgets of changed lines."""
+        if self.memory is None:
+            return
+        for pos in range(row, min(row + count, len(self.widgets))):
+            if self.widgets[pos] is not None:
+                self._remember(self.widgets[pos], pos)
+
+    def _forget(self, widgets):
+        """Remove the widgets of removed lines from the memory budget."""
+        if self.memory is None:
+            return
+        for edit in widgets:
+            if edit is not None:
+                self.memory.discard(self, edit)
+
+    def keep_canvases(self, widgets):
+        """Keep the canvases of the widgets of a frame, and no others.
+
+        The kept canvases are not counted in the memory budget, so only
+        the lines that are shown keep one.
+        """
+        shown = set(widgets)
+        for edit in self._shown - shown:
+            edit.drop_canvas()
+        self._shown = shown
+
+    def evict(self, widgets):
+        """Drop widgets of lines, when over the memory budget.
+
+        The widgets are made again when their lines are shown. The widget
+        of the focus line is kept.
+        """
+        stale = []
+        for edit in widgets:
+            pos = edit.row_hint
+            if pos < len(self.widgets) and self.widgets[pos] is edit:
+                self._drop_widget(pos)
+            else:
+                stale.append(edit)
+        if stale:
+            # Lines were added or removed since the widgets were used, so
+            # look for them, and update the positions of all widgets.
+            stale = set(map(id, stale))
+            for pos, edit in enumerate(self.widgets):
+                if edit is None:
+                    continue
+                if id(edit) in stale:
+                    self._drop_widget(pos)
+                else:
+                    edit.row_hint = pos
+
+    def _drop_widget(self, pos):
+        if pos != self.focus:
+            urwid.CanvasCache.invalidate(self.widgets[pos])
+            self.widgets[pos] = None
+
+    def _spans_version(self):
+        return (self.selection.version, self.cursors.version)
+
+    def _update_spans(self, edit, pos):
+        spans = [('selection', start, end)
+                 for start, end in self.selection.row_spans(pos)]
+        spans.extend(('cursor', col, col + 1)
+                     for col in self.cursors.row_cols(pos))
+        spans.extend(('bracket', col, col + 1)
+                     for row, col in self.bracket_pair if row == pos)
+        edit.set_spans(spans)
+        edit.spans_version = self._spans_version()
+
+    def find(self, term, row, col):
+        """Return the (row, col) of the next match of term.
+
+        The search starts at the position passed and wraps around at
+        the end of the code. Returns None if there is no match.
+        """
+        rows = len(self.code)
+        for offset in range(rows + 1):
+            index = (row + offset) % rows
+            line = self.code[index]
+            if offset == 0:
+                found = line.find(term, col)
+            elif offset == rows:
+                # Back where we started, look before the start column.
+                found = line.find(term, 0, col + len(term) - 1)
+            else:
+                found = line.find(term)
+            if found != -1:
+                return index, found
+        return None
+
+    def set_lines(self, lines):
+        """Replace the text of several lines.
+
+        :param lines: The new text of each line, keyed on line number
+        :type lines: dict
+
+        Only the widgets of lines that have been displayed are updated,
+        each of them once, and the other views are told about each range
+        of adjacent lines once.
+        """
+        widgets = self.widgets
+        edits = {}
+        for row, text in lines.items():
+            edits[row] = text_change(self.code[row], text)
+            self.code[row] = text
+            if row < len(widgets) and widgets[row] is not None:
+                widgets[row].set_edit_text(text)
+        rows = sorted(lines)
+        for ignore, group in groupby(enumerate(rows),
+                                     lambda item: item[1] - item[0]):
+            group = [row for ignore, row in group]
+            self._lines_changed(group[0], len(group), len(group),
+                                dict((row, edits[row]) for row in group))
+        self._modified()
+
+    def get_range_text(self, from_row, from_col, to_row, to_col):
+        """Return the text between two positions."""
+        if from_row == to_row:
+            return self.code[from_row][from_col:to_col]
+        parts = [self.code[from_row][from_col:]]
+        parts.extend(self.code[row] for row in range(from_row + 1, to_row))
+        parts.append(self.code[to_row][:to_col])
+        return parts[0][:0].join(parts)
+
+    def delete_range(self, from_row, from_col, to_row, to_col):
+        """Delete the text between two positions.
+
+        The code is changed with one delete_text() call and the widgets
+        of the removed lines are dropped in one go, however many lines
+        the range spans.
+        """
+        with self.batch():
+            self.code.delete_text(from_row, from_col, to_row, to_col)
+            self._forget(self.widgets[from_row + 1:to_row + 1])
+            del self.widgets[from_row + 1:to_row + 1]
+            self.focus = from_row
+            widget, pos = self._get_at_pos(from_row)
+            widget.set_edit_text(self.code[from_row])
+            widget.set_edit_pos(from_col)
+            if from_row == to_row:
+                edits = {from_row: (from_col, to_col - from_col, 0)}
+            else:
+                edits = None
+            self._lines_changed(from_row, to_row - from_row + 1, 1, edits)
+            self._modified()
+
+    def insert_text(self, row, col, text):
+        """Insert text that may span several lines at a position.
+
+        Returns the (row, col) position after the inserted text.
+        """
+        with self.batch():
+            line = self.code[row]
+            lines = split_lines(text)
+            if len(lines) == 1 and lines[0][-1:] not in ONECHAR_NEWLINES:
+                self.code[row] = line[:col] + text + line[col:]
+                end = row, col + len(text)
+                edits = {row: (col, 0, len(text))}
+            else:
+                lines[0] = line[:col] + lines[0]
+                if lines[-1][-1:] in ONECHAR_NEWLINES:
+                    lines.append(line[col:])
+                else:
+                    lines[-1] += line[col:]
+                end = row + len(lines) - 1, len(lines[-1]) - len(line) + col
+                edits = None
+                self._replace_lines(row, 1, lines)
+                self.widgets[row + 1:row + 1] = [None] * (len(lines) - 1)
+            widget, pos = self._get_at_pos(row)
+            widget.set_edit_text(self.code[row])
+            self.focus = end[0]
+            widget, pos = self._get_at_pos(end[0])
+            widget.set_edit_pos(end[1])
+            self._lines_changed(row, 1, end[0] - row + 1, edits)
+            self._modified()
+            return end
+
+    def reload(self, lines):
+        """Replace the code with new lines, only changing what differs.
+
+        The lines are compared with
+        :func:`doctrine.urwid.linediff.diff_lines`, and only the changed
+        hunks are replaced in the code and the widget cache, so the
+        widgets and layouts of the unchanged lines are kept. The focus,
+        cursors and selection stay on the same lines, or on the last line
+        that replaced them.
+
+        Returns True if anything changed.
+        """
+        new = list(lines)
+        hunks = [(old_start, old_end - old_start, new[new_start:new_end])
+                 for old_start, old_end, new_start, new_end
+                 in diff_lines(self.code.lines, new)]
+        if not hunks:
+            return False
+
+        with self.batch():
+            # From the end, so the earlier rows stay valid
+            for row, removed, added in reversed(hunks):
+                self._replace_lines(row, removed, added)
+                self.update_lines(row, removed, len(added))
+                self._notify_changed(row, removed, len(added))
+            self.focus = min(self.focus, len(self.code) - 1)
+        return True
+
     def split_focus(self, insertion):
         """The focus line has been split into two"""
-        pos = self.focus
-        focus_widget = self.widgets[pos]
-        col = focus_widget.edit_pos
-        self.code.split_row(pos, col, insertion)
-        self.widgets[pos].set_edit_text(self.code[pos])
-        new_widget = self._make_widget(self.code[pos + 1])
-        new_widget.set_edit_pos(0)
-        self.widgets.insert(self.focus + 1, new_widget)
-        self.set_focus(pos + 1)
+        with self.batch():
+            pos = self.focus
+            focus_widget = self.widgets[pos]
+            col = focus_widget.edit_pos
+            self.code.split_row(pos, col, insertion)
+            self.widgets[pos].set_edit_text(self.code[pos])
+            new_widget = self._make_widget(self.code[pos + 1])
+            new_widget.set_edit_pos(0)
+            self.widgets.insert(self.focus + 1, new_widget)
+            self._lines_changed(pos, 1, 2)
+            self.set_focus(pos + 1)
 
     def combine_focus_with_prev(self):
         """Combine the focus edit widget with the one above."""
-        focus_widget, pos = self.get_prev(self.focus)
-        focus_widget.set_edit_pos(focus_widget.get_edit_len())
-        self.code.merge_rows(pos, pos + 1)
-        focus_widget.set_edit_text(self.code[pos])
-        del self.widgets[pos + 1]
-        self.focus = pos
+        with self.batch():
+            # Not get_prev(), which steps over folds
+            focus_widget, pos = self._get_at_pos(self.focus - 1)
+            focus_widget.set_edit_pos(focus_widget.get_edit_len())
+            self.code.merge_rows(pos, pos + 1)
+            focus_widget.set_edit_text(self.code[pos])
+            self._forget(self.widgets[pos + 1:pos + 2])
+            del self.widgets[pos + 1]
+            self.focus = pos
+            self._lines_changed(pos, 2, 1)
+            self._modified()
 
     def combine_focus_with_next(self):
         """Combine the focus edit widget with the one below."""
-        pos = self.focus
-        focus_widget, ignore = self.get_next(pos)
-        self.code.merge_rows(pos, pos + 1)
-        focus_widget.set_edit_text(self.code[pos])
-        focus_widget.set_edit_pos(self.widgets[pos].edit_pos)
-        del self.widgets[pos]
+        with self.batch():
+            pos = self.focus
+            focus_widget, ignore = self._get_at_pos(pos + 1)
+            self.code.merge_rows(pos, pos + 1)
+            focus_widget.set_edit_text(self.code[pos])
+            focus_widget.set_edit_pos(self.widgets[pos].edit_pos)
+            self._forget(self.widgets[pos:pos + 1])
+            del self.widgets[pos]
+            self._lines_changed(pos, 2, 1)
+            self._modified()
 
 
 class EditorConfig(object):
     """This holds the configuration for a TextEditor."""
     newline = u'↲'
     screen_encoding = 'UTF-8'
+    # Render at most this many times per second, None means no limit.
+    # Needs TextEditor.set_event_loop() to be called.
+    max_fps = None
+    # The directory to cache line indexes of opened files in, None
+    # disables the cache. See TextEditor.open_index().
+    index_dir = None
+    # Highlight the bracket at the cursor and its partner
+    match_brackets = False
+    # The most bytes the caches of an editor may use, None is no limit.
+    # Editors that share a Document share the budget.
+    memory_budget = None
+    # Lines longer than this are shown long_line_rows rows at a time,
+    # wrapped at any character, with a 'long line' marker. None means
+    # all lines are laid out in full.
+    long_line_length = 100000
+    long_line_rows = 50
+    # Make equal lines share one string, and one layout. Saves memory for
+    # logs and other texts that repeat lines a lot.
+    intern_lines = False
+    # Ctrl-C is not used, as urwid's raw_display gets it as an interrupt
+    # signal, unless the screen is told not to with tty_signal_keys().
     command_map = {
         'backspace': ERASE_LEFT,
         'delete': ERASE_RIGHT,
+        'ctrl x': CUT,
+        'meta c': COPY,
+        'ctrl v': PASTE,
+        'meta d': ADD_CURSOR_NEXT_MATCH,
+        'meta up': ADD_CURSOR_ABOVE,
+        'meta down': ADD_CURSOR_BELOW,
+        'ctrl left': WORD_LEFT,
+        'ctrl right': WORD_RIGHT,
+        'ctrl w': ERASE_WORD_LEFT,
+        'meta backspace': ERASE_WORD_LEFT,
+        'ctrl delete': ERASE_WORD_RIGHT,
     }
 
     def __init__(self, **kw):
@@ -202,21 +1117,405 @@ class EditorConfig(object):
 class TextEditor(urwid.ListBox):
     """An Urwid code editor widget.
 
-    :param code: The code object to be edited
-    :type code: doctrine.code.Code
+    :param code: The code object to be edited, or a Document to show the
+                 code of in several editors.
+    :type code: doctrine.code.Code or doctrine.urwid.document.Document
     """
 
     _sizing = frozenset(['box'])
 
     def __init__(self, code, config):
-        walker = LineWalker(code, newline=config.newline,
-                            layout=CodeLayout())
+        if isinstance(code, Document):
+            document = code
+            walker = LineWalker(document.code, newline=config.newline,
+                                layout=document.layout)
+            document.connect(walker)
+        else:
+            walker = LineWalker(code, newline=config.newline,
+                                layout=CodeLayout())
+        if config.memory_budget:
+            if walker.layout.memory is None:
+                walker.layout.memory = MemoryBudget(config.memory_budget)
+            walker.memory = walker.layout.memory
+        walker.long_line_length = config.long_line_length
+        walker.long_line_rows = config.long_line_rows
         self.parser = None
+        self.clipboard = None
+        self.throttle = None
+        self.line_index = None
+        self.brackets = None
+        self._anchor = None
         urwid.ListBox.__init__(self, walker)
         self.config = config
         self.codec = codecs.getencoder(config.screen_encoding)
         for k, v in self.config.command_map.items():
             self._command_map[k] = v
+        if config.intern_lines:
+            # The interner follows the edits of all editors of the code
+            document = self.get_document()
+            if document.interner is None:
+                document.interner = LineInterner(document.code)
+                document.add_listener(document.interner)
+            walker.interner = document.interner
+        if config.match_brackets:
+            self.update_bracket_pair()
+
+    def set_event_loop(self, event_loop):
+        """Set the urwid event loop that the editor runs in.
+
+        This enables the redraw limit of config.max_fps. Keys are still
+        applied at once, but within a frame the last canvas is reused,
+        and the event loop is used to draw the end result when the frame
+        is over. A LineNosWidget, MinimapWidget or ScrollbarWidget around
+        the editor reuses its canvas in the same frames.
+        """
+        if self.config.max_fps:
+            self.throttle = RedrawThrottle(self.config.max_fps, event_loop)
+
+    def open_index(self, path, encoding='utf-8'):
+        """Load the line index of the file the code was read from.
+
+        The index has the byte offsets of the lines in the file and the
+        number of screen rows of each line, and is memory mapped from the
+        cache in config.index_dir. A stale cache is rebuilt, only
+        indexing the new lines if the file was appended to. A
+        :class:`doctrine.urwid.scrollbar.ScrollbarWidget` uses its row
+        counts until the code is edited, but only for widths that are
+        already indexed. Index a new width with ``index.rows(width)``,
+        which lays out the whole file, so do it outside of rendering.
+
+        Returns the :class:`doctrine.urwid.lineindex.LineIndex`, or None
+        if config.index_dir is not set.
+        """
+        if self.config.index_dir is None:
+            return None
+        if self.line_index is not None:
+            self.line_index.close()
+        self.line_index = LineIndex.open(
+            path, self.config.index_dir, newline=self.config.newline,
+            encoding=encoding, layout=self.body.layout)
+        return self.line_index
+
+    def render(self, size, focus=False):
+        if self.throttle is not None:
+            return self.throttle.render(self, size, focus, self._render)
+        return self._render(size, focus)
+
+    def _render(self, size, focus):
+        canvas = urwid.ListBox.render(self, size, focus)
+        middle, top, bottom = self.calculate_visible(size, focus)
+        if middle is not None:
+            self.body.keep_canvases(
+                [middle[1]] + [widget for widget, pos, rows
+                               in top[1] + bottom[1]])
+        return canvas
+
+    def update_bracket_pair(self):
+        """Highlight the bracket at the cursor and its partner.
+
+        This is done after every keypress and mouse event when
+        config.match_brackets is set. Call it after moving the cursor in
+        other ways.
+        """
+        self.body.set_bracket_pair(self.match_bracket())
+
+    def match_bracket(self):
+        """Return the positions of the bracket at the cursor and its partner.
+
+        The bracket after the cursor is matched first, then the one before
+        it. Returns an empty tuple if neither has a partner. The partners
+        are found with a :class:`doctrine.urwid.brackets.BracketIndex`.
+        """
+        if self.brackets is None:
+            self.brackets = BracketIndex(self.body.code)
+            self.get_document().add_listener(self.brackets)
+        row, col = self.get_cursor_position()
+        length = self.body.long_line_length
+        if length is not None and len(self.body.code[row]) > length:
+            # Scanning the line would take too long
+            return ()
+        for pos in (col, col - 1):
+            if pos < 0:
+                continue
+            partner = self.brackets.match(row, pos)
+            if partner is not None:
+                return (row, pos), partner
+        return ()
+
+    document = property(lambda self: self.body.document, doc="""
+        The :class:`doctrine.urwid.document.Document` this editor shares
+        with other editors, or None.
+        """)
+
+    def split(self):
+        """Return a new editor showing the same code.
+
+        The editors share a :class:`doctrine.urwid.document.Document`, and
+        with it the layouts of the lines, but each has its own focus,
+        cursors and selection. Changes made in one editor only update the
+        changed lines in the others.
+        """
+        return TextEditor(self.get_document(), self.config)
+
+    def get_document(self):
+        """Return the Document of this editor, making one if it has none."""
+        if self.body.document is None:
+            document = Document(self.body.code, self.body.layout,
+                                dirty=self.body.dirty)
+            document.connect(self.body)
+        return self.body.document
+
+    def reload(self, code):
+        """Show the text of another code object, keeping what is the same.
+
+        Use this when the file changed on disk. Only the lines that differ
+        are replaced, and the focus and scroll position stay on the same
+        line.
+
+        :param code: The code object with the new text
+        :type code: doctrine.code.Code
+        """
+        self._anchor = None
+        changed = self.body.reload(code.lines)
+        # The lines are now the same as in the file
+        self.body.dirty.clear()
+        return changed
+
+    folds = property(lambda self: self.body.folds, doc="""
+        The :class:`doctrine.urwid.folding.FoldIndex` of this editor. Fold
+        and unfold lines with LineWalker.fold() and LineWalker.unfold().
+        """)
+
+    memory = property(lambda self: self.body.memory, doc="""
+        The :class:`doctrine.urwid.memory.MemoryBudget` of this editor, or
+        None if config.memory_budget is not set.
+        """)
+
+    dirty = property(lambda self: self.body.dirty, doc="""
+        The :class:`doctrine.urwid.autosave.DirtyLines` with the lines
+        changed since the code was last saved. It is false if nothing
+        changed.
+        """)
+
+    selection = property(lambda self: self.body.selection, doc="""
+        The :class:`doctrine.urwid.selection.Selection` of this editor.
+        """)
+
+    def get_cursor_position(self):
+        """Return the (row, col) position of the cursor in the code."""
+        focus_widget, pos = self.body.get_focus()
+        return pos, focus_widget.edit_pos
+
+    def select(self, from_row, from_col, to_row, to_col):
+        """Select the text between two positions."""
+        self.clear_cursors()
+        self.selection.set((from_row, from_col), (to_row, to_col))
+        self._anchor = None
+        self._invalidate()
+
+    def add_selection(self, from_row, from_col, to_row, to_col):
+        """Add the text between two positions to the selection."""
+        self.selection.add((from_row, from_col), (to_row, to_col))
+        self._invalidate()
+
+    def clear_selection(self):
+        """Deselect everything."""
+        self._anchor = None
+        if self.selection:
+            self.selection.clear()
+            self._invalidate()
+
+    def get_selected_text(self):
+        """Return the selected text.
+
+        The text of each selected range is joined by a newline.
+        """
+        texts = [self.body.get_range_text(start[0], start[1], end[0], end[1])
+                 for start, end in self.selection]
+        if not texts:
+            return None
+        if isinstance(texts[0], bytes):
+            return B('\n').join(texts)
+        return u'\n'.join(texts)
+
+    def delete_selection(self):
+        """Delete all selected text.
+
+        Each range is removed with a single delete_text() on the code,
+        starting from the end so that the earlier positions stay valid.
+        The cursor ends up where the first range started.
+        """
+        for start, end in reversed(self.selection.ranges):
+            self.body.delete_range(start[0], start[1], end[0], end[1])
+        self.clear_selection()
+
+    def copy(self):
+        """Copy the selected text to the clipboard."""
+        if self.selection:
+            self.clipboard = self.get_selected_text()
+
+    def cut(self):
+        """Move the selected text to the clipboard."""
+        if self.selection:
+            self.copy()
+            self.delete_selection()
+
+    def paste(self):
+        """Replace the selection with the clipboard text."""
+        if self.clipboard is None:
+            return
+        if self.selection:
+            self.delete_selection()
+        row, col = self.get_cursor_position()
+        self.body.insert_text(row, col, self.clipboard)
+
+    cursors = property(lambda self: self.body.cursors, doc="""
+        The extra :class:`doctrine.urwid.selection.Cursors` of this editor.
+        """)
+
+    def add_cursor(self, row, col):
+        """Add an extra cursor.
+
+        Edits are made at all the cursors at once, until the cursors are
+        cleared, or the main cursor moves to another line.
+        """
+        self.clear_selection()
+        if (row, col) != self.get_cursor_position():
+            self.cursors.add(row, min(col, line_length(self.body.code[row])))
+            self._invalidate()
+
+    def add_cursors_in_column(self, from_row, to_row, col):
+        """Add a cursor to each line in a column block.
+
+        The cursor is placed at the end of lines that are too short.
+        """
+        if to_row < from_row:
+            from_row, to_row = to_row, from_row
+        for row in range(from_row, to_row + 1):
+            self.add_cursor(row, col)
+
+    def add_cursor_at_next_match(self):
+        """Add a cursor at the next match of the word at the cursor.
+
+        If there is a selection on one line, the selected text is looked
+        for instead. The new cursor is placed at the same place in the
+        match as the main cursor is in its word.
+        Returns False if there is no other match.
+        """
+        row, col = self.get_cursor_position()
+        ranges = self.selection.ranges
+        if len(ranges) == 1 and ranges[0][0][0] == ranges[0][1][0] == row:
+            (row, start), (row, end) = ranges[0]
+        else:
+            span = word_at(self.body.code[row], col)
+            if span is None:
+                return False
+            start, end = span
+        term = self.body.code[row][start:end]
+        offset = col - start
+
+        last_row, last_col = max(self.cursors.positions + [(row, col)])
+        found = self.body.find(term, last_row, last_col - offset + len(term))
+        if found is None or found == (row, start):
+            return False
+        self.add_cursor(found[0], found[1] + offset)
+        return True
+
+    def clear_cursors(self):
+        """Remove the extra cursors."""
+        if self.cursors:
+            self.cursors.clear()
+            self._invalidate()
+
+    def _add_cursor_vertical(self, size, command):
+        """Add a cursor where the main cursor is, and move it up or down."""
+        row, col = self.get_cursor_position()
+        cursors = list(self.cursors.positions)
+        if command == ADD_CURSOR_ABOVE:
+            unhandled = self._keypress_up(size)
+        else:
+            unhandled = self._keypress_down(size)
+        if unhandled or self.get_cursor_position()[0] == row:
+            return
+        self.cursors.set(cursors + [(row, col)])
+        self._invalidate()
+
+    def _keypress_cursors(self, key, command):
+        """Apply a keystroke at all cursors as one batched edit.
+
+        All cursor positions are adjusted in one sweep per line, and
+        each changed line is updated in the code, and laid out, once.
+        Returns False if the keystroke is not one that can be applied
+        at several cursors.
+        """
+        if self._valid_char(key) or key == 'tab':
+            insertion = '\t' if key == 'tab' else key
+        elif command in (ERASE_LEFT, ERASE_RIGHT, urwid.CURSOR_LEFT,
+                         urwid.CURSOR_RIGHT, urwid.CURSOR_MAX_LEFT,
+                         urwid.CURSOR_MAX_RIGHT):
+            insertion = None
+        else:
+            return False
+
+        focus_widget, focus_pos = self.body.get_focus()
+        main = focus_pos, focus_widget.edit_pos
+        positions = sorted(set(self.cursors.positions + [main]))
+        main_index = positions.index(main)
+
+        code = self.body.code
+        changed = {}
+        result = []
+        for row, row_positions in groupby(positions, lambda p: p[0]):
+            text = code[row]
+            cols = [col for ignore, col in row_positions]
+            end = line_length(text)
+            if insertion is not None:
+                ranges = [(col, col) for col in cols]
+            elif command == ERASE_LEFT:
+                ranges = [(move_prev_char(text, 0, col) if col else col, col)
+                          for col in cols]
+            elif command == ERASE_RIGHT:
+                ranges = [(col, move_next_char(text, col, end)
+                           if col < end else col) for col in cols]
+            elif command == urwid.CURSOR_LEFT:
+                ranges = None
+                cols = [move_prev_char(text, 0, col) if col else col
+                        for col in cols]
+            elif command == urwid.CURSOR_RIGHT:
+                ranges = None
+                cols = [move_next_char(text, col, end) if col < end else col
+                        for col in cols]
+            else:
+                ranges = None
+                cols = [0 if command == urwid.CURSOR_MAX_LEFT else end
+                        for col in cols]
+
+            if ranges is not None:
+                new_text, cols = replace_ranges(text, ranges,
+                                                insertion or text[:0])
+                if new_text != text:
+                    changed[row] = new_text
+            result.extend((row, col) for col in cols)
+
+        if changed:
+            self.body.set_lines(changed)
+        main = result.pop(main_index)
+        focus_widget.set_edit_pos(main[1])
+        self.cursors.set(p for p in result if p != main)
+        self._invalidate()
+        return True
+
+    def _keypress_select(self, size, key):
+        """Move the cursor with key and select from where it was."""
+        self.clear_cursors()
+        anchor = self._anchor
+        if anchor is None or not self.selection:
+            anchor = self.get_cursor_position()
+        result = self.keypress(size, key)
+        self.selection.set(anchor, self.get_cursor_position())
+        self._anchor = anchor
+        self._invalidate()
+        return result
 
     def _valid_char(self, ch):
         """
@@ -233,12 +1532,34 @@ class TextEditor(urwid.ListBox):
         """Inserts a character at the current edit position."""
         col = focus_widget.edit_pos
         text = self.body.code[pos]
-        text = text[:col] + key + text[col:]
-        self.body.code[pos] = text
-        focus_widget.set_edit_text(text)
+        self.body.set_lines({pos: text[:col] + key + text[col:]})
         focus_widget.set_edit_pos(col + 1)
 
+    def _invalidate(self):
+        if self.body.in_batch():
+            # The walker signals modified when the batch ends.
+            self.body._modified()
+            return
+        urwid.ListBox._invalidate(self)
+
     def keypress(self, size, key):
+        # Keypresses often take several steps, like moving the focus and
+        # then the cursor, so batch them to redraw only once.
+        with self.body.batch():
+            key = self._keypress(size, key)
+            if self.config.match_brackets:
+                self.update_bracket_pair()
+            return key
+
+    def mouse_event(self, size, event, button, col, row, focus):
+        with self.body.batch():
+            handled = urwid.ListBox.mouse_event(self, size, event, button,
+                                                col, row, focus)
+            if self.config.match_brackets:
+                self.update_bracket_pair()
+            return handled
+
+    def _keypress(self, size, key):
         (maxcol, maxrow) = size
 
         focus_widget, pos = self.body.get_focus()
@@ -252,6 +1573,25 @@ class TextEditor(urwid.ListBox):
         if self.set_focus_pending or self.set_focus_valign_pending:
             self._set_focus_complete((maxcol, maxrow), focus=True)
 
+        if (key.startswith('shift ') and
+           self._command_map[key[6:]] in MOVEMENT_COMMANDS):
+            return self._keypress_select(size, key[6:])
+
+        if self.selection and (self._valid_char(key) or
+                               key in ('tab', 'enter')):
+            # Typing replaces the selected text
+            self.delete_selection()
+            focus_widget, pos = self.body.get_focus()
+
+        command = self._command_map[key]
+        if self.cursors and command not in (ADD_CURSOR_NEXT_MATCH,
+                                            ADD_CURSOR_ABOVE,
+                                            ADD_CURSOR_BELOW):
+            if self._keypress_cursors(key, command):
+                return
+            # Anything else only applies to the main cursor
+            self.clear_cursors()
+
         if self._valid_char(key):
             self._insert_char(key, focus_widget, pos)
             return
@@ -268,7 +1608,34 @@ class TextEditor(urwid.ListBox):
             self.body.split_focus('\n')
             return
 
-        command = self._command_map[key]
+        if command in MOVEMENT_COMMANDS:
+            self.clear_selection()
+
+        if command == ADD_CURSOR_NEXT_MATCH:
+            self.add_cursor_at_next_match()
+            return
+
+        if command in (ADD_CURSOR_ABOVE, ADD_CURSOR_BELOW):
+            self._add_cursor_vertical((maxcol, maxrow), command)
+            return
+
+        if command == CUT:
+            self.cut()
+            return
+
+        if command == COPY:
+            self.copy()
+            return
+
+        if command == PASTE:
+            self.paste()
+            return
+
+        if command in (ERASE_LEFT, ERASE_RIGHT, ERASE_WORD_LEFT,
+                       ERASE_WORD_RIGHT) and self.selection:
+            self.delete_selection()
+            return
+
         # pass off the heavy lifting
         if command == urwid.CURSOR_UP:
             return actual_key(self._keypress_up((maxcol, maxrow)))
@@ -293,7 +1660,7 @@ class TextEditor(urwid.ListBox):
         if command == urwid.CURSOR_LEFT:
             col = focus_widget.edit_pos
             if col != 0:
-                col = move_prev_char(focus_widget.edit_text, 0, col)
+                col = move_prev_char(focus_widget.get_line_text(), 0, col)
                 focus_widget.set_edit_pos(col)
                 return
 
@@ -311,8 +1678,7 @@ class TextEditor(urwid.ListBox):
             col = focus_widget.edit_pos
             l = focus_widget.get_edit_len()
             if col < l:
-                col = move_next_char(focus_widget.edit_text, col,
-                                     len(focus_widget.edit_text))
+                col = move_next_char(focus_widget.get_line_text(), col, l)
                 focus_widget.set_edit_pos(col)
                 return
 
@@ -326,6 +1692,25 @@ class TextEditor(urwid.ListBox):
             self.keypress(size, "home")
             return
 
+        if command == WORD_LEFT:
+            col = focus_widget.edit_pos
+            if col == 0:
+                # Start of line, move to the end of the previous line
+                return actual_key(self.keypress(size, 'left'))
+            start = focus_widget.prev_word_start(col)
+            focus_widget.set_edit_pos(start or 0)
+            return
+
+        if command == WORD_RIGHT:
+            col = focus_widget.edit_pos
+            end = focus_widget.get_edit_len()
+            if col == end:
+                # End of line, move to the start of the next line
+                return actual_key(self.keypress(size, 'right'))
+            word_end = focus_widget.next_word_end(col)
+            focus_widget.set_edit_pos(end if word_end is None else word_end)
+            return
+
         if command == ERASE_LEFT:
             col = focus_widget.edit_pos
             if col == 0:
@@ -335,9 +1720,7 @@ class TextEditor(urwid.ListBox):
                 # Merge the lines
                 self.body.combine_focus_with_prev()
                 return
-            self.body.code.delete_text(pos, col-1, pos, col)
-            focus_widget.set_edit_text(self.body.code[pos])
-            focus_widget.set_edit_pos(col-1)
+            self.body.delete_range(pos, col-1, pos, col)
             return
 
         if command == ERASE_RIGHT:
@@ -351,8 +1734,51 @@ class TextEditor(urwid.ListBox):
                 # Merge the lines
                 self.body.combine_focus_with_next()
                 return
-            self.body.code.delete_text(pos, col, pos, col + 1)
-            focus_widget.set_edit_text(self.body.code[pos])
+            self.body.delete_range(pos, col, pos, col + 1)
+            return
+
+        if command == ERASE_WORD_LEFT:
+            col = focus_widget.edit_pos
+            if col == 0:
+                # Merge with the line above, like erasing a character
+                return actual_key(self.keypress(size, 'backspace'))
+            start = focus_widget.prev_word_start(col) or 0
+            self.body.delete_range(pos, start, pos, col)
+            return
+
+        if command == ERASE_WORD_RIGHT:
+            col = focus_widget.edit_pos
+            end = focus_widget.get_edit_len()
+            if col == end:
+                return actual_key(self.keypress(size, 'delete'))
+            word_end = focus_widget.next_word_end(col)
+            self.body.delete_range(pos, col, pos,
+                                   end if word_end is None else word_end)
             return
 
         return key
+
+
+def _line_args(walker, *args, **kw):
+    return {'line': walker.focus}
+
+
+def _render_args(widget, size, focus=False):
+    return {'width': size[0], 'height': size[1]}
+
+
+instrument.get_counter('walker.widgets')
+instrument.get_counter('edit.words')
+instrument.get_counter('edit.text')
+instrument.get_counter('edit.render')
+instrument.get_counter('lineno.render')
+instrument.probe(LineWalker, '_make_widget', 'walker.make_widget',
+                 lambda walker, text: {'length': len(text)})
+for method in ('split_focus', 'combine_focus_with_prev',
+               'combine_focus_with_next', 'delete_range', 'insert_text',
+               'set_lines', 'update_lines', 'reload'):
+    instrument.probe(LineWalker, method, 'walker.' + method, _line_args)
+instrument.probe(LineNosWidget, 'render', 'linenos.render', _render_args)
+instrument.probe(TextEditor, 'keypress', 'editor.keypress',
+                 lambda editor, size, key: {'key': key})
+instrument.probe(TextEditor, 'render', 'editor.render', _render_args)
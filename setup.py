@@ -23,7 +23,8 @@ setup(name='doctrine.urwid',
       author_email='regebro@gmail.com',
       url='https://github.com/regebro/doctrine.urwid',
       license='MIT',
-      packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
+      packages=find_packages(exclude=['ez_setup', 'examples', 'tests',
+                                      'benchmarks']),
       include_package_data=True,
       zip_safe=False,
       test_suite='tests',
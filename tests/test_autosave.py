@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from doctrine import code
+from doctrine import urwid
+from doctrine.urwid.autosave import Autosave, DirtyLines
+
+TEXT = u'first line\nsecond line\nthird line\nfourth line\nlast line\n'
+
+
+class DirtyLinesTest(unittest.TestCase):
+
+    def test_mark(self):
+        dirty = DirtyLines()
+        self.assertFalse(dirty)
+        dirty.mark(5, 1, 1)
+        dirty.mark(1, 1, 1)
+        self.assertTrue(dirty)
+        self.assertEqual(dirty.ranges, [(1, 2), (5, 6)])
+        # Splitting a line moves the ranges after it
+        dirty.mark(3, 1, 2)
+        self.assertEqual(dirty.ranges, [(1, 2), (3, 5), (6, 7)])
+        # Touching ranges are merged
+        dirty.mark(2, 1, 1)
+        self.assertEqual(dirty.ranges, [(1, 5), (6, 7)])
+        # Joining lines moves them back
+        dirty.mark(4, 2, 1)
+        self.assertEqual(dirty.ranges, [(1, 6)])
+
+    def test_removed(self):
+        dirty = DirtyLines()
+        dirty.mark(3, 2, 0)
+        self.assertTrue(dirty)
+        self.assertEqual(dirty.ranges, [(3, 3)])
+        dirty.mark(0, 1, 1)
+        self.assertEqual(dirty.ranges, [(0, 1), (3, 3)])
+
+    def test_clear(self):
+        dirty = DirtyLines()
+        dirty.mark(0, 1, 1)
+        version = dirty.version
+        dirty.mark(1, 1, 1)
+        self.assertFalse(dirty.clear(version))
+        self.assertTrue(dirty)
+        self.assertTrue(dirty.clear(dirty.version))
+        self.assertFalse(dirty)
+
+
+class AutosaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'code.txt')
+        with io.open(self.path, 'wt', encoding='utf-8', newline='') as f:
+            f.write(TEXT)
+        self.editor = urwid.TextEditor(code.Code(io.StringIO(TEXT)),
+                                       urwid.EditorConfig())
+        self.size = (40, 10)
+        self.editor.render(self.size, focus=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        with io.open(self.path, 'rt', encoding='utf-8', newline='') as f:
+            return f.read()
+
+    def test_clean(self):
+        autosave = Autosave(self.editor, self.path)
+        self.assertFalse(self.editor.dirty)
+        self.assertFalse(autosave.save())
+        self.assertEqual(autosave.saves, 0)
+
+    def test_save(self):
+        autosave = Autosave(self.editor, self.path)
+        self.editor.keypress(self.size, u'ö')
+        self.editor.keypress(self.size, 'enter')
+        self.assertEqual(self.editor.dirty.ranges, [(0, 2)])
+        self.assertTrue(autosave.save())
+        autosave.wait()
+        self.assertIsNone(autosave.error)
+        self.assertEqual(self.read(), u'ö\n' + TEXT)
+        self.assertFalse(self.editor.dirty)
+        self.assertEqual(os.listdir(self.tmpdir), ['code.txt'])
+
+    def test_edit_while_saving(self):
+        autosave = Autosave(self.editor, self.path)
+        self.editor.keypress(self.size, 'x')
+        self.assertTrue(autosave.save())
+        # This change is not in the snapshot, and stays dirty
+        self.editor.keypress(self.size, 'y')
+        autosave.wait()
+        self.assertEqual(self.read(), u'x' + TEXT)
+        self.assertTrue(self.editor.dirty)
+        self.assertTrue(autosave.save())
+        autosave.wait()
+        self.assertEqual(self.read(), u'xy' + TEXT)
+        self.assertFalse(self.editor.dirty)
+
+    def test_error(self):
+        errors = []
+        autosave = Autosave(self.editor,
+                            os.path.join(self.tmpdir, 'missing', 'code.txt'),
+                            on_error=errors.append)
+        self.editor.keypress(self.size, 'x')
+        autosave.save()
+        autosave.wait()
+        self.assertIsNotNone(autosave.error)
+        self.assertEqual(errors, [autosave.error])
+        self.assertTrue(self.editor.dirty)
+
+    def test_split(self):
+        self.editor.keypress(self.size, 'x')
+        other = self.editor.split()
+        self.assertIs(other.dirty, self.editor.dirty)
+        other.keypress(self.size, 'down')
+        other.keypress(self.size, 'y')
+        self.assertEqual(self.editor.dirty.ranges, [(0, 2)])
+
+    def test_reload(self):
+        self.editor.keypress(self.size, 'x')
+        self.editor.reload(code.Code(io.StringIO(TEXT)))
+        self.assertFalse(self.editor.dirty)
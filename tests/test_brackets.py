@@ -0,0 +1,170 @@
+# -*- coding: UTF-8 -*-
+import io
+import random
+import unittest
+
+from doctrine import code
+from doctrine import urwid
+from doctrine.urwid.brackets import BracketIndex, line_summary
+
+TEXT = u"""{
+    "list": [1, 2, (3)],
+    "dict": {
+        "a": "b"
+    }
+}
+)
+"""
+
+
+def naive_match(lines, row, col):
+    """Find the partner of a bracket by scanning the whole text."""
+    text = u''.join(lines)
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line))
+    pos = starts[row] + col
+    char = text[pos]
+    step = 1 if char in u'([{' else -1
+    depth = 0
+    while 0 <= pos < len(text):
+        if text[pos] in u'([{':
+            depth += step
+        elif text[pos] in u')]}':
+            depth -= step
+        if depth == 0:
+            found_row = max(r for r in range(len(lines)) if starts[r] <= pos)
+            found = found_row, pos - starts[found_row]
+            pair = {u'(': u')', u'[': u']', u'{': u'}'}
+            opening, closing = sorted([char, text[pos]],
+                                      key=lambda c: c not in pair)
+            if pair.get(opening) != closing:
+                return None
+            return found
+        pos += step
+    return None
+
+
+class BracketIndexTest(unittest.TestCase):
+
+    def index(self, text):
+        index = BracketIndex(code.Code(io.StringIO(text)))
+        index.chunk_size = 2
+        return index
+
+    def test_summary(self):
+        self.assertEqual(line_summary(u'a(b)c'), (0, 0))
+        self.assertEqual(line_summary(u')) ((('), (1, -2))
+
+    def test_match(self):
+        index = self.index(TEXT)
+        self.assertEqual(index.match(0, 0), (5, 0))
+        self.assertEqual(index.match(5, 0), (0, 0))
+        self.assertEqual(index.match(1, 12), (1, 22))
+        self.assertEqual(index.match(1, 21), (1, 19))
+        self.assertEqual(index.match(2, 12), (4, 4))
+        self.assertEqual(index.match(4, 4), (2, 12))
+        # Not a bracket, and an unmatched bracket
+        self.assertIsNone(index.match(1, 4))
+        self.assertIsNone(index.match(6, 0))
+
+    def test_mismatch(self):
+        index = self.index(u'(\n]\n')
+        self.assertIsNone(index.match(0, 0))
+        self.assertIsNone(index.match(1, 0))
+
+    def test_bytes(self):
+        index = BracketIndex(code.Code(io.BytesIO(TEXT.encode('ascii'))))
+        self.assertEqual(index.match(2, 12), (4, 4))
+
+    def test_lazy(self):
+        lines = [u'(\n'] + [u'x\n'] * 1000 + [u')\n']
+        index = BracketIndex(code.Code(io.StringIO(u''.join(lines))))
+        self.assertEqual(index.match(0, 0), (1001, 0))
+        # Only the chunks after the bracket were summarized
+        self.assertEqual(index._chunks[0][0], None)
+        # And the next search uses the tree
+        summarized = [len([s for s in chunk if s is not None])
+                      for chunk in index._chunks]
+        self.assertEqual(index.match(1001, 0), (0, 0))
+        self.assertEqual(summarized[1:],
+                         [len([s for s in chunk if s is not None])
+                          for chunk in index._chunks][1:])
+
+    def test_edits(self):
+        rng = random.Random(42)
+        codeob = code.Code(io.StringIO(u''.join(
+            u''.join(rng.choice(u'([{x}])') for i in range(rng.randint(0, 4)))
+            + u'\n' for row in range(60))))
+        index = BracketIndex(codeob)
+        index.chunk_size = 4
+        for step in range(300):
+            lines = codeob.lines
+            row = rng.randrange(len(lines))
+            removed = rng.randint(0, 3)
+            added = rng.randint(0, 3) if step % 2 else removed
+            new = [u''.join(rng.choice(u'([{x}])')
+                            for i in range(rng.randint(0, 4))) + u'\n'
+                   for i in range(added)]
+            removed = min(removed, len(lines) - row - 1)
+            if removed + len(new) == 0:
+                continue
+            lines[row:row + removed] = new
+            index.update_lines(row, removed, len(new))
+            row = rng.randrange(len(lines))
+            for col, char in enumerate(lines[row]):
+                if char in u'()[]{}':
+                    self.assertEqual(index.match(row, col),
+                                     naive_match(lines, row, col))
+
+
+class BracketHighlightTest(unittest.TestCase):
+
+    def test_highlight(self):
+        config = urwid.EditorConfig(newline='*', match_brackets=True)
+        editor = urwid.TextEditor(code.Code(io.StringIO(TEXT)), config)
+        size = (40, 10)
+        self.assertEqual(editor.body.bracket_pair, ((0, 0), (5, 0)))
+        editor.render(size, focus=True)
+        edit = editor.body._get_at_pos(5)[0]
+        self.assertIn(('bracket', 0, 1), edit.spans)
+
+        editor.keypress(size, 'down')
+        editor.render(size, focus=True)
+        self.assertEqual(editor.body.bracket_pair, ())
+        edit = editor.body._get_at_pos(5)[0]
+        self.assertNotIn(('bracket', 0, 1), edit.spans)
+
+        # The index follows edits
+        editor.set_focus(2)
+        editor.keypress(size, 'end')
+        editor.keypress(size, 'enter')
+        editor.keypress(size, 'left')
+        editor.render(size, focus=True)
+        self.assertEqual(editor.body.bracket_pair, ((2, 12), (5, 4)))
+
+    def test_render(self):
+        config = urwid.EditorConfig(newline='*', match_brackets=True)
+        editor = urwid.TextEditor(code.Code(io.StringIO(TEXT)), config)
+        size = (40, 10)
+        editor.render(size, focus=True)
+        editor.set_focus(1)
+        # Rendering does not match brackets, moving the cursor does
+        editor.render(size, focus=True)
+        self.assertEqual(editor.body.bracket_pair, ((0, 0), (5, 0)))
+        editor.keypress(size, 'end')
+        self.assertEqual(editor.body.bracket_pair, ())
+        editor.keypress(size, 'left')
+        self.assertEqual(editor.body.bracket_pair, ((1, 22), (1, 12)))
+        edit = editor.body._get_at_pos(1)[0]
+        self.assertIn(('bracket', 12, 13), edit.spans)
+        self.assertNotIn(('bracket', 0, 1),
+                         editor.body._get_at_pos(0)[0].spans)
+
+    def test_disabled(self):
+        config = urwid.EditorConfig(newline='*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(TEXT)), config)
+        editor.render((40, 10), focus=True)
+        editor.keypress((40, 10), 'down')
+        self.assertIsNone(editor.brackets)
+        self.assertIsNone(editor.document)
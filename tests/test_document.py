@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+import io
+import unittest
+
+from doctrine import code
+from doctrine import urwid
+
+TEXT = u'first line\nsecond line\nthird line\nfourth line\nlast line'
+
+
+class DocumentTest(unittest.TestCase):
+
+    def setUp(self):
+        config = urwid.EditorConfig(newline='*')
+        codeob = code.Code(io.StringIO(TEXT))
+        self.left = urwid.TextEditor(codeob, config)
+        self.right = self.left.split()
+        self.size = (40, 10)
+        self.left.render(self.size, focus=True)
+        self.right.render(self.size)
+
+    def lines(self, editor):
+        return [line.decode('ascii').rstrip()
+                for line in editor.render(self.size).text[:6]]
+
+    def test_shared(self):
+        document = self.left.document
+        self.assertIsInstance(document, urwid.Document)
+        self.assertIs(self.right.document, document)
+        self.assertIs(self.right.body.code, self.left.body.code)
+        self.assertIs(self.right.body.layout, self.left.body.layout)
+        # Both rendered, but each line was only laid out once
+        self.assertEqual(len(self.left.body.layout._cache), 5)
+
+    def test_edit_line(self):
+        right_widgets = list(self.right.body.widgets)
+        self.right.set_focus(3)
+        self.right.keypress(self.size, 'end')
+
+        self.left.keypress(self.size, 'x')
+        self.left.keypress(self.size, 'delete')
+        self.assertEqual(self.lines(self.right)[0], u'xirst line*')
+        # The widgets are kept, only the changed one is updated
+        self.assertEqual(self.right.body.widgets, right_widgets)
+        self.assertEqual(self.right.get_cursor_position(), (3, 11))
+
+    def test_edit_same_line(self):
+        self.right.keypress(self.size, 'end')
+        self.right.add_cursor(0, 6)
+        self.right.add_cursor(1, 2)
+        self.right.add_selection(0, 6, 0, 10)
+
+        # The cursors and selection after the edit move with the text
+        self.left.keypress(self.size, 'x')
+        self.left.keypress(self.size, 'x')
+        self.assertEqual(self.right.get_cursor_position(), (0, 12))
+        self.assertEqual(self.right.cursors.positions, [(0, 8), (1, 2)])
+        self.assertEqual(self.right.selection.ranges, [((0, 8), (0, 12))])
+
+        # Removed text takes the positions in it to where it was
+        self.left.select(0, 6, 0, 10)
+        self.left.keypress(self.size, 'delete')
+        self.assertEqual(self.lines(self.right)[0], u'xxfirsne*')
+        self.assertEqual(self.right.get_cursor_position(), (0, 8))
+        self.assertEqual(self.right.cursors.positions, [(0, 6), (1, 2)])
+
+    def test_set_lines(self):
+        calls = []
+
+        class Listener(object):
+            def update_lines(self, row, removed, added):
+                calls.append((row, removed, added))
+
+        listener = Listener()
+        self.left.document.add_listener(listener)
+        self.right.add_cursor(1, 3)
+        self.left.add_cursors_in_column(0, 2, 0)
+        self.left.add_cursor(4, 0)
+        self.left.keypress(self.size, 'x')
+        # Adjacent lines are one change
+        self.assertEqual(calls, [(0, 3, 3), (4, 1, 1)])
+        self.assertEqual(self.right.cursors.positions, [(1, 4)])
+
+    def test_split_lines(self):
+        self.right.set_focus(2)
+        self.right.keypress(self.size, 'right')
+        self.right.add_cursor(4, 2)
+        self.right.add_selection(3, 0, 3, 6)
+
+        self.left.keypress(self.size, 'down')
+        self.left.keypress(self.size, 'enter')
+        self.left.keypress(self.size, 'enter')
+        self.assertEqual(self.lines(self.right),
+                         [u'first line*', u'*', u'*', u'second line*',
+                          u'third line*', u'fourth line*'])
+        # The focus, cursors and selection are still on the same text
+        self.assertEqual(self.right.get_cursor_position(), (4, 1))
+        self.assertEqual(self.right.cursors.positions, [(6, 2)])
+        self.assertEqual(self.right.selection.ranges, [((5, 0), (5, 6))])
+
+        # And back again
+        self.left.keypress(self.size, 'backspace')
+        self.left.keypress(self.size, 'backspace')
+        self.assertEqual(self.lines(self.right), self.lines(self.left))
+        self.assertEqual(self.right.get_cursor_position(), (2, 1))
+        self.assertEqual(self.right.cursors.positions, [(4, 2)])
+
+    def test_removed_lines(self):
+        self.right.set_focus(2)
+        self.left.select(0, 5, 3, 0)
+        self.left.keypress(self.size, 'delete')
+        self.assertEqual(self.lines(self.right)[:3],
+                         [u'firstfourth line*', u'last line', u''])
+        # The focus line was removed, the focus moves to the merged line
+        self.assertEqual(self.right.get_cursor_position()[0], 0)
+
+        self.left.body.insert_text(0, 5, u' line\nsecond\nthird\n')
+        self.assertEqual(self.lines(self.right),
+                         self.lines(self.left))
+
+    def test_reload(self):
+        self.right.set_focus(3)
+        new_text = TEXT.replace(u'second line\n', u'')
+        self.left.reload(code.Code(io.StringIO(u'new\n' + new_text)))
+        self.assertEqual(self.lines(self.right), self.lines(self.left))
+        self.assertEqual(self.lines(self.right)[:2],
+                         [u'new*', u'first line*'])
+        self.assertEqual(self.right.get_cursor_position(), (3, 0))
+        self.assertEqual(self.right.focus.edit_text, u'fourth line\n')
@@ -0,0 +1,122 @@
+# -*- coding: UTF-8 -*-
+import io
+import unittest
+
+from doctrine import code
+from doctrine import urwid
+from doctrine.urwid.folding import FoldIndex
+
+TEXT = u''.join(u'line %i\n' % i for i in range(10))
+
+
+class FoldIndexTest(unittest.TestCase):
+
+    def test_fold(self):
+        folds = FoldIndex()
+        self.assertEqual(folds.fold(5, 8), (5, 8))
+        self.assertEqual(folds.fold(1, 3), (1, 3))
+        self.assertIsNone(folds.fold(4, 5))
+        self.assertEqual(list(folds), [(1, 3), (5, 8)])
+        # Overlapping folds are merged
+        self.assertEqual(folds.fold(2, 6), (1, 8))
+        self.assertEqual(list(folds), [(1, 8)])
+        self.assertEqual(folds.unfold(4), (1, 8))
+        self.assertFalse(folds)
+
+    def test_lookup(self):
+        folds = FoldIndex()
+        folds.fold(1, 3)
+        folds.fold(5, 8)
+        self.assertEqual(folds.fold_at(6), (5, 8))
+        self.assertIsNone(folds.fold_at(4))
+        self.assertFalse(folds.hidden(5))
+        self.assertTrue(folds.hidden(7))
+        self.assertEqual(folds.hidden_after(5), 2)
+        self.assertEqual(folds.hidden_after(6), 0)
+        self.assertEqual(folds.next_row(0), 1)
+        self.assertEqual(folds.next_row(1), 3)
+        self.assertEqual(folds.next_row(5), 8)
+        self.assertEqual(folds.prev_row(8), 5)
+        self.assertEqual(folds.prev_row(5), 4)
+        self.assertEqual(folds.prev_row(3), 1)
+
+    def test_update_lines(self):
+        folds = FoldIndex()
+        folds.fold(2, 4)
+        folds.fold(6, 9)
+        # Changing lines keeps the folds
+        folds.update_lines(7, 1, 1)
+        self.assertEqual(list(folds), [(2, 4), (6, 9)])
+        # Inserting lines before moves them
+        folds.update_lines(0, 1, 3)
+        self.assertEqual(list(folds), [(4, 6), (8, 11)])
+        folds.update_lines(4, 0, 1)
+        self.assertEqual(list(folds), [(5, 7), (9, 12)])
+        # Splitting a folded line opens the fold
+        folds.update_lines(10, 1, 2)
+        self.assertEqual(list(folds), [(5, 7)])
+        folds.update_lines(7, 2, 1)
+        self.assertEqual(list(folds), [(5, 7)])
+
+
+class FoldingTest(unittest.TestCase):
+
+    def setUp(self):
+        config = urwid.EditorConfig(newline='*')
+        self.editor = urwid.TextEditor(code.Code(io.StringIO(TEXT)), config)
+        self.size = (40, 8)
+
+    def lines(self, widget):
+        return [line.decode('ascii').rstrip()
+                for line in widget.render(self.size, focus=True).text]
+
+    def test_render(self):
+        self.editor.body.fold(2, 7)
+        self.assertEqual(self.lines(self.editor)[:5],
+                         [u'line 0*', u'line 1*', u'line 2* [4 lines]',
+                          u'line 7*', u'line 8*'])
+        linenos = urwid.LineNosWidget(self.editor)
+        canvas = linenos.render(self.size, focus=True)
+        self.assertEqual([line[:4] for line in canvas.text[:5]],
+                         [b'  0 ', b'  1 ', b'  2 ', b'  7 ', b'  8 '])
+        row = list(canvas.content())[2]
+        self.assertEqual(row[0][0], 'lineno folded')
+        self.editor.body.unfold(2)
+        self.assertEqual(self.lines(self.editor)[2:4],
+                         [u'line 2*', u'line 3*'])
+
+    def test_movement(self):
+        self.editor.body.fold(2, 7)
+        self.editor.set_focus(1)
+        self.editor.keypress(self.size, 'down')
+        self.assertEqual(self.editor.get_cursor_position(), (2, 0))
+        self.editor.keypress(self.size, 'down')
+        self.assertEqual(self.editor.get_cursor_position(), (7, 0))
+        self.editor.keypress(self.size, 'left')
+        self.assertEqual(self.editor.get_cursor_position(), (2, 6))
+        self.editor.keypress(self.size, 'up')
+        self.assertEqual(self.editor.get_cursor_position(), (1, 6))
+
+    def test_edit(self):
+        self.editor.body.fold(2, 7)
+        self.editor.set_focus(0)
+        self.editor.keypress(self.size, 'enter')
+        self.assertEqual(list(self.editor.folds), [(3, 8)])
+        # Typing on the folded line keeps the fold
+        self.editor.set_focus(3)
+        self.editor.keypress(self.size, 'x')
+        self.assertEqual(list(self.editor.folds), [(3, 8)])
+        self.assertEqual(self.lines(self.editor)[3], u'xline 2* [4 lines]')
+        # Joining with the hidden line below opens it
+        self.editor.keypress(self.size, 'end')
+        self.editor.keypress(self.size, 'delete')
+        self.assertFalse(self.editor.folds)
+        self.assertEqual(self.editor.body.code[3], u'xline 2line 3\n')
+
+    def test_focus_hidden(self):
+        self.editor.set_focus(4)
+        self.editor.body.fold(2, 7)
+        self.assertEqual(self.editor.get_cursor_position()[0], 2)
+        # Moving the focus into a fold opens it
+        self.editor.set_focus(5)
+        self.assertFalse(self.editor.folds)
@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from doctrine import urwid
+from doctrine import code
+from doctrine.urwid import instrument
+
+
+class InstrumentTest(unittest.TestCase):
+
+    def tearDown(self):
+        instrument.disable()
+        instrument.reset()
+
+    def _render(self):
+        config = urwid.EditorConfig(newline='*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(u'A\nB\nC')), config)
+        widget = urwid.LineNosWidget(editor)
+        widget.render((20, 5))
+        editor.keypress((16, 5), 'x')
+        widget.render((20, 5))
+
+    def test_disabled(self):
+        render = urwid.TextEditor.render
+        instrument.enable()
+        self.assertIsNot(urwid.TextEditor.render, render)
+        instrument.disable()
+        # Disabling puts the original methods back
+        self.assertIs(urwid.TextEditor.render, render)
+        self._render()
+        stats = instrument.snapshot()
+        self.assertEqual(stats['editor.render']['calls'], 0)
+        self.assertEqual(stats['walker.widgets']['hits'], 0)
+
+    def test_snapshot(self):
+        instrument.enable()
+        self._render()
+        stats = instrument.snapshot()
+        self.assertEqual(stats['editor.keypress']['calls'], 1)
+        self.assertEqual(stats['linenos.render']['calls'], 2)
+        self.assertEqual(stats['walker.make_widget']['calls'], 3)
+        self.assertEqual(stats['walker.widgets']['misses'], 3)
+        self.assertTrue(stats['walker.widgets']['hit_ratio'] > 0.5)
+        layout = stats['layout.calculate_text_segments']
+        self.assertTrue(layout['calls'] >= 3)
+        self.assertTrue(layout['max'] <= layout['total'])
+        instrument.reset()
+        self.assertEqual(instrument.snapshot()['editor.render']['calls'], 0)
+
+    def test_line_renders(self):
+        text = u''.join(u'line %i\n' % i for i in range(100))
+        config = urwid.EditorConfig(newline='*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(text)), config)
+        widget = urwid.LineNosWidget(editor)
+        size = (40, 10)
+        widget.render(size, focus=True)
+        instrument.enable()
+        # The canvas of the frame is dropped each time, so urwid's
+        # CanvasCache can not keep the canvases of the lines
+        for key, rendered in [('x', 1), ('right', 1), ('down', 2)]:
+            instrument.reset()
+            widget.keypress(size, key)
+            widget.render(size, focus=True)
+            stats = instrument.snapshot()
+            self.assertEqual(stats['edit.render']['misses'], rendered)
+            self.assertEqual(stats['edit.render']['hits'], 10 - rendered)
+            self.assertEqual(stats['lineno.render']['misses'], 0)
+
+        # Scrolling only renders the new line, and the old focus line
+        for i in range(8):
+            widget.keypress(size, 'down')
+            widget.render(size, focus=True)
+        instrument.reset()
+        widget.keypress(size, 'down')
+        widget.render(size, focus=True)
+        self.assertEqual(editor.focus_position, 10)
+        stats = instrument.snapshot()
+        self.assertEqual(stats['edit.render']['misses'], 2)
+        self.assertEqual(stats['lineno.render']['misses'], 1)
+
+        # Only the lines that are shown keep their canvases
+        for i in range(40):
+            widget.keypress(size, 'page down')
+            widget.render(size, focus=True)
+        kept = [edit for edit in editor.body.widgets
+                if edit is not None and edit._canvas is not None]
+        self.assertEqual(len(kept), 10)
+
+    def test_trace(self):
+        tracer = instrument.start_trace(capacity=1000)
+        config = urwid.EditorConfig(newline='*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(u'A\nB')), config)
+        editor.render((20, 5))
+        editor.keypress((20, 5), 'enter')
+        events = tracer.events()
+        names = [event['name'] for event in events]
+        self.assertIn('walker.split_focus', names)
+        keypress = events[names.index('editor.keypress')]
+        split = events[names.index('walker.split_focus')]
+        self.assertEqual(keypress['args'], {'key': 'enter'})
+        self.assertEqual(split['args'], {'line': 0})
+        # The split is nested within the keypress
+        self.assertTrue(keypress['ts'] <= split['ts'])
+        self.assertTrue(split['ts'] + split['dur'] <=
+                        keypress['ts'] + keypress['dur'])
+        self.assertIs(instrument.stop_trace(), tracer)
+
+    def test_trace_ring(self):
+        tracer = instrument.start_trace(capacity=5)
+        config = urwid.EditorConfig(newline='*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(u'A\nB')), config)
+        for key in 'abcdefgh':
+            editor.keypress((20, 5), key)
+        self.assertEqual(len(tracer.events()), 5)
+
+    def test_trace_threads(self):
+        tracer = instrument.Tracer()
+        tracer.add('main', 0.0, 1.0, None)
+        thread = threading.Thread(target=tracer.add,
+                                  args=('worker', 0.0, 1.0, None))
+        thread.start()
+        thread.join()
+        # Each span has the thread it ran in, not the one dumping it
+        tids = dict((event['name'], event['tid'])
+                    for event in tracer.events())
+        self.assertEqual(tids['main'], threading.current_thread().ident)
+        self.assertEqual(tids['worker'], thread.ident)
+
+    def test_slow_frame_dump(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'trace.json')
+        tracer = instrument.start_trace(slow_frame=0, path=path)
+        tracer.dump_interval = 0
+        config = urwid.EditorConfig(newline='*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(u'A\nB')), config)
+        editor.render((20, 5))
+        self.assertTrue(tracer.slow_frames)
+        with open(path) as trace_file:
+            trace = json.load(trace_file)
+        names = [event['name'] for event in trace['traceEvents']]
+        self.assertIn('editor.render', names)
+        self.assertIn('layout.calculate_text_segments', names)
+
+    def test_slow_frame_dump_limit(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'trace.json')
+        tracer = instrument.Tracer(slow_frame=0.5, path=path)
+        tracer.add('old', 0.0, 0.1, None)
+        tracer.add('inner', 9.5, 9.8, None)
+        tracer.add('slow', 9.4, 10.0, None)
+        # Only the spans around the slow frame are dumped
+        with open(path) as trace_file:
+            trace = json.load(trace_file)
+        self.assertEqual([event['name'] for event in trace['traceEvents']],
+                         ['inner', 'slow'])
+        # And only once within the dump interval
+        tracer.add('slow', 12.0, 13.0, None)
+        self.assertEqual((tracer.slow_frames, tracer.dumps), (2, 1))
+        tracer.add('slow', 20.0, 21.0, None)
+        self.assertEqual((tracer.slow_frames, tracer.dumps), (3, 2))
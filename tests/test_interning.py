@@ -0,0 +1,63 @@
+# -*- coding: UTF-8 -*-
+import io
+import unittest
+
+from doctrine import code
+from doctrine import urwid
+from doctrine.urwid.interning import LineInterner
+
+
+class LineInternerTest(unittest.TestCase):
+
+    def test_intern(self):
+        codeob = code.Code(io.StringIO(u'a line\n' * 3 + u'other\n'))
+        interner = LineInterner(codeob)
+        lines = codeob.lines
+        self.assertIs(lines[0], lines[1])
+        self.assertIs(lines[0], lines[2])
+        self.assertIsNot(lines[0], lines[3])
+        self.assertIs(interner.intern(u''.join([u'a ', u'line\n'])),
+                      lines[0])
+
+    def test_bytes(self):
+        codeob = code.Code(io.BytesIO(b'x\nx\n'))
+        interner = LineInterner(codeob)
+        self.assertIs(codeob.lines[0], codeob.lines[1])
+        self.assertIs(interner.intern(b'x\n'[:1]), interner.intern(b'x'))
+
+    def test_max_size(self):
+        interner = LineInterner(code.Code(io.StringIO(u'a\nb\n')))
+        interner.max_size = len(interner)
+        interner.intern(u'c')
+        self.assertEqual(len(interner), 1)
+
+
+class EditorInterningTest(unittest.TestCase):
+
+    def test_editor(self):
+        text = u'same\n' * 10
+        config = urwid.EditorConfig(newline='*', intern_lines=True)
+        editor = urwid.TextEditor(code.Code(io.StringIO(text)), config)
+        size = (20, 5)
+        editor.render(size, focus=True)
+        first = editor.body._get_at_pos(0)[0]
+        second = editor.body._get_at_pos(1)[0]
+        self.assertIs(first.get_line_text(), second.get_line_text())
+        self.assertIs(first.get_text()[0], second.get_text()[0])
+
+        # Edited lines are interned too, in all editors of the code
+        other = editor.split()
+        editor.keypress(size, 'x')
+        editor.keypress(size, 'down')
+        editor.keypress(size, 'home')
+        editor.keypress(size, 'x')
+        lines = editor.body.code.lines
+        self.assertEqual(lines[1], u'xsame\n')
+        self.assertIs(lines[0], lines[1])
+        self.assertIs(other.body.interner, editor.body.interner)
+
+    def test_disabled(self):
+        config = urwid.EditorConfig(newline='*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(u'a\na\n')), config)
+        self.assertIsNone(editor.body.interner)
+        self.assertIsNone(editor.document)
@@ -1,10 +1,17 @@
 # -*- coding: UTF-8 -*-
+import random
 import unittest
 import urwid
 
-from urwid import text_layout
+from urwid import text_layout, old_str_util, util
 from urwid.compat import B
 from doctrine.urwid import CodeLayout
+from doctrine.urwid import layout as layout_module
+
+try:
+    unichr
+except NameError:  # Python 3
+    unichr = chr
 
 
 ##################################################
@@ -600,6 +607,17 @@ class DOSNewlineTest(CalcBreaksTest, unittest.TestCase):
     ]
 
 
+class DOSNewlineSecondLineTest(CalcBreaksTest, unittest.TestCase):
+    mode = 'any'
+    text = "abfghsdjf askhtrvs\r\naltjhgsdf ljahtshgf\r\n"
+    # tests
+    do = [
+        (100, [18, 39, 41]),
+        (6, [6, 12, 18, 26, 32, 38, 39, 41]),
+        (10, [10, 18, 30, 39, 41]),
+    ]
+
+
 class MacNewlineTest(CalcBreaksTest, unittest.TestCase):
     mode = 'any'
     text = "abfghsdjf askhtrvs\raltjhgsdf ljahtshgf"
@@ -655,3 +673,188 @@ class EmptyLinesSpaceTest(CalcBreaksTest, unittest.TestCase):
         (6, [6, 12, 17, 18, 25, 31, 37, 38, 39]),
         (10, [9, 17, 18, 28, 38, 39]),
     ]
+
+
+class LineOffsetTest(unittest.TestCase):
+    """A line is laid out the same, whatever lines come before it."""
+
+    def shifted(self, segments, offset):
+        return [[seg[:-2] + (seg[-2] - offset, seg[-1] - offset)
+                 if len(seg) == 3 else (seg[0], seg[1] - offset)
+                 for seg in row] for row in segments]
+
+    def test_following_line(self):
+        first = u' x b\n'
+        for line in (u' x\t ba\xe9 \n', u'abcdef ghijk lmn\r\n'):
+            for text, head in ((line, first),
+                               (line.encode('utf8'), first.encode('utf8'))):
+                for width in (2, 3, 5, 80):
+                    for mode in ('space', 'any', 'clip'):
+                        alone = layout.calculate_text_segments(
+                            text, width, mode)
+                        after = layout.calculate_text_segments(
+                            head + text, width, mode)
+                        self.assertEqual(
+                            self.shifted(after, len(head))[-len(alone):],
+                            alone)
+
+    def test_long_bytes_line(self):
+        # A long line is only measured a screen width at a time
+        text = B('word ') * 20000 + B('\n')
+        segments = layout.calculate_text_segments(text, 80, 'space')
+        self.assertEqual(len(segments), 1250 + 1)
+        self.assertEqual(segments[-2][-2:],
+                         [(80, 99920, 100000), (0, 100000)])
+        self.assertEqual(segments[-1], [(0, 100001)])
+
+
+##################################################
+# Width lookup table tests
+##################################################
+
+class WidthTableTest(unittest.TestCase):
+    """The lookup tables must give the same results as urwid."""
+
+    def setUp(self):
+        random.seed(4)
+        chars = (u'abc \t\x0e\x0f\x7f\x90̀҃ᄀᅟ〈'
+                 u'　あ一龥가힣豈︰！'
+                 u'￠\U0001d400\U00020000\U0002fffd\U00030000')
+        self.texts = [u''.join(random.choice(chars) for i in range(40))
+                      for j in range(50)]
+
+    def test_char_width(self):
+        ordinals = set([0xe, 0xf, 0xffff, 0x10000, 0x10ffff])
+        for num, wid in old_str_util.widths:
+            ordinals.update([num - 1, num, num + 1])
+        for o in sorted(ordinals):
+            if o < 0x110000:
+                self.assertEqual(layout_module.char_width(unichr(o)),
+                                 old_str_util.get_width(o), hex(o))
+
+    def test_calc_width(self):
+        for text in self.texts:
+            for start, end in ((0, 40), (3, 17), (20, 20), (39, 40)):
+                expected = old_str_util.calc_width(text, start, end)
+                self.assertEqual(util.calc_width(text, start, end), expected)
+                self.assertEqual(
+                    layout_module.table_calc_width(text, start, end),
+                    expected)
+
+    def test_calc_text_pos(self):
+        for text in self.texts:
+            for start, end in ((0, 40), (3, 17), (39, 40)):
+                for pref_col in (0, 1, 5, 20, 79):
+                    expected = old_str_util.calc_text_pos(
+                        text, start, end, pref_col)
+                    self.assertEqual(
+                        util.calc_text_pos(text, start, end, pref_col),
+                        expected)
+                    self.assertEqual(layout_module.table_calc_text_pos(
+                        text, start, end, pref_col), expected)
+
+    def test_is_wide_char(self):
+        for text in self.texts:
+            for offs in range(len(text)):
+                self.assertEqual(
+                    layout_module.table_is_wide_char(text, offs),
+                    old_str_util.is_wide_char(text, offs))
+
+    def test_layout(self):
+        # Lay out with the tables, and with urwid's functions
+        texts = [u'\t'.join(self.texts), u'\n'.join(self.texts),
+                 u' '.join(self.texts)]
+        saved = (layout_module.calc_width, layout_module.calc_text_pos,
+                 layout_module.is_wide_char)
+        try:
+            results = []
+            for functions in ((layout_module.table_calc_width,
+                               layout_module.table_calc_text_pos,
+                               layout_module.table_is_wide_char),
+                              (util.calc_width, util.calc_text_pos,
+                               util.is_wide_char)):
+                (layout_module.calc_width, layout_module.calc_text_pos,
+                 layout_module.is_wide_char) = functions
+                results.append([
+                    layout.layout(text, width, 'left', mode)
+                    for text in texts for width in (5, 17, 80)
+                    for mode in ('space', 'clip')])
+        finally:
+            (layout_module.calc_width, layout_module.calc_text_pos,
+             layout_module.is_wide_char) = saved
+        self.assertEqual(results[0], results[1])
+
+
+##################################################
+# Layout cache and cursor map tests
+##################################################
+
+class CursorMapTest(unittest.TestCase):
+    """The cursor map must give the same results as urwid."""
+
+    def setUp(self):
+        urwid.set_encoding("utf-8")
+        random.seed(34)
+        chars = [u'a', u'b', u' ', u' ', u'\t', u'一', u'\xe9']
+        self.texts = [u''.join(random.choice(chars)
+                               for i in range(random.randint(0, 60)))
+                      for j in range(50)]
+
+    def test_coords(self):
+        layout = CodeLayout()
+        for text in self.texts:
+            for text in (text, text.encode('utf8')):
+                for width in (2, 5, 13, 80):
+                    cursor_map = layout.cursor_map(text, width, 'left',
+                                                   'space')
+                    for pos in range(len(text) + 1):
+                        self.assertEqual(cursor_map.coords(pos),
+                                         text_layout.calc_coords(
+                                             text, cursor_map.trans, pos))
+
+    def test_pos(self):
+        layout = CodeLayout()
+        for text in self.texts:
+            for text in (text, text.encode('utf8')):
+                for width in (2, 5, 13, 80):
+                    cursor_map = layout.cursor_map(text, width, 'left',
+                                                   'space')
+                    for y in range(len(cursor_map.trans)):
+                        for x in list(range(width + 1)) + ['left', 'right']:
+                            self.assertEqual(cursor_map.pos(x, y),
+                                             text_layout.calc_pos(
+                                                 text, cursor_map.trans,
+                                                 x, y))
+
+    def test_cache(self):
+        layout = CodeLayout()
+        layout.cache_size = 2
+        trans = layout.layout(u'foo bar', 4, 'left', 'space')
+        self.assertIs(layout.layout(u'foo bar', 4, 'left', 'space'), trans)
+        self.assertIs(layout.cursor_map(u'foo bar', 4, 'left',
+                                        'space').trans, trans)
+        self.assertIsNot(layout.layout(u'foo bar', 5, 'left', 'space'),
+                         trans)
+        layout.layout(u'foo baz', 5, 'left', 'space')
+        # The least recently used layout was dropped
+        self.assertIsNot(layout.layout(u'foo bar', 4, 'left', 'space'),
+                         trans)
+        self.assertEqual(layout.layout(u'foo bar', 4, 'left', 'space'),
+                         trans)
+
+
+class TerminatorTest(unittest.TestCase):
+
+    def test_split(self):
+        split = layout_module.split_terminator
+        self.assertEqual(split(u'foo\n'), (u'foo', layout_module.LF))
+        self.assertEqual(split(u'foo\r\n'), (u'foo', layout_module.CRLF))
+        self.assertEqual(split(u'foo\r'), (u'foo', layout_module.CR))
+        self.assertEqual(split(u'foo'), (u'foo', layout_module.NO_TERMINATOR))
+        self.assertEqual(split(u''), (u'', layout_module.NO_TERMINATOR))
+        self.assertEqual(split(B('foo\r\n')), (B('foo'), layout_module.CRLF))
+
+    def test_join(self):
+        for line in (u'foo\n', u'foo\r\n', u'foo\r', u'foo', B('foo\r\n')):
+            self.assertEqual(layout_module.join_terminator(
+                *layout_module.split_terminator(line)), line)
@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+import difflib
+import random
+import unittest
+
+from doctrine.urwid.linediff import diff_lines, unique_anchors
+
+
+def apply_hunks(old, hunks, new):
+    result = list(old)
+    for old_start, old_end, new_start, new_end in reversed(hunks):
+        result[old_start:old_end] = new[new_start:new_end]
+    return result
+
+
+class DiffLinesTest(unittest.TestCase):
+
+    def test_small(self):
+        old = list('abcdefgh')
+        new = list('abXdefYYh')
+        hunks = diff_lines(old, new)
+        self.assertEqual(hunks, [(2, 3, 2, 3), (6, 7, 6, 8)])
+        self.assertEqual(apply_hunks(old, hunks, new), new)
+        self.assertEqual(diff_lines(old, old), [])
+
+    def test_anchors(self):
+        old = list('axbxcxd')
+        new = list('dxbxaxc')
+        # x is not unique, and only b, c is in the same order on both sides
+        self.assertEqual(unique_anchors(old, 0, 7, new, 0, 7),
+                         [(2, 2), (4, 6)])
+
+    def test_large(self):
+        rnd = random.Random(42)
+        old = [u'line %i\n' % i for i in range(5000)]
+        new = list(old)
+        for pos in sorted(rnd.sample(range(5000), 200), reverse=True):
+            if pos % 3 == 0:
+                del new[pos]
+            elif pos % 3 == 1:
+                new[pos] = u'changed %i\n' % pos
+            else:
+                new.insert(pos, u'new %i\n' % pos)
+        # Split at unique lines, so the hunks are the same as with difflib
+        hunks = diff_lines(old, new, limit=50)
+        self.assertEqual(apply_hunks(old, hunks, new), new)
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        self.assertEqual(hunks, [(i1, i2, j1, j2) for tag, i1, i2, j1, j2
+                                 in matcher.get_opcodes() if tag != 'equal'])
+
+    def test_no_anchors(self):
+        # Nothing unique to split at, so it is one hunk
+        old = [u'a\n', u'b\n'] * 100
+        new = [u'b\n', u'a\n'] * 100 + [u'c\n']
+        hunks = diff_lines(old, new, limit=10)
+        self.assertEqual(apply_hunks(old, hunks, new), new)
+        self.assertEqual(len(hunks), 1)
@@ -0,0 +1,195 @@
+# -*- coding: UTF-8 -*-
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from doctrine import code
+from doctrine import urwid
+from doctrine.urwid import lineindex
+from doctrine.urwid.lineindex import LineIndex, scan_lines
+from doctrine.urwid.scrollbar import ScrollbarWidget
+
+TEXT = u'A short line\n\tAnd a tabbed line that wraps a bit\n\nlast'
+
+
+class LineIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'file.txt')
+        self.write(TEXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, text, mode='w'):
+        with io.open(self.path, mode, encoding='utf-8') as f:
+            f.write(text)
+
+    def open(self):
+        index = LineIndex.open(self.path, self.dir, newline=u'*')
+        self.addCleanup(index.close)
+        return index
+
+    def test_offsets(self):
+        index = self.open()
+        self.assertEqual(index.loaded, 'built')
+        self.assertEqual(list(index.offsets), [0, 13, 49, 50])
+        self.assertEqual(index.line_offset(3), 50)
+
+        # A newline at the end starts an empty line, like in Code
+        self.write(u'\n', 'a')
+        index = self.open()
+        self.assertEqual(len(index), 5)
+
+    def test_terminators(self):
+        # Lines end like in Code, in \r\n, \n or \r
+        text = u'one\rtwo\r\nthree\n\rfour\r'
+        self.write(text)
+        index = self.open()
+        self.assertEqual(list(index.offsets), [0, 4, 9, 15, 16, 21])
+        self.assertEqual(len(index), len(code.Code(io.StringIO(text, newline=''))))
+        self.assertEqual(list(index.rows(80)), [1, 1, 1, 1, 1, 1])
+
+        # Also when a \r\n is split between chunks
+        self.addCleanup(setattr, lineindex, 'CHUNK_SIZE',
+                        lineindex.CHUNK_SIZE)
+        for size in range(1, len(text) + 1):
+            lineindex.CHUNK_SIZE = size
+            self.assertEqual(list(scan_lines(self.path, 0)),
+                             [4, 9, 15, 16, 21])
+
+    def test_rows(self):
+        index = self.open()
+        self.assertEqual(list(index.rows(20)), [1, 3, 1, 1])
+        self.assertEqual(index.total_rows(20), 6)
+        self.assertEqual(list(index.rows(80)), [1, 1, 1, 1])
+
+        # The same as the rows of the editor's lines
+        config = urwid.EditorConfig(newline=u'*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(TEXT)), config)
+        self.assertEqual(
+            [editor.body._get_at_pos(row)[0].rows((20,))
+             for row in range(4)],
+            list(index.rows(20)))
+
+    def test_reopen(self):
+        index = self.open()
+        index.rows(20)
+        index.close()
+
+        index = self.open()
+        self.assertEqual(index.loaded, 'cached')
+        self.assertIsInstance(index.offsets, memoryview)
+        self.assertEqual(list(index.offsets), [0, 13, 49, 50])
+        self.assertEqual(list(index.rows(20)), [1, 3, 1, 1])
+        # A new width is added to the cache
+        index.rows(10)
+        index.close()
+        index = self.open()
+        self.assertEqual(index.loaded, 'cached')
+        self.assertEqual(sorted(index._rows), [10, 20])
+
+    def test_append(self):
+        index = self.open()
+        index.rows(20)
+        index.close()
+
+        self.write(u' line\nand one that is longer than 20\n', 'a')
+        index = self.open()
+        self.assertEqual(index.loaded, 'appended')
+        expected = LineIndex(self.path, self.dir, newline=u'*')
+        expected._build(0, 0)
+        self.assertEqual(list(index.offsets), list(expected.offsets))
+        self.assertEqual(list(index.rows(20)),
+                         list(expected.rows(20)))
+        self.assertEqual(list(index.rows(20)), [1, 3, 1, 1, 2, 1])
+
+    def test_append_crlf(self):
+        self.write(u'one\r')
+        index = self.open()
+        self.assertEqual(list(index.offsets), [0, 4])
+        index.rows(20)
+        index.close()
+
+        # The \r is now part of a \r\n
+        self.write(u'\ntwo', 'a')
+        index = self.open()
+        self.assertEqual(index.loaded, 'appended')
+        self.assertEqual(list(index.offsets), [0, 5])
+        self.assertEqual(list(index.rows(20)), [1, 1])
+
+    def test_newline(self):
+        index = self.open()
+        index.rows(20)
+        index.close()
+
+        # Newlines that are longer than 8 bytes in UTF-8 are kept whole
+        long_newline = u'\u21b2' * 4
+        for newline in [long_newline, long_newline + u'\u21b2']:
+            index = LineIndex.open(self.path, self.dir, newline=newline)
+            index.close()
+            self.assertEqual(index.loaded, 'cached')
+            index = LineIndex.open(self.path, self.dir, newline=newline)
+            self.addCleanup(index.close)
+            # The row counts of the old newline are not used
+            self.assertEqual(sorted(index._rows), [])
+            index.rows(10)
+            index.close()
+            index = LineIndex.open(self.path, self.dir, newline=newline)
+            self.addCleanup(index.close)
+            self.assertEqual(sorted(index._rows), [10])
+
+    def test_stale(self):
+        self.open().close()
+        # Same size, different content
+        self.write(TEXT.replace(u'\n\n', u'\nx'))
+        index = self.open()
+        self.assertEqual(index.loaded, 'built')
+        self.assertEqual(list(index.offsets), [0, 13, 49])
+
+        # A broken cache file is rebuilt
+        index.close()
+        with open(index.cache_path, 'r+b') as f:
+            f.truncate(50)
+        index = self.open()
+        self.assertEqual(index.loaded, 'built')
+        self.assertEqual(list(index.offsets), [0, 13, 49])
+
+    def test_editor(self):
+        config = urwid.EditorConfig(newline=u'*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(TEXT)), config)
+        self.assertIsNone(editor.open_index(self.path))
+
+        config.index_dir = self.dir
+        index = editor.open_index(self.path)
+        self.addCleanup(index.close)
+        self.assertIs(editor.line_index, index)
+        self.assertEqual(len(index), len(editor.body.code))
+
+    def test_scrollbar(self):
+        text = u'a line that wraps\n' * 10
+        self.write(text)
+        config = urwid.EditorConfig(newline=u'*', index_dir=self.dir)
+        editor = urwid.TextEditor(code.Code(io.StringIO(text)), config)
+        index = editor.open_index(self.path)
+        self.addCleanup(index.close)
+        scrollbar = ScrollbarWidget(editor)
+        scrollbar.render((11, 4), focus=True)
+        # A width that is not indexed is estimated, and not indexed
+        estimate = scrollbar.estimate
+        self.assertIs(estimate.index, index)
+        self.assertFalse(index.has_rows(10))
+        self.assertEqual(estimate.total_rows(), 3 * 11)
+
+        # The exact rows of the file, not of the lines that were shown
+        index.rows(10)
+        self.assertEqual(estimate.total_rows(), index.total_rows(10))
+        self.assertEqual(estimate.total_rows(), 3 * 10 + 1)
+
+        # Edits make the index stale
+        editor.keypress((11, 4), 'x')
+        scrollbar.render((11, 4), focus=True)
+        self.assertIsNone(estimate.index)
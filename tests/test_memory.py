@@ -0,0 +1,140 @@
+# -*- coding: UTF-8 -*-
+import io
+import unittest
+
+from doctrine import code
+from doctrine import urwid
+from doctrine.urwid.memory import MemoryBudget
+
+
+class Cache(object):
+
+    def __init__(self):
+        self.evicted = []
+
+    def evict(self, keys):
+        self.evicted.extend(keys)
+
+
+class MemoryBudgetTest(unittest.TestCase):
+
+    def test_evict_coldest(self):
+        budget = MemoryBudget(100)
+        first = Cache()
+        second = Cache()
+        budget.add(first, 'a', 30)
+        budget.add(second, 'b', 30)
+        budget.add(first, 'c', 30)
+        self.assertTrue(budget.touch(first, 'a'))
+        self.assertEqual(budget.used, 90)
+        # The least recently used entries go first, from any cache
+        budget.add(second, 'd', 30)
+        self.assertEqual(second.evicted, ['b'])
+        self.assertEqual(first.evicted, [])
+        budget.add(second, 'e', 50)
+        self.assertEqual(first.evicted, ['c', 'a'])
+        self.assertEqual(budget.used, 80)
+        self.assertEqual(budget.evictions, 3)
+        self.assertFalse(budget.touch(first, 'a'))
+
+    def test_too_big(self):
+        budget = MemoryBudget(10)
+        cache = Cache()
+        budget.add(cache, 'a', 5)
+        budget.add(cache, 'b', 50)
+        # The new entry is kept, even if it is over the budget by itself
+        self.assertEqual(cache.evicted, ['a'])
+        self.assertEqual(len(budget), 1)
+
+    def test_discard(self):
+        budget = MemoryBudget(100)
+        cache = Cache()
+        budget.add(cache, 'a', 5)
+        budget.add(cache, 'a', 7)
+        self.assertEqual(budget.used, 7)
+        budget.discard(cache, 'a')
+        budget.discard(cache, 'a')
+        self.assertEqual(budget.used, 0)
+
+
+class EditorMemoryTest(unittest.TestCase):
+
+    def _get_editor(self, budget):
+        text = u''.join(u'line %i\n' % i for i in range(1000))
+        config = urwid.EditorConfig(newline='*', memory_budget=budget)
+        return urwid.TextEditor(code.Code(io.StringIO(text)), config)
+
+    def test_no_budget(self):
+        editor = self._get_editor(None)
+        self.assertIsNone(editor.memory)
+        self.assertIsNone(editor.body.layout.memory)
+
+    def test_scrolling(self):
+        editor = self._get_editor(50000)
+        size = (40, 20)
+        for i in range(20):
+            editor.render(size, focus=True)
+            editor.keypress(size, 'page down')
+        editor.render(size, focus=True)
+        memory = editor.memory
+        self.assertLessEqual(memory.used, 50000)
+        self.assertGreater(memory.evictions, 0)
+        widgets = [w for w in editor.body.widgets if w is not None]
+        self.assertLess(len(widgets), 100)
+        self.assertLess(len(editor.body.layout._cache), 200)
+        # The lines on screen and the focus line are still there
+        focus = editor.focus_position
+        self.assertIsNotNone(editor.body.widgets[focus])
+        self.assertIsNotNone(editor.body.widgets[focus - 5])
+
+        # Going back makes the widgets again
+        editor.set_focus(0)
+        canvas = editor.render(size, focus=True)
+        self.assertEqual(canvas.text[0].rstrip(), b'line 0*')
+
+    def test_shifted_lines(self):
+        editor = self._get_editor(30000)
+        size = (40, 20)
+        editor.render(size, focus=True)
+        editor.keypress(size, 'enter')
+        for i in range(10):
+            editor.keypress(size, 'page down')
+            editor.render(size, focus=True)
+        # The widgets moved by the new line were found and dropped
+        self.assertLessEqual(editor.memory.used, 30000)
+        for pos, widget in enumerate(editor.body.widgets):
+            if widget is not None:
+                self.assertEqual(widget.edit_text, editor.body.code[pos])
+
+    def test_removed_widgets(self):
+        editor = self._get_editor(1000000)
+        size = (40, 20)
+        editor.render(size, focus=True)
+        memory = editor.memory
+        for i in range(30):
+            editor.keypress(size, 'down')
+            editor.keypress(size, 'home')
+            editor.keypress(size, 'backspace')
+            editor.render(size, focus=True)
+        # Only the widgets still in the walker are in the budget
+        widgets = [w for w in editor.body.widgets if w is not None]
+        entries = dict((key, size)
+                       for (cache, key), size in memory._entries.items()
+                       if cache is editor.body)
+        self.assertEqual(len(entries), len(widgets))
+        self.assertEqual(sum(entries.values()),
+                         sum(w.memory_size for w in widgets))
+
+    def test_text_size(self):
+        editor = self._get_editor(1000000)
+        size = (40, 20)
+        editor.render(size, focus=True)
+        used = editor.memory.used
+        editor.body.set_lines({0: u'x' * 10000 + u'\n'})
+        # The size of the new text is counted at once
+        self.assertGreater(editor.memory.used, used + 9000)
+
+    def test_shared(self):
+        editor = self._get_editor(50000)
+        other = editor.split()
+        self.assertIs(other.memory, editor.memory)
@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+import io
+import unittest
+
+from doctrine import code
+from doctrine import urwid
+from doctrine.urwid.minimap import Minimap
+
+TEXT = u''.join(u'    line %i\n' % i if i % 2 else u'line %i\n' % i
+                for i in range(40))
+
+
+class MinimapTest(unittest.TestCase):
+
+    def test_rows(self):
+        minimap = Minimap(code.Code(io.StringIO(TEXT)))
+        rows = minimap.rows(10)
+        self.assertEqual(minimap.lines_per_row, 5)
+        self.assertEqual(len(rows), 10)
+        # Lines 0, 2 and 4 have no indent, lines 1 and 3 have 4 spaces
+        self.assertEqual(rows[0], (8 // 5, (6 * 3 + 10 * 2) // 5))
+        # A short code leaves the last rows empty
+        rows = minimap.rows(50)
+        self.assertEqual(minimap.lines_per_row, 1)
+        self.assertEqual(rows[1], (4, 10))
+        # The code ends with a newline, so it has an empty last line
+        self.assertEqual(rows[40], (0, 0))
+        self.assertEqual(rows[41:], [None] * 9)
+
+    def test_samples(self):
+        codeob = code.Code(io.StringIO(u'x\n' * 10000))
+        minimap = Minimap(codeob)
+        measured = []
+        codeob.lines = Lines(codeob.lines, measured)
+        minimap.rows(10)
+        self.assertEqual(len(measured), 10 * minimap.samples)
+
+    def test_update_lines(self):
+        codeob = code.Code(io.StringIO(TEXT))
+        minimap = Minimap(codeob)
+        rows = minimap.rows(10)
+        codeob.lines[7] = u'a much longer line than the others\n'
+        minimap.update_lines(7, 1, 1)
+        self.assertEqual(minimap._rows.count(None), 1)
+        new_rows = minimap.rows(10)
+        self.assertNotEqual(new_rows[1], rows[1])
+        self.assertEqual(new_rows[2:], rows[2:])
+
+        codeob.lines[12:12] = [u'\n'] * 5
+        minimap.update_lines(12, 0, 5)
+        self.assertEqual(minimap._rows.count(None), 8)
+
+
+class Lines(list):
+    """A list of lines that records which lines are read."""
+
+    def __init__(self, lines, measured):
+        list.__init__(self, lines)
+        self.measured = measured
+
+    def __getitem__(self, index):
+        self.measured.append(index)
+        return list.__getitem__(self, index)
+
+
+class MinimapWidgetTest(unittest.TestCase):
+
+    def setUp(self):
+        config = urwid.EditorConfig(newline='*')
+        self.editor = urwid.TextEditor(code.Code(io.StringIO(TEXT)), config)
+        self.widget = urwid.MinimapWidget(self.editor, width=8, scale=2)
+        self.size = (40, 10)
+
+    def test_render(self):
+        canvas = self.widget.render(self.size, focus=True)
+        self.assertEqual(canvas.text[0], b'line 0*' + b' ' * 24 + b' ====    ')
+        self.assertEqual(canvas.text[1][31:], b'  ===    ')
+        rows = list(canvas.content())
+        # The first 10 lines are shown, that is the first two rows
+        self.assertEqual(rows[0][-1][0], 'minimap viewport')
+        self.assertEqual(rows[1][-1][0], 'minimap viewport')
+        self.assertEqual(rows[2][-1][0], 'minimap')
+
+    def test_edit(self):
+        self.widget.render(self.size, focus=True)
+        self.widget.keypress(self.size, 'enter')
+        # The editor got the key, and the overview was told of the change
+        self.assertEqual(self.editor.body.code[0], u'\n')
+        self.assertEqual(self.widget.minimap._rows, [None] * 10)
+        self.widget.render(self.size, focus=True)
+        self.widget.keypress(self.size, 'x')
+        self.assertEqual(self.widget.minimap._rows.count(None), 1)
+
+    def test_selection(self):
+        self.editor.select(12, 0, 13, 2)
+        rows = list(self.widget.render(self.size, focus=True).content())
+        self.assertEqual(rows[2][-1][0], 'minimap selection')
@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+import io
+import unittest
+
+from benchmarks.screenbench import ScreenBenchmark, changed_cells, run
+from doctrine import code
+from doctrine import urwid
+
+
+class ScreenBenchmarkTest(unittest.TestCase):
+
+    def _get_bench(self, lines=100):
+        text = u''.join(u'line %i\n' % i for i in range(lines))
+        config = urwid.EditorConfig(newline='*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(text)), config)
+        bench = ScreenBenchmark(urwid.LineNosWidget(editor), size=(40, 10))
+        self.addCleanup(bench.close)
+        return bench
+
+    def test_changed_cells(self):
+        old = [[(None, u'a'), (None, u'b')], [(None, u'c')]]
+        new = [[(None, u'a'), ('x', u'b')], [(None, u'c')], [(None, u'd')]]
+        self.assertEqual(changed_cells(old, new), (2, 2))
+        self.assertEqual(changed_cells(new, new), (0, 0))
+
+    def test_steps(self):
+        bench = self._get_bench()
+        first = bench.draw('first draw')
+        self.assertEqual(first.cells, 400)
+        self.assertEqual(first.rows, 10)
+        self.assertGreater(first.bytes, 400)
+
+        # Typing redraws the line, moving the cursor redraws nothing
+        typed = bench.keypress('x')
+        self.assertEqual(typed.rows, 1)
+        self.assertEqual(typed.cells, len(u'xline 0*'))
+        self.assertLess(typed.bytes, first.bytes / 4)
+        moved = bench.keypress('right')
+        self.assertEqual((moved.cells, moved.rows), (0, 0))
+        self.assertLess(moved.bytes, typed.bytes)
+
+        resized = bench.resize(50, 12)
+        self.assertEqual(resized.name, 'resize 50x12')
+        self.assertEqual(resized.rows, 12)
+        self.assertEqual(len(bench.steps), 4)
+        self.assertEqual(bench.totals().bytes,
+                         sum(step.bytes for step in bench.steps))
+
+    def test_run(self):
+        text = u''.join(u'line %i\n' % i for i in range(100))
+        config = urwid.EditorConfig(newline='*')
+        editor = urwid.TextEditor(code.Code(io.StringIO(text)), config)
+        bench = run(urwid.LineNosWidget(editor), size=(40, 10))
+        self.addCleanup(bench.close)
+        report = bench.report().splitlines()
+        self.assertEqual(report[1].split()[:2], ['first', 'draw'])
+        self.assertEqual(report[-1].split()[0], 'total')
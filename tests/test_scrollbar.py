@@ -0,0 +1,117 @@
+# -*- coding: UTF-8 -*-
+import io
+import unittest
+
+from doctrine import code
+from doctrine import urwid
+from doctrine.urwid.scrollbar import RowEstimate
+
+TEXT = u''.join(u'line %i\n' % i for i in range(100))
+
+
+class RowEstimateTest(unittest.TestCase):
+
+    def test_estimate(self):
+        estimate = RowEstimate(code.Code(io.StringIO(TEXT)))
+        self.assertEqual(estimate.total_rows(), 101)
+        estimate.set_width(40)
+        estimate.seen([(0, 1), (1, 3)])
+        self.assertEqual(estimate.rows_per_line(), 2.0)
+        self.assertEqual(estimate.total_rows(), 202)
+        # The same lines are not counted again
+        estimate.seen([(0, 1), (1, 3)])
+        self.assertEqual(len(estimate.heights), 2)
+        estimate.seen([(1, 3), (2, 2)])
+        self.assertEqual(list(estimate.heights), [1, 3, 2])
+        estimate.set_width(20)
+        self.assertEqual(len(estimate.heights), 0)
+
+    def test_sample_size(self):
+        estimate = RowEstimate(code.Code(io.StringIO(TEXT)))
+        estimate.heights = type(estimate.heights)(maxlen=3)
+        estimate.seen([(0, 5), (1, 1), (2, 1), (3, 1)])
+        self.assertEqual(estimate.known_rows, 3)
+        self.assertEqual(estimate.rows_per_line(), 1.0)
+
+    def test_update_lines(self):
+        estimate = RowEstimate(code.Code(io.StringIO(TEXT)))
+        estimate.seen([(0, 1), (1, 2), (2, 3), (3, 4)])
+        estimate.update_lines(1, 1, 1)
+        estimate.update_lines(0, 1, 2)
+        # The replaced lines are counted again, the moved ones are not
+        estimate.seen([(0, 2), (1, 1), (2, 2), (3, 3), (4, 4)])
+        self.assertEqual(list(estimate.heights), [1, 2, 3, 4, 2, 1, 2])
+
+
+class ScrollbarWidgetTest(unittest.TestCase):
+
+    def setUp(self):
+        config = urwid.EditorConfig(newline='*')
+        self.editor = urwid.TextEditor(code.Code(io.StringIO(TEXT)), config)
+        self.widget = urwid.ScrollbarWidget(self.editor)
+        self.size = (20, 10)
+
+    def thumb(self):
+        canvas = self.widget.render(self.size, focus=True)
+        return [row for row, line in enumerate(canvas.text)
+                if line.endswith(b'#')]
+
+    def test_render(self):
+        canvas = self.widget.render(self.size, focus=True)
+        self.assertEqual(canvas.text[0], b'line 0*' + b' ' * 12 + b'#')
+        self.assertEqual(self.thumb(), [0])
+        self.assertEqual(len(self.widget.estimate.heights), 10)
+        # Drawing the same lines again does not count them again
+        self.widget.render(self.size, focus=True)
+        self.assertEqual(len(self.widget.estimate.heights), 10)
+
+        self.editor.set_focus(100)
+        self.assertEqual(self.thumb(), [9])
+        self.editor.set_focus(50)
+        self.widget.render(self.size, focus=True)
+        self.editor.set_focus_valign('top')
+        self.assertEqual(self.thumb(), [5])
+
+    def test_no_scroll(self):
+        self.editor.body.code.lines[5:] = []
+        self.assertEqual(self.thumb(), list(range(10)))
+
+    def test_click(self):
+        self.widget.render(self.size, focus=True)
+        self.assertTrue(self.widget.mouse_event(
+            self.size, 'mouse press', 1, 19, 5, True))
+        self.assertEqual(self.editor.focus_position, 50)
+
+    def test_edit(self):
+        self.widget.render(self.size, focus=True)
+        self.widget.keypress(self.size, 'enter')
+        self.assertEqual(self.editor.body.code[0], u'\n')
+        # The lines after the split moved, and are not counted again,
+        # only the new line in view is
+        self.widget.render(self.size, focus=True)
+        self.assertEqual(sorted(self.widget.estimate._shown),
+                         list(range(1, 11)))
+        self.assertEqual(len(self.widget.estimate.heights), 11)
+
+    def test_stacked(self):
+        # The wrappers can wrap each other
+        minimap = urwid.MinimapWidget(self.editor, width=4)
+        linenos = urwid.LineNosWidget(minimap)
+        widget = urwid.ScrollbarWidget(linenos)
+        self.assertIs(widget.editor, self.editor)
+        self.assertIs(linenos.editor, self.editor)
+        size = (30, 10)
+        canvas = widget.render(size, focus=True)
+        self.assertEqual(canvas.text[0][:12], b'  0 line 0* ')
+        self.assertEqual(canvas.text[0][-1:], b'#')
+        # The editor is 30 - 1 - 4 - 1 - 3 - 1 columns wide
+        self.assertEqual(widget._text_width(size), 20)
+        self.assertEqual(widget.get_cursor_coords(size), (4, 0))
+
+        widget.keypress(size, 'right')
+        self.assertEqual(widget.get_cursor_coords(size), (5, 0))
+        widget.mouse_event(size, 'mouse press', 1, 29, 9, True)
+        self.assertGreater(self.editor.get_cursor_position()[0], 80)
+        # Clicks on the line numbers are not passed on
+        self.assertFalse(widget.mouse_event(size, 'mouse press', 1, 1, 0,
+                                            True))
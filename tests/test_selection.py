@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+import unittest
+
+from doctrine.urwid.selection import Selection, shift_position
+
+
+class SelectionTest(unittest.TestCase):
+
+    def test_add_merges(self):
+        selection = Selection()
+        selection.add((5, 0), (6, 2))
+        selection.add((1, 3), (0, 1))
+        self.assertEqual(selection.ranges,
+                         [((0, 1), (1, 3)), ((5, 0), (6, 2))])
+        selection.add((1, 0), (5, 1))
+        self.assertEqual(selection.ranges, [((0, 1), (6, 2))])
+        # Empty ranges select nothing
+        selection.set((2, 2), (2, 2))
+        self.assertFalse(selection)
+
+    def test_version(self):
+        selection = Selection()
+        selection.add((0, 1), (0, 2))
+        self.assertEqual(selection.version, 1)
+        # Each change bumps the version once
+        selection.set((1, 0), (1, 5))
+        self.assertEqual(selection.version, 2)
+        selection.add((3, 0), (3, 1))
+        selection.update_lines(0, 1, 2)
+        self.assertEqual(selection.version, 4)
+        # Adding an empty range changes nothing
+        selection.add((4, 0), (4, 0))
+        self.assertEqual(selection.version, 4)
+
+    def test_row_spans(self):
+        selection = Selection()
+        selection.add((0, 4), (2, 0))
+        selection.add((2, 3), (2, 5))
+        selection.add((2, 7), (4, 1))
+        self.assertEqual(selection.row_spans(0), [(4, None)])
+        self.assertEqual(selection.row_spans(1), [(0, None)])
+        self.assertEqual(selection.row_spans(2), [(3, 5), (7, None)])
+        self.assertEqual(selection.row_spans(4), [(0, 1)])
+        self.assertEqual(selection.row_spans(5), [])
+
+    def test_update_lines(self):
+        selection = Selection()
+        selection.add((0, 4), (2, 3))
+        selection.add((5, 1), (5, 2))
+        # Line 1 was split into three lines
+        selection.update_lines(1, 1, 3)
+        self.assertEqual(selection.ranges, [((0, 4), (4, 3)),
+                                            ((7, 1), (7, 2))])
+        # Lines 3 to 5 were merged into one
+        selection.update_lines(3, 3, 1)
+        self.assertEqual(selection.ranges, [((0, 4), (3, 3)),
+                                            ((5, 1), (5, 2))])
+
+    def test_shift_position(self):
+        # Before the change
+        self.assertEqual(shift_position((1, 5), 2, 1, 3), (1, 5))
+        # On a changed line that is still there
+        self.assertEqual(shift_position((2, 5), 2, 2, 1), (2, 5))
+        # On a removed line
+        self.assertEqual(shift_position((3, 5), 2, 2, 1), (2, 5))
+        # After the change
+        self.assertEqual(shift_position((4, 5), 2, 2, 1), (3, 5))
+        self.assertEqual(shift_position((4, 5), 2, 1, 3), (6, 5))
@@ -3,6 +3,7 @@ import io
 import unittest
 from doctrine import urwid
 from doctrine import code
+from urwid import signals as urwid_signals
 
 LOREM = u"""Lorem ipsum dolor sit amet, consectetur adipiscing elit. Sed in
 semper nisi, elementum elementum nibh. Aliquam malesuada purus nec ante
@@ -163,6 +164,86 @@ class TextEditorTest(unittest.TestCase):
         widget.keypress(size, 'right')
         self.assertEqual(widget.get_cursor_coords(size), (9, 1))
 
+    def test_tab_width_change(self):
+        widget = self._get_editor(u'a\tb\nc\td\n')
+        size = (20, 3)
+        canvas = widget.render(size, focus=True)
+        self.assertEqual(canvas.text[0], b'a       b*          ')
+        self.assertEqual(canvas.text[1], b'c       d*          ')
+        # The canvases kept by the lines are stale after the layout cache
+        # is cleared, on the focus line and the others
+        # urwid keeps the canvas of the frame while it is used
+        del canvas
+        widget.body.layout.tab_width = 2
+        widget.body.layout.clear_cache()
+        canvas = widget.render(size, focus=True)
+        self.assertEqual(canvas.text[0], b'a b*                ')
+        self.assertEqual(canvas.text[1], b'c d*                ')
+
+    def test_wrapped_line(self):
+        widget = self._get_editor(u'word ' * 10 + u'\nend')
+        size = (12, 10)
+        widget.render(size, focus=True)
+        widget.keypress(size, 'end')
+        self.assertEqual(widget.get_cursor_coords(size), (10, 4))
+
+        # Clicks within the wrapped line
+        self.assertTrue(widget.mouse_event(size, 'mouse press', 1, 3, 2,
+                                           True))
+        self.assertEqual(widget.focus.edit_pos, 23)
+        self.assertEqual(widget.get_cursor_coords(size), (3, 2))
+        widget.mouse_event(size, 'mouse press', 1, 11, 1, True)
+        self.assertEqual(widget.focus.edit_pos, 19)
+        self.assertEqual(widget.get_cursor_coords(size), (9, 1))
+
+        # The column is kept when moving to the next line and back
+        widget.mouse_event(size, 'mouse press', 1, 9, 3, True)
+        widget.keypress(size, 'down')
+        widget.keypress(size, 'up')
+        self.assertEqual(widget.focus.edit_pos, 49)
+        self.assertEqual(widget.get_cursor_coords(size), (9, 4))
+
+    def test_reload(self):
+        lines = [u'line %s\n' % row for row in range(100)]
+        widget = self._get_editor(u''.join(lines))
+        size = (20, 10)
+        widget.set_focus(50)
+        widget.keypress(size, 'right')
+        widget.add_cursor(80, 2)
+        canvas = widget.render(size, focus=True)
+        screen = canvas.text, canvas.cursor
+        kept = widget.body.widgets[48]
+
+        # A line changed, three inserted and one deleted
+        lines[5] = u'changed\n'
+        lines[20:20] = [u'new\n'] * 3
+        del lines[70]
+        new_code = code.Code(io.StringIO(u''.join(lines)))
+        self.assertTrue(widget.reload(new_code))
+        self.assertEqual(widget.body.code.lines[:-1], lines)
+        self.assertIs(widget.body.widgets[51], kept)
+        self.assertEqual(widget.get_cursor_position(), (53, 1))
+        self.assertEqual(widget.cursors.positions, [(82, 2)])
+        # The same lines are shown at the same place
+        canvas = widget.render(size, focus=True)
+        self.assertEqual((canvas.text, canvas.cursor), screen)
+
+        self.assertFalse(widget.reload(new_code))
+
+    def test_reload_reformatted(self):
+        lines = [u'line %s\n' % row for row in range(3000)]
+        widget = self._get_editor(u''.join(lines))
+        widget.set_focus(2500)
+        widget.add_cursor(2990, 2)
+        # Every line changed, which is replaced as one hunk
+        lines = [u'    line %s\n' % row for row in range(2000)]
+        new_code = code.Code(io.StringIO(u''.join(lines)))
+        self.assertTrue(widget.reload(new_code))
+        self.assertEqual(widget.body.code.lines[:-1], lines)
+        # The positions on removed lines move to the last new line
+        self.assertEqual(widget.get_cursor_position()[0], 1999)
+        self.assertEqual(widget.cursors.positions, [(1999, 2)])
+
     def test_delete(self):
         widget = self._get_editor(u'A text\nwith several\nlines')
         size = (80, 25)
@@ -201,6 +282,71 @@ class TextEditorTest(unittest.TestCase):
         self.assertEqual(widget.body.code[0], u' textwith several\n')
         self.assertEqual(len(widget.body.code), 2)
 
+    def test_word_movement(self):
+        widget = self._get_editor(u'A text, with\n  several lines')
+        size = (80, 25)
+        widget.keypress(size, 'ctrl right')
+        self.assertEqual(widget.get_cursor_position(), (0, 1))
+        widget.keypress(size, 'ctrl right')
+        self.assertEqual(widget.get_cursor_position(), (0, 6))
+        widget.keypress(size, 'ctrl right')
+        widget.keypress(size, 'ctrl right')
+        self.assertEqual(widget.get_cursor_position(), (1, 0))
+        widget.keypress(size, 'ctrl right')
+        self.assertEqual(widget.get_cursor_position(), (1, 9))
+        widget.keypress(size, 'ctrl left')
+        self.assertEqual(widget.get_cursor_position(), (1, 2))
+        widget.keypress(size, 'ctrl left')
+        self.assertEqual(widget.get_cursor_position(), (1, 0))
+        widget.keypress(size, 'ctrl left')
+        self.assertEqual(widget.get_cursor_position(), (0, 12))
+        widget.keypress(size, 'ctrl left')
+        self.assertEqual(widget.get_cursor_position(), (0, 8))
+        # With shift it selects
+        widget.keypress(size, 'shift ctrl left')
+        self.assertEqual(widget.selection.ranges, [((0, 2), (0, 8))])
+
+    def test_word_bounds_cached(self):
+        widget = self._get_editor(u'one two three\n')
+        edit = widget.body.get_focus()[0]
+        bounds = edit.word_bounds()
+        self.assertEqual(bounds, ([0, 4, 8], [3, 7, 13]))
+        self.assertIs(edit.word_bounds(), bounds)
+        widget.keypress((80, 25), 'x')
+        self.assertEqual(edit.word_bounds(), ([0, 5, 9], [4, 8, 14]))
+
+    def test_display_text_cached(self):
+        widget = self._get_editor(u'one two\n')
+        edit = widget.body.get_focus()[0]
+        text, attrib = edit.get_text()
+        self.assertEqual(text, u'one two*')
+        self.assertIs(edit.get_text()[0], text)
+        edit.set_spans([('bracket', 0, 1)])
+        self.assertEqual(edit.get_text()[1], [('bracket', 1)])
+        widget.keypress((80, 25), 'x')
+        self.assertEqual(edit.get_text()[0], u'xone two*')
+        edit.newline = u'$'
+        self.assertEqual(edit.get_text()[0], u'xone two$')
+
+    def test_erase_word(self):
+        widget = self._get_editor(u'A text, with\nseveral lines')
+        size = (80, 25)
+        widget.keypress(size, 'down')
+        widget.keypress(size, 'ctrl right')
+        widget.keypress(size, 'ctrl w')
+        self.assertEqual(widget.body.code[1], u' lines')
+        widget.keypress(size, 'ctrl delete')
+        self.assertEqual(widget.body.code[1], u'')
+        widget.keypress(size, 'meta backspace')
+        self.assertEqual(widget.body.code[0], u'A text, with')
+        self.assertEqual(widget.get_cursor_position(), (0, 12))
+        widget.keypress(size, 'left')
+        widget.keypress(size, 'left')
+        widget.keypress(size, 'ctrl delete')
+        self.assertEqual(widget.body.code[0], u'A text, wi')
+        widget.keypress(size, 'ctrl delete')
+        self.assertEqual(widget.body.code[0], u'A text, wi')
+
     def test_inserts(self):
         widget = self._get_editor(u'A text\nwith several\nlines')
         size = (80, 25)
@@ -231,3 +377,248 @@ class TextEditorTest(unittest.TestCase):
         self.assertIsNone(widget.keypress(size, 'delete'))
         self.assertIsNone(widget.keypress(size, 'r'))
         self.assertIsNone(widget.keypress(size, 'enter'))
+
+    def test_selection(self):
+        widget = self._get_editor(u'A text\nwith several\nlines')
+        size = (80, 25)
+        widget.keypress(size, 'right')
+        widget.keypress(size, 'shift down')
+        widget.keypress(size, 'shift right')
+        self.assertEqual(widget.get_selected_text(), u' text\nwi')
+        # The selection is shown on the lines it covers
+        rows = [[(attr, text) for attr, cs, text in row]
+                for row in widget.render(size, focus=True).content()]
+        self.assertEqual(rows[0][:2], [(None, b'A'), ('selection', b' text*')])
+        self.assertEqual(rows[1][0], ('selection', b'wi'))
+        # Moving without shift deselects
+        widget.keypress(size, 'left')
+        self.assertFalse(widget.selection)
+
+    def test_delete_selection(self):
+        widget = self._get_editor(u'A text\nwith several\nlines\nmore')
+        size = (80, 25)
+        widget.select(0, 2, 2, 3)
+        widget.add_selection(3, 0, 3, 2)
+        widget.keypress(size, 'backspace')
+        self.assertEqual(widget.body.code[0], u'A es\n')
+        self.assertEqual(widget.body.code[1], u're')
+        self.assertEqual(len(widget.body.code), 2)
+        self.assertEqual(widget.get_cursor_position(), (0, 2))
+        self.assertFalse(widget.selection)
+
+    def test_cut_and_paste(self):
+        widget = self._get_editor(u'A text\nwith several\nlines')
+        size = (80, 25)
+        widget.select(0, 2, 1, 4)
+        widget.keypress(size, 'ctrl x')
+        self.assertEqual(widget.clipboard, u'text\nwith')
+        self.assertEqual(widget.body.code[0], u'A  several\n')
+        widget.keypress(size, 'ctrl v')
+        self.assertEqual(widget.body.code[0], u'A text\n')
+        self.assertEqual(widget.body.code[1], u'with several\n')
+        self.assertEqual(widget.get_cursor_position(), (1, 4))
+        # Copy leaves the text alone
+        widget.select(2, 0, 2, 4)
+        widget.keypress(size, 'meta c')
+        self.assertEqual(widget.clipboard, u'line')
+        self.assertEqual(widget.body.code[2], u'lines')
+
+    def test_cursors_in_column(self):
+        widget = self._get_editor(u'one\ntwo\nthree\nfour')
+        size = (80, 25)
+        widget.keypress(size, 'end')
+        widget.add_cursors_in_column(1, 3, 3)
+        self.assertEqual(widget.cursors.positions, [(1, 3), (2, 3), (3, 3)])
+        widget.keypress(size, '!')
+        widget.keypress(size, 'left')
+        widget.keypress(size, 'backspace')
+        self.assertEqual([widget.body.code[row] for row in range(4)],
+                         [u'on!\n', u'tw!\n', u'th!ee\n', u'fo!r'])
+        self.assertEqual(widget.get_cursor_position(), (0, 2))
+        self.assertEqual(widget.cursors.positions, [(1, 2), (2, 2), (3, 2)])
+        # The extra cursors are shown
+        rows = [[(attr, text) for attr, cs, text in row]
+                for row in widget.render(size, focus=True).content()]
+        self.assertEqual(rows[1][:2], [(None, b'tw'), ('cursor', b'!')])
+        # Moving up or down goes back to one cursor
+        widget.keypress(size, 'down')
+        self.assertFalse(widget.cursors)
+
+    def test_cursor_at_next_match(self):
+        widget = self._get_editor(u'foo bar\nbar foo\nfoo')
+        size = (80, 25)
+        widget.keypress(size, 'right')
+        widget.keypress(size, 'meta d')
+        widget.keypress(size, 'meta d')
+        self.assertEqual(widget.cursors.positions, [(1, 5), (2, 1)])
+        # No more matches
+        self.assertFalse(widget.add_cursor_at_next_match())
+        widget.keypress(size, 'delete')
+        widget.keypress(size, 'x')
+        self.assertEqual([widget.body.code[row] for row in range(3)],
+                         [u'fxo bar\n', u'bar fxo\n', u'fxo'])
+
+    def test_cursor_below(self):
+        widget = self._get_editor(u'one\ntwo\nthree')
+        size = (80, 25)
+        widget.keypress(size, 'right')
+        widget.keypress(size, 'meta down')
+        widget.keypress(size, 'meta down')
+        self.assertEqual(widget.get_cursor_position(), (2, 1))
+        self.assertEqual(widget.cursors.positions, [(0, 1), (1, 1)])
+        widget.keypress(size, 'tab')
+        self.assertEqual([widget.body.code[row] for row in range(3)],
+                         [u'o\tne\n', u't\two\n', u't\three'])
+
+    def test_batched_modified(self):
+        widget = self._get_editor(u'A text\nwith several\nlines')
+        size = (80, 25)
+        signals = []
+        urwid_signals.connect_signal(widget.body, 'modified',
+                                     lambda: signals.append(1))
+        widget.keypress(size, 'down')
+        del signals[:]
+        # Moving left from the start of a line moves up and to the end
+        widget.keypress(size, 'left')
+        self.assertEqual(len(signals), 1)
+        self.assertEqual(widget.get_cursor_position(), (0, 6))
+        widget.keypress(size, 'enter')
+        self.assertEqual(len(signals), 2)
+        widget.keypress(size, 'backspace')
+        self.assertEqual(len(signals), 3)
+
+        with widget.body.batch():
+            widget.body.set_focus(2)
+            widget.body.set_focus(1)
+            self.assertEqual(len(signals), 3)
+        self.assertEqual(len(signals), 4)
+
+    def test_max_fps(self):
+        alarms = []
+        now = [100.0]
+
+        class EventLoop(object):
+            def alarm(self, seconds, callback):
+                alarms.append((seconds, callback))
+
+        config = urwid.EditorConfig(newline='*', max_fps=10)
+        widget = urwid.TextEditor(code.Code(io.StringIO(u'text')), config)
+        widget.set_event_loop(EventLoop())
+        widget.throttle.clock = lambda: now[0]
+        size = (20, 5)
+
+        self.assertEqual(widget.render(size).text[0], b'text                ')
+        # Keys are applied at once, but not drawn within the frame
+        now[0] += 0.02
+        widget.keypress(size, 'a')
+        widget.keypress(size, 'b')
+        self.assertEqual(widget.body.code[0], u'abtext')
+        self.assertEqual(widget.render(size).text[0], b'text                ')
+        self.assertEqual(len(alarms), 1)
+        self.assertAlmostEqual(alarms[0][0], 0.08)
+        # When the frame is over, the end result is drawn
+        now[0] += 0.08
+        alarms[0][1]()
+        self.assertEqual(widget.render(size).text[0], b'abtext              ')
+
+    def test_max_fps_wrapped(self):
+        alarms = []
+        now = [100.0]
+
+        class EventLoop(object):
+            def alarm(self, seconds, callback):
+                alarms.append((seconds, callback))
+
+        text = u''.join(u'l%i\n' % row for row in range(20))
+        config = urwid.EditorConfig(newline='*', max_fps=10)
+        editor = urwid.TextEditor(code.Code(io.StringIO(text)), config)
+        editor.set_event_loop(EventLoop())
+        editor.throttle.clock = lambda: now[0]
+        widget = urwid.ScrollbarWidget(urwid.LineNosWidget(editor))
+        size = (20, 5)
+
+        first = widget.render(size, focus=True)
+        self.assertEqual(first.text[0][:7], b'  0 l0*')
+        # The line numbers are kept with the text within a frame
+        now[0] += 0.02
+        editor.keypress(size, 'page down')
+        editor.keypress(size, 'page down')
+        self.assertEqual(widget.render(size, focus=True).text, first.text)
+        self.assertEqual(len(alarms), 1)
+        # And drawn together when it is over
+        now[0] += 0.08
+        alarms[0][1]()
+        text = widget.render(size, focus=True).text
+        self.assertEqual([line[:3].strip() for line in text],
+                         [line[5:].split(b'*')[0] for line in text])
+        self.assertNotEqual(text, first.text)
+
+    def test_terminators(self):
+        text = u'dos\r\nmac\runix\nend'
+        stream = io.StringIO(text, newline='')
+        widget = urwid.TextEditor(code.Code(stream),
+                                  urwid.EditorConfig(newline='*'))
+        size = (20, 5)
+        canvas = widget.render(size, focus=True)
+        self.assertEqual([row.rstrip() for row in canvas.text],
+                         [b'dos*', b'mac*', b'unix*', b'end', b''])
+        edit = widget.body._get_at_pos(0)[0]
+        self.assertEqual(edit.get_line_text(), u'dos')
+        self.assertEqual(edit.get_edit_len(), 3)
+        self.assertEqual(edit.edit_text, u'dos\r\n')
+
+        # Edits keep the terminators as they were
+        widget.keypress(size, 'end')
+        widget.keypress(size, 'x')
+        widget.keypress(size, 'down')
+        widget.keypress(size, 'backspace')
+        self.assertEqual(edit.edit_text, u'dosx\r\n')
+        self.assertEqual(u''.join(widget.body.code.lines),
+                         u'dosx\r\nma\runix\nend')
+
+    def test_long_line(self):
+        text = u'short\n' + u'0123456789' * 100 + u'\nend\n'
+        config = urwid.EditorConfig(newline='*', long_line_length=500,
+                                    long_line_rows=3)
+        widget = urwid.TextEditor(code.Code(io.StringIO(text)), config)
+        size = (20, 6)
+        widget.keypress(size, 'down')
+        canvas = widget.render(size, focus=True)
+        # Only three rows of the long line are shown, wrapped anywhere
+        self.assertEqual(canvas.text[1], b'01234567890123456789')
+        self.assertEqual(canvas.text[4], b' [long line 0-60 of ')
+        self.assertEqual(canvas.text[5], b'1000]               ')
+        self.assertEqual(canvas.cursor, (0, 1))
+        self.assertFalse(widget.body._get_at_pos(0)[0].is_long())
+
+        # The part with the cursor is shown
+        widget.keypress(size, 'end')
+        canvas = widget.render(size, focus=True)
+        self.assertEqual(widget.get_cursor_position(), (1, 1000))
+        self.assertEqual(canvas.text[0], b'short*              ')
+        self.assertEqual(canvas.text[2], b'01234567890123456789')
+        self.assertEqual(canvas.text[3], b'* [long line 960-100')
+        self.assertEqual(canvas.cursor, (0, 3))
+        widget.keypress(size, 'left')
+        widget.keypress(size, 'left')
+        widget.keypress(size, 'x')
+        canvas = widget.render(size, focus=True)
+        self.assertEqual(widget.body.code[1][-4:], u'x89\n')
+        self.assertEqual(canvas.text[2], b'012345678901234567x8')
+        self.assertEqual(canvas.cursor, (19, 2))
+        # Going back before the part shows the part before it
+        for i in range(40):
+            widget.keypress(size, 'left')
+        canvas = widget.render(size, focus=True)
+        self.assertEqual(widget.get_cursor_position(), (1, 959))
+        self.assertEqual(canvas.text[3], b'01234567890123456789')
+        self.assertEqual(canvas.text[4], b' [long line 900-960 ')
+        self.assertEqual(canvas.cursor, (19, 3))
+
+    def test_long_line_disabled(self):
+        text = u'0123456789' * 100
+        config = urwid.EditorConfig(newline='*', long_line_length=None)
+        widget = urwid.TextEditor(code.Code(io.StringIO(text)), config)
+        canvas = widget.render((20, 60), focus=True)
+        self.assertEqual(canvas.text[49], b'01234567890123456789')
+        self.assertNotIn(b'long line', b''.join(canvas.text))